@@ -0,0 +1,359 @@
+import io
+import os
+import socket
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ConversionJob
+from .utils.dataset_cache import load_dataset
+from .utils.delta import DELTA_FORMATS, diff_tables, frame_rows, iter_delta_script
+from .utils.duplicates import frame_chunks
+from .utils.file_parser import iter_sheets
+from .utils.script_generator import (
+    OUTPUT_FORMATS, block_size, format_options, iter_script, iter_script_chunks, sheet_identifier,
+)
+from .utils.streaming import STREAM_CHUNK_ROWS, sheet_stream, streaming_enabled
+from .utils.timing import span
+
+DOWNLOAD_PATH = os.path.join(settings.BASE_DIR, 'converter', 'downloads')
+
+
+class QueueFull(Exception):
+    """Raised when the conversion queue already holds CONVERTER_JOB_QUEUE_DEPTH jobs."""
+
+
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+_worker_id = None
+_worker_pid = None
+
+ACTIVE_STATUSES = [ConversionJob.STATUS_QUEUED, ConversionJob.STATUS_RUNNING]
+
+
+def worker_id():
+    """
+    Identifies this process as the owner of the jobs it queues. A forked process
+    gets its own id.
+    """
+    global _worker_id, _worker_pid
+    with _lock:
+        if _worker_pid != os.getpid():
+            _worker_pid = os.getpid()
+            _worker_id = f"{socket.gethostname()}:{_worker_pid}:{uuid.uuid4().hex[:8]}"
+        return _worker_id
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'CONVERTER_JOB_WORKERS', 2),
+            thread_name_prefix='conversion',
+        )
+        threading.Thread(target=_heartbeat, name='conversion-heartbeat', daemon=True).start()
+    return _executor
+
+
+def _heartbeat():
+    """
+    Marks the jobs this process owns as alive every CONVERTER_JOB_HEARTBEAT seconds,
+    and fails the jobs of processes that stopped doing so.
+    """
+    owner = worker_id()
+    while True:
+        close_old_connections()
+        try:
+            ConversionJob.objects.filter(owner=owner, status__in=ACTIVE_STATUSES).update(heartbeat_at=timezone.now())
+            recover_interrupted_jobs()
+        except Exception as e:
+            print(f"Conversion job heartbeat failed: {e}", flush=True)
+        finally:
+            connection.close()
+        time.sleep(getattr(settings, 'CONVERTER_JOB_HEARTBEAT', 30))
+
+
+def recover_interrupted_jobs():
+    """
+    Fails the queued or running jobs whose owning process has sent no heartbeat for
+    CONVERTER_JOB_STALE_AFTER seconds, as it was stopped or crashed. Jobs of live
+    processes, on this host or others, are left alone. Returns the number failed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'CONVERTER_JOB_STALE_AFTER', 120))
+    stale = ConversionJob.objects.filter(status__in=ACTIVE_STATUSES).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True)
+    )
+    return stale.update(status=ConversionJob.STATUS_FAILED, error='Interrupted by a server restart.',
+                        finished_at=timezone.now())
+
+
+def enqueue_conversion(uploaded, output_format, table_name=None, sheet_name=None, options=None,
+                       all_sheets=False, sheet_tables=None, base_file=None, key_columns=None):
+    """
+    Creates a ConversionJob and hands it to the local worker pool.
+    With `all_sheets`, every sheet is converted into one zip; `sheet_tables` maps
+    sheet names to table/model names, defaulting to names derived from the sheets.
+    With `base_file`, only the changes since that earlier upload are written, as
+    DELETE, UPDATE and INSERT statements matching rows on `key_columns`.
+    If the same content was already converted the same way, the job is created
+    finished, sharing the earlier output.
+    Raises QueueFull when too many jobs are already waiting or running.
+    """
+    global _pending
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if base_file is not None:
+        if output_format not in DELTA_FORMATS or all_sheets:
+            raise ValueError("Changes-only scripts are available for single-sheet SQL output.")
+        if not key_columns:
+            raise ValueError("Choose the key columns that identify a row.")
+
+    fields = dict(
+        uploaded_file=uploaded,
+        output_format=output_format,
+        table_name=table_name or OUTPUT_FORMATS[output_format]['default_name'] or '',
+        sheet_name=sheet_name,
+        options=format_options(output_format, options),
+        all_sheets=all_sheets,
+        sheet_tables={sheet: name for sheet, name in (sheet_tables or {}).items() if name},
+        base_file=base_file,
+        key_columns=list(key_columns or []) if base_file is not None else [],
+    )
+    # The same conversion of the same content is served from the earlier output
+    previous = _previous_output(**fields)
+    if previous is not None:
+        now = timezone.now()
+        return ConversionJob.objects.create(
+            **fields, status=ConversionJob.STATUS_DONE, output_filename=previous.output_filename,
+            rows_total=previous.rows_total, rows_processed=previous.rows_processed,
+            started_at=now, finished_at=now,
+        )
+
+    with _lock:
+        executor = _get_executor()
+        if _pending >= getattr(settings, 'CONVERTER_JOB_QUEUE_DEPTH', 20):
+            raise QueueFull()
+        _pending += 1
+
+    job = None
+    try:
+        job = ConversionJob.objects.create(**fields, owner=worker_id(), heartbeat_at=timezone.now())
+        executor.submit(_run_job, job.id)
+    except Exception:
+        # The job never reached a worker, so its slot is given back here
+        with _lock:
+            _pending -= 1
+        if job is not None:
+            ConversionJob.objects.filter(id=job.id).update(status=ConversionJob.STATUS_FAILED,
+                                                           error='Could not be queued.', finished_at=timezone.now())
+        raise
+    return job
+
+
+def _previous_output(uploaded_file, output_format, table_name, sheet_name, options, all_sheets, sheet_tables,
+                     base_file, key_columns):
+    """
+    Returns the latest finished job that converted the same content with the same
+    sheet, format, name and options (and for a delta, against the same earlier
+    content) and whose output is still on disk, or None.
+    """
+    if not uploaded_file.content_hash or (base_file is not None and not base_file.content_hash):
+        return None
+    candidates = ConversionJob.objects.filter(
+        uploaded_file__content_hash=uploaded_file.content_hash, status=ConversionJob.STATUS_DONE,
+        output_format=output_format, table_name=table_name, sheet_name=sheet_name, all_sheets=all_sheets,
+    ).order_by('-finished_at')
+    if base_file is None:
+        candidates = candidates.filter(base_file__isnull=True)
+    else:
+        candidates = candidates.filter(base_file__content_hash=base_file.content_hash,
+                                       base_file__sheet_name=base_file.sheet_name)
+    for job in candidates:
+        if job.options == options and job.sheet_tables == sheet_tables and job.key_columns == key_columns \
+                and os.path.exists(os.path.join(DOWNLOAD_PATH, job.output_filename)):
+            return job
+    return None
+
+
+def _run_job(job_id):
+    global _pending
+    close_old_connections()
+    try:
+        run_conversion(ConversionJob.objects.get(id=job_id))
+    finally:
+        with _lock:
+            _pending -= 1
+        connection.close()
+
+
+def run_conversion(job):
+    """
+    Runs a conversion job to completion, recording progress on the job as it goes.
+    """
+    job.status = ConversionJob.STATUS_RUNNING
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    spec = OUTPUT_FORMATS[job.output_format]
+    extension = 'zip' if job.all_sheets else spec['extension']
+    filename = f"migration_output_{job.uploaded_file_id}_{job.id}.{extension}"
+    file_save_path = os.path.join(DOWNLOAD_PATH, filename)
+    partial_path = file_save_path + '.part'
+    try:
+        os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+        # Write to a temporary name so a half-written script is never served
+        with span('generate', format=job.output_format, job=job.id) as timing:
+            stream = _open_stream(job)
+            if job.base_file_id:
+                rows = _write_delta(job, partial_path)
+            elif job.all_sheets:
+                rows = _write_bundle(job, partial_path, stream)
+            elif stream is not None:
+                ConversionJob.objects.filter(id=job.id).update(rows_total=stream.rows)
+                with open(partial_path, 'w', encoding='utf-8') as f:
+                    _write_stream(job, stream, job.table_name, f)
+                rows = stream.rows
+            else:
+                df = load_dataset(job.uploaded_file, sheet_name=job.sheet_name, trim_whitespace=True)
+                if df is None:
+                    raise ValueError("Failed to parse file.")
+                ConversionJob.objects.filter(id=job.id).update(rows_total=len(df))
+                with open(partial_path, 'w', encoding='utf-8') as f:
+                    _write_script(job, df, job.table_name, f)
+                rows = len(df)
+            timing.add(rows=rows, nbytes=os.path.getsize(partial_path))
+        os.replace(partial_path, file_save_path)
+
+        job.refresh_from_db()
+        job.status = ConversionJob.STATUS_DONE
+        job.output_filename = filename
+        job.error = ''
+    except Exception as e:
+        print(f"Conversion job {job.id} failed: {e}", flush=True)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        job.refresh_from_db()
+        job.status = ConversionJob.STATUS_FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def _open_stream(job):
+    """
+    Returns a CsvStream for a job over a CSV too large to load whole, or None to
+    convert from the in-memory dataset. Chunks hold whole partitions, as in iter_script.
+    """
+    uploaded = job.uploaded_file
+    if job.base_file_id or not streaming_enabled(uploaded):
+        return None
+    chunk_size = block_size(getattr(settings, 'CONVERTER_PARTITION_ROWS', 10000), job.options)
+    return sheet_stream(uploaded, chunk_size=chunk_size)
+
+
+def _write_script(job, df, name, f, rows_before=0):
+    for rows_done, text in iter_script(
+        df, job.output_format, name,
+        chunk_size=getattr(settings, 'CONVERTER_PARTITION_ROWS', 10000),
+        workers=getattr(settings, 'CONVERTER_GENERATION_WORKERS', 1),
+        parallel_min_rows=getattr(settings, 'CONVERTER_PARALLEL_MIN_ROWS', 50000),
+        options=job.options,
+    ):
+        f.write(text)
+        ConversionJob.objects.filter(id=job.id).update(rows_processed=rows_before + rows_done)
+
+
+def _write_stream(job, stream, name, f):
+    # Streams are far above CONVERTER_PARALLEL_MIN_ROWS, so they always use the pool
+    for rows_done, text in iter_script_chunks(
+        stream.chunks(), stream.rows, job.output_format, name,
+        workers=getattr(settings, 'CONVERTER_GENERATION_WORKERS', 1),
+        options=job.options,
+    ):
+        f.write(text)
+        ConversionJob.objects.filter(id=job.id).update(rows_processed=rows_done)
+
+
+def _write_bundle(job, path, stream=None):
+    """
+    Converts every sheet of the job's file into its own entry of a zip archive.
+    The workbook is opened once and sheets are parsed and written one at a time,
+    so only one sheet is in memory and entries are compressed as they are written.
+    A large CSV is read through `stream` instead. Returns the number of rows converted.
+    """
+    uploaded = job.uploaded_file
+    sheets = uploaded.sheet_names()
+    extension = OUTPUT_FORMATS[job.output_format]['extension']
+    row_counts = [sheet.row_count for sheet in uploaded.sheets.all()]
+    if None not in row_counts:
+        ConversionJob.objects.filter(id=job.id).update(rows_total=sum(row_counts))
+
+    rows = 0
+    entries = set()
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        if stream is not None:
+            sources = [('', stream)]
+        else:
+            sources = iter_sheets(uploaded.file.path, sheets, trim_whitespace=True,
+                                  optimize=getattr(settings, 'CONVERTER_OPTIMIZE_DTYPES', True),
+                                  **uploaded.parse_options())
+        for sheet_name, source in sources:
+            name = job.sheet_tables.get(sheet_name) or sheet_identifier(sheet_name, job.output_format)
+            entry = f"{name}.{extension}"
+            suffix = 1
+            while entry in entries:
+                suffix += 1
+                entry = f"{name}_{suffix}.{extension}"
+            entries.add(entry)
+
+            with io.TextIOWrapper(bundle.open(entry, 'w', force_zip64=True), encoding='utf-8') as f:
+                if stream is not None:
+                    _write_stream(job, source, name, f)
+                    rows += source.rows
+                else:
+                    _write_script(job, source, name, f, rows_before=rows)
+                    rows += len(source)
+    return rows
+
+
+def _delta_source(uploaded, sheet_name):
+    """
+    Returns (chunks, fetch_rows, chunk_size) for one side of a delta: a large CSV is
+    read through a stream, anything else from the in-memory dataset.
+    """
+    if streaming_enabled(uploaded):
+        stream = sheet_stream(uploaded)
+        if stream is not None:
+            # Each fetch parses from the indexed row before it, so rows are fetched in large batches
+            return stream.chunks, stream.read_rows, STREAM_CHUNK_ROWS
+    df = load_dataset(uploaded, sheet_name=sheet_name, trim_whitespace=True)
+    if df is None:
+        raise ValueError("Failed to parse file.")
+    return frame_chunks(df), frame_rows(df), getattr(settings, 'CONVERTER_PARTITION_ROWS', 10000)
+
+
+def _write_delta(job, path):
+    """
+    Writes the changes between the job's base upload and its upload as SQL.
+    Progress counts statements rather than rows. Returns the number of changes.
+    """
+    new_chunks, new_rows, chunk_size = _delta_source(job.uploaded_file, job.sheet_name)
+    old_chunks, old_rows, old_chunk_size = _delta_source(job.base_file, job.base_file.sheet_name or None)
+    delta = diff_tables(old_chunks, new_chunks, job.key_columns, job.options.get('dialect', 'generic'))
+    ConversionJob.objects.filter(id=job.id).update(rows_total=delta.changes)
+    with open(path, 'w', encoding='utf-8') as f:
+        for changes_done, text in iter_delta_script(delta, old_rows, new_rows, job.table_name, job.options,
+                                                    chunk_size=max(chunk_size, old_chunk_size)):
+            f.write(text)
+            ConversionJob.objects.filter(id=job.id).update(rows_processed=changes_done)
+    return delta.changes
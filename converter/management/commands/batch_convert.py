@@ -0,0 +1,100 @@
+import json
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.utils.batch import batch_settings, expand_inputs, run_batch
+from converter.utils.script_generator import OUTPUT_FORMATS, SQL_DIALECTS
+
+
+def _csv_list(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = ("Validates and converts a set of CSV/Excel files into scripts without going through "
+            "the web app, one file per worker process. Files whose outputs are up to date are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('inputs', nargs='+',
+                            help="Input files, directories or glob patterns (quote them; ** matches subdirectories).")
+        parser.add_argument('--output-dir', required=True, help="Where the scripts are written.")
+        parser.add_argument('--format', default='sql', choices=list(OUTPUT_FORMATS))
+        parser.add_argument('--table-name',
+                            help="Table/model name for every file; by default derived from each file (or sheet) name.")
+        parser.add_argument('--sheet', help="Sheet to convert in each workbook; the first sheet by default.")
+        parser.add_argument('--all-sheets', action='store_true',
+                            help="Convert every sheet of each workbook into its own script.")
+        parser.add_argument('--required', default='', help="Comma-separated columns that must not be blank.")
+        parser.add_argument('--unique', default='', help="Comma-separated columns whose values must not repeat.")
+        parser.add_argument('--allow-errors', action='store_true',
+                            help="Write scripts even for sheets with rows failing validation.")
+        parser.add_argument('--dialect', choices=[value for value, _ in SQL_DIALECTS])
+        parser.add_argument('--batch-size', type=int, help="Rows per multi-row INSERT or bulk_create call.")
+        parser.add_argument('--column-list', action='store_true', default=None,
+                            help="Name the target columns in INSERT statements.")
+        parser.add_argument('--transaction', action='store_true', default=None,
+                            help="Wrap SQL output in BEGIN/COMMIT.")
+        parser.add_argument('--no-atomic', dest='atomic', action='store_false', default=None,
+                            help="Do not wrap bulk_create output in transaction.atomic().")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Files converted in parallel.")
+        parser.add_argument('--force', action='store_true', help="Convert every file, even if up to date.")
+        parser.add_argument('--summary',
+                            help="Write the per-file summary as JSON here (default: batch_summary.json in the output dir).")
+
+    def handle(self, *args, **options):
+        if options['sheet'] and options['all_sheets']:
+            raise CommandError("Use either --sheet or --all-sheets.")
+        inputs = expand_inputs(options['inputs'])
+        if not inputs:
+            raise CommandError("No .csv, .xls or .xlsx files match the given inputs.")
+        # Outputs are named after the input files, so two inputs must not share a name
+        stems = Counter(os.path.splitext(os.path.basename(path))[0] for path in inputs)
+        clashes = sorted(stem for stem, count in stems.items() if count > 1)
+        if clashes:
+            raise CommandError(f"Several inputs would write the same output: {', '.join(clashes)}")
+
+        script_options = {
+            name: options[name] for name in ('dialect', 'batch_size', 'column_list', 'transaction', 'atomic')
+            if options[name] is not None
+        }
+        if 'batch_size' in script_options:
+            script_options['batch_size'] = max(script_options['batch_size'], 1)
+        batch = batch_settings(
+            options['format'], table_name=options['table_name'], sheet=options['sheet'],
+            all_sheets=options['all_sheets'], options=script_options,
+            required_columns=_csv_list(options['required']), unique_columns=_csv_list(options['unique']),
+            allow_errors=options['allow_errors'],
+        )
+
+        def log(summary):
+            name = os.path.basename(summary['input'])
+            if summary['status'] == 'skipped':
+                self.stdout.write(f"{name:<32} skipped (up to date)")
+                return
+            seconds = summary['seconds']
+            line = (f"{name:<32} {summary['status']:<8} {summary['rows']:>10} rows {summary['error_rows']:>8} errors "
+                    f"{seconds['parse']:8.2f} {seconds['validate']:8.2f} {seconds['generate']:8.2f} s")
+            if summary['status'] == 'failed':
+                self.stdout.write(self.style.ERROR(f"{line}  {summary['error']}"))
+            elif summary['status'] == 'invalid':
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+
+        self.stdout.write(f"Converting {len(inputs)} file(s) with {max(options['workers'], 1)} worker(s)")
+        self.stdout.write(f"{'file':<32} {'status':<8} {'':>15} {'':>15} {'parse':>8} {'validate':>8} {'generate':>8}")
+        summaries = run_batch(inputs, options['output_dir'], batch, workers=max(options['workers'], 1),
+                              force=options['force'], log=log)
+
+        summary_path = options['summary'] or os.path.join(options['output_dir'], 'batch_summary.json')
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump({'settings': batch, 'files': summaries}, f, indent=2)
+
+        counts = Counter(summary['status'] for summary in summaries)
+        totals = ', '.join(f"{count} {status}" for status, count in sorted(counts.items()))
+        self.stdout.write(self.style.SUCCESS(f"{totals}. Summary written to {summary_path}"))
+        if counts['failed']:
+            raise CommandError(f"{counts['failed']} file(s) failed to convert.")
@@ -0,0 +1,115 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.utils.benchmark import (
+    BENCHMARK_FILE_TYPES, BENCHMARK_OUTPUT_FORMATS, BENCHMARK_SCALES, BENCHMARK_SHAPES,
+    REGRESSION_TOLERANCE, benchmark_report, compare_results, load_report, run_benchmarks,
+)
+from converter.utils.script_generator import OUTPUT_FORMATS
+
+
+def _parse_scale(value):
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith('k'):
+        value, multiplier = value[:-1], 1000
+    elif value.endswith('m'):
+        value, multiplier = value[:-1], 1000000
+    return int(float(value) * multiplier)
+
+
+def _csv_list(value, allowed=None):
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    if allowed is not None:
+        unknown = [item for item in items if item not in allowed]
+        if unknown:
+            raise CommandError(f"Unknown value(s): {', '.join(unknown)}. Choose from: {', '.join(allowed)}")
+    return items
+
+
+class Command(BaseCommand):
+    help = ("Times the parse, validate and generate stages on synthetic CSV/XLSX datasets "
+            "and optionally compares the results with a stored baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default=','.join(str(s) for s in BENCHMARK_SCALES[:2]),
+                            help="Comma-separated row counts, e.g. 10k,100k,1M.")
+        parser.add_argument('--shapes', default=','.join(BENCHMARK_SHAPES),
+                            help="Comma-separated dataset shapes: narrow, wide, mixed.")
+        parser.add_argument('--file-types', default=','.join(BENCHMARK_FILE_TYPES),
+                            help="Comma-separated input file types: csv, xlsx.")
+        parser.add_argument('--formats', default=','.join(BENCHMARK_OUTPUT_FORMATS),
+                            help="Comma-separated output formats to generate.")
+        parser.add_argument('--repeat', type=int, default=1,
+                            help="Runs per stage; the fastest run is reported.")
+        parser.add_argument('--no-memory', action='store_true',
+                            help="Skip the tracemalloc run used to record peak memory.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--data-dir',
+                            default=os.path.join(settings.BASE_DIR, 'converter', 'benchmarks', 'data'),
+                            help="Where generated datasets are kept between runs.")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--baseline', help="Compare with a JSON report from an earlier run.")
+        parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                            help="Allowed slowdown before a stage counts as a regression (0.2 = 20%%).")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error if any stage regressed against the baseline.")
+
+    def handle(self, *args, **options):
+        try:
+            scales = [_parse_scale(s) for s in _csv_list(options['scales'])]
+        except ValueError:
+            raise CommandError(f"Invalid --scales value: {options['scales']}")
+        shapes = _csv_list(options['shapes'], BENCHMARK_SHAPES)
+        file_types = _csv_list(options['file_types'], BENCHMARK_FILE_TYPES)
+        output_formats = _csv_list(options['formats'], list(OUTPUT_FORMATS))
+
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = load_report(options['baseline'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline: {e}")
+
+        def log(result):
+            if result.get('skipped'):
+                self.stdout.write(f"{result['dataset']:<24} {result['stage']:<22} skipped ({result['skipped']})")
+                return
+            peak = '' if result['peak_bytes'] is None else f"{result['peak_bytes'] / 1024 / 1024:10.1f} MB"
+            self.stdout.write(f"{result['dataset']:<24} {result['stage']:<22} {result['seconds']:10.3f} s {peak}")
+
+        results = run_benchmarks(
+            options['data_dir'], scales=scales, shapes=shapes, file_types=file_types,
+            output_formats=output_formats, repeat=options['repeat'],
+            memory=not options['no_memory'], seed=options['seed'], log=log,
+        )
+        report = benchmark_report(
+            results, scales=scales, shapes=shapes, file_types=file_types,
+            output_formats=output_formats, repeat=options['repeat'], seed=options['seed'],
+        )
+
+        regressions = []
+        if baseline is not None:
+            report['baseline'] = {'path': options['baseline'], 'created_at': baseline.get('created_at')}
+            report['comparison'] = compare_results(results, baseline.get('results', []), options['tolerance'])
+            regressions = [c for c in report['comparison'] if c['regression']]
+            self.stdout.write('')
+            for c in report['comparison']:
+                line = f"{c['dataset']:<24} {c['stage']:<22} x{c['time_ratio']:.2f} time"
+                if c['memory_ratio'] is not None:
+                    line += f"  x{c['memory_ratio']:.2f} memory"
+                self.stdout.write(self.style.ERROR(line) if c['regression'] else line)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+        if regressions:
+            message = f"{len(regressions)} stage(s) regressed by more than {options['tolerance']:.0%}"
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
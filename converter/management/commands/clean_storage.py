@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from converter.retention import enforce_retention
+
+
+def _size(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{num_bytes} B"
+        num_bytes /= 1024
+
+
+class Command(BaseCommand):
+    help = ("Deletes stored uploads and generated scripts that are past their TTL, least "
+            "recently used first until each area fits its quota (CONVERTER_*_MAX_BYTES / _TTL_DAYS).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="List what would be deleted without deleting anything.")
+        parser.add_argument('--verbose-paths', action='store_true',
+                            help="Print every file deleted (or that would be).")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        report = enforce_retention(dry_run=dry_run)
+        verb = "would free" if dry_run else "freed"
+        for area, stats in report.items():
+            self.stdout.write(
+                f"{area:<10} {stats['files']:>6} files {_size(stats['bytes']):>10}   "
+                f"{stats['evicted']:>6} evicted, {verb} {_size(stats['freed_bytes'])}"
+            )
+            if options['verbose_paths']:
+                for path in stats['evicted_paths']:
+                    self.stdout.write(f"    {path}")
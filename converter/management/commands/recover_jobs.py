@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from converter.jobs import recover_interrupted_jobs
+
+
+class Command(BaseCommand):
+    help = ("Fails conversion jobs left queued or running by a stopped server process, "
+            "i.e. without a heartbeat for CONVERTER_JOB_STALE_AFTER seconds. Run at startup.")
+
+    def handle(self, *args, **options):
+        count = recover_interrupted_jobs()
+        self.stdout.write(f"{count} interrupted job(s) marked as failed.")
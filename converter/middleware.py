@@ -0,0 +1,55 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from .utils.timing import finish_request, metrics, start_request, timing_enabled
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header listing the stages timed while handling the request,
+    plus the total, and counts requests per view and status for the metrics endpoint.
+    Removes itself at startup when CONVERTER_TIMING_ENABLED is off.
+    Works both ways, so under ASGI it does not force async views onto a single thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not timing_enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            header = finish_request(token)
+        return self._finish(request, response, header, start)
+
+    async def __acall__(self, request):
+        token = start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            header = finish_request(token)
+        return self._finish(request, response, header, start)
+
+    def _finish(self, request, response, header, start):
+        total_ms = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        metrics.record_request(match.url_name if match else None, response.status_code)
+        metrics.observe('request', total_ms)
+
+        header = f"{header}, total;dur={total_ms:.1f}" if header else f"total;dur={total_ms:.1f}"
+        response['Server-Timing'] = header
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='SheetMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('row_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('column_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('columns', models.JSONField(default=list)),
+                ('uploaded_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sheets', to='converter.uploadedfile')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+    ]
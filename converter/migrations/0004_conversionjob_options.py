@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0003_conversionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversionjob',
+            name='options',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
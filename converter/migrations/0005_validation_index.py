@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0004_conversionjob_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sheet_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('required_columns', models.JSONField(default=list)),
+                ('unique_columns', models.JSONField(default=list)),
+                ('columns', models.JSONField(default=list)),
+                ('column_types', models.JSONField(default=dict)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('error_row_count', models.PositiveIntegerField(default=0)),
+                ('column_error_counts', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('uploaded_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='validation_runs', to='converter.uploadedfile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ValidationIssue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.PositiveIntegerField()),
+                ('column', models.CharField(max_length=255)),
+                ('rule', models.CharField(max_length=50)),
+                ('message', models.CharField(max_length=255)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='issues', to='converter.validationrun')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['run', 'row'], name='converter_v_run_id_3c0d40_idx')],
+            },
+        ),
+    ]
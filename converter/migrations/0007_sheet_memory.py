@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0006_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sheetmetadata',
+            name='memory_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sheetmetadata',
+            name='optimized_memory_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
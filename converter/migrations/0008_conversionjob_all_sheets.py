@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0007_sheet_memory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversionjob',
+            name='all_sheets',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='conversionjob',
+            name='sheet_tables',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0008_conversionjob_all_sheets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sheetmetadata',
+            name='stream_schema',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
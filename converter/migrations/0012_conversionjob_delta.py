@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0011_storage_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversionjob',
+            name='base_file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='delta_jobs', to='converter.uploadedfile'),
+        ),
+        migrations.AddField(
+            model_name='conversionjob',
+            name='key_columns',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
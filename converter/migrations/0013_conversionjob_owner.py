@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0012_conversionjob_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversionjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversionjob',
+            name='owner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
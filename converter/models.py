@@ -1,6 +1,278 @@
+import datetime
+import os
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
+# Accesses closer together than this are recorded once, so scrolling or polling does not write on every request
+TOUCH_INTERVAL = datetime.timedelta(minutes=1)
+
+
+def _touch(instance):
+    now = timezone.now()
+    if instance.last_accessed_at is None or now - instance.last_accessed_at > TOUCH_INTERVAL:
+        instance.last_accessed_at = now
+        type(instance).objects.filter(pk=instance.pk).update(last_accessed_at=now)
+
 
 class UploadedFile(models.Model):
     file = models.FileField(upload_to='uploads/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     sheet_name = models.CharField(max_length=255, blank=True, null=True)  # for Excel
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)  # sha256 of the file
+    delimiter = models.CharField(max_length=5, blank=True, default='')  # sniffed CSV delimiter
+    encoding = models.CharField(max_length=20, blank=True, default='')  # sniffed CSV encoding
+    # Last preview, validation or conversion of the upload; drives storage retention
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+
+    def parse_options(self):
+        """
+        Returns the sniffed CSV settings to pass on to parse_file.
+        """
+        return {key: value for key, value in
+                (('delimiter', self.delimiter), ('encoding', self.encoding)) if value}
+
+    def record_metadata(self, content_hash=None):
+        """
+        Reads the file once and stores its content hash and per-sheet dimensions,
+        so later requests never have to reopen the workbook for them. A hash already
+        computed while the file was received can be passed in to skip rehashing.
+        """
+        from .utils.file_parser import extract_file_metadata
+
+        metadata = extract_file_metadata(self.file.path, content_hash=content_hash, **self.parse_options())
+        self.content_hash = metadata['content_hash']
+        # A sniffed CSV delimiter and encoding are kept so every later parse uses them
+        self.delimiter = metadata.get('delimiter', self.delimiter)
+        self.encoding = metadata.get('encoding', self.encoding)
+        self.save(update_fields=['content_hash', 'delimiter', 'encoding'])
+        self.sheets.all().delete()
+        SheetMetadata.objects.bulk_create([
+            SheetMetadata(uploaded_file=self, position=position, **sheet)
+            for position, sheet in enumerate(metadata['sheets'])
+        ])
+
+    @classmethod
+    def find_stored(cls, content_hash):
+        """
+        Returns the earliest upload with this content whose file is still stored and
+        whose metadata is recorded, or None.
+        """
+        for candidate in cls.objects.filter(content_hash=content_hash).order_by('id'):
+            if candidate.file and os.path.exists(candidate.file.path) and candidate.sheets.exists():
+                return candidate
+        return None
+
+    def share(self):
+        """
+        Creates a new upload of the same content that points at this upload's stored
+        file and starts with a copy of its metadata, so nothing is stored or read again.
+        """
+        copy = UploadedFile.objects.create(
+            file=self.file.name, content_hash=self.content_hash,
+            delimiter=self.delimiter, encoding=self.encoding,
+        )
+        fields = [f.name for f in SheetMetadata._meta.concrete_fields if f.name not in ('id', 'uploaded_file')]
+        SheetMetadata.objects.bulk_create([
+            SheetMetadata(uploaded_file=copy, **{name: getattr(sheet, name) for name in fields})
+            for sheet in self.sheets.all()
+        ])
+        return copy
+
+    def touch(self):
+        """
+        Records an access for storage retention. Repeated accesses within
+        TOUCH_INTERVAL are not written again.
+        """
+        _touch(self)
+
+    def ensure_metadata(self):
+        # Uploads made before metadata was recorded get it on first use
+        if not self.content_hash:
+            self.record_metadata()
+
+    def sheet_names(self):
+        """
+        Returns the workbook's sheet names in order, or an empty list for CSV.
+        """
+        self.ensure_metadata()
+        return [sheet.name for sheet in self.sheets.all() if sheet.name]
+
+    def get_sheet(self, sheet_name=None):
+        """
+        Returns the SheetMetadata for a sheet (the first one if no name is given), or None.
+        """
+        self.ensure_metadata()
+        sheets = list(self.sheets.all())
+        if sheet_name:
+            sheets = [sheet for sheet in sheets if sheet.name == sheet_name]
+        return sheets[0] if sheets else None
+
+
+class SheetMetadata(models.Model):
+    uploaded_file = models.ForeignKey(UploadedFile, related_name='sheets', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255, blank=True)  # blank for CSV
+    position = models.PositiveIntegerField(default=0)
+    row_count = models.PositiveIntegerField(null=True, blank=True)  # data rows, excluding the header
+    column_count = models.PositiveIntegerField(null=True, blank=True)
+    columns = models.JSONField(default=list)
+    # In-memory size of the fully parsed sheet, as read and after dtype optimization;
+    # measured the first time the whole sheet is loaded
+    memory_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    optimized_memory_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    # Column dtypes and row count settled by the first chunked read of a large CSV,
+    # {'dtypes': None} if it cannot be streamed; null until then
+    stream_schema = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['position']
+
+    def memory_saving(self):
+        """
+        Returns the share of memory saved by dtype optimization (0-100), or None if not measured.
+        """
+        if not self.memory_bytes or self.optimized_memory_bytes is None:
+            return None
+        return round(100 * (1 - self.optimized_memory_bytes / self.memory_bytes))
+
+
+class ConversionJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_EXPIRED = 'expired'  # done, but the output was removed by storage retention
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_EXPIRED, 'Expired'),
+    ]
+
+    uploaded_file = models.ForeignKey(UploadedFile, related_name='jobs', on_delete=models.CASCADE)
+    output_format = models.CharField(max_length=20)
+    table_name = models.CharField(max_length=255, blank=True)  # table or model name used in the script
+    sheet_name = models.CharField(max_length=255, blank=True, null=True)
+    options = models.JSONField(default=dict, blank=True)  # formatter options, e.g. batch_size
+    # Converts every sheet into one zip; sheet_tables maps sheet names to table/model names
+    all_sheets = models.BooleanField(default=False)
+    sheet_tables = models.JSONField(default=dict, blank=True)
+    # Delta scripts hold only the changes since base_file, matching rows on key_columns
+    base_file = models.ForeignKey(UploadedFile, related_name='delta_jobs', null=True, blank=True,
+                                  on_delete=models.CASCADE)
+    key_columns = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    rows_total = models.PositiveIntegerField(null=True, blank=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    output_filename = models.CharField(max_length=255, blank=True)  # relative to the downloads folder
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Last download or view of the output; drives storage retention
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+    # The process that queued the job, and when it last reported the job alive
+    owner = models.CharField(max_length=255, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED, self.STATUS_EXPIRED)
+
+    def touch(self):
+        """
+        Records an access to the job's output for storage retention.
+        """
+        _touch(self)
+
+    def eta_seconds(self):
+        """
+        Estimates the seconds left from the throughput so far, or None if unknown.
+        """
+        if self.status != self.STATUS_RUNNING or not self.started_at or not self.rows_total \
+                or not self.rows_processed:
+            return None
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        remaining = self.rows_total - self.rows_processed
+        return round(elapsed / self.rows_processed * remaining, 1)
+
+
+class ValidationRun(models.Model):
+    uploaded_file = models.ForeignKey(UploadedFile, related_name='validation_runs', on_delete=models.CASCADE)
+    sheet_name = models.CharField(max_length=255, blank=True, null=True)
+    required_columns = models.JSONField(default=list)
+    unique_columns = models.JSONField(default=list)
+    columns = models.JSONField(default=list)
+    column_types = models.JSONField(default=dict)
+    row_count = models.PositiveIntegerField(default=0)
+    error_row_count = models.PositiveIntegerField(default=0)
+    column_error_counts = models.JSONField(default=dict)  # column -> rows with an error in it
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def record(cls, uploaded_file, sheet_name, required_columns, unique_columns,
+               columns, column_types, row_count, rule_errors):
+        """
+        Persists the sparse error index produced by validator.run_rules, one
+        ValidationIssue per failing cell and rule.
+        """
+        error_rows = set()
+        column_rows = {}
+        for errors in rule_errors.values():
+            for row, row_errors in errors.items():
+                error_rows.add(row)
+                for column in row_errors:
+                    column_rows.setdefault(column, set()).add(row)
+
+        run = cls.objects.create(
+            uploaded_file=uploaded_file,
+            sheet_name=sheet_name,
+            required_columns=list(required_columns),
+            unique_columns=list(unique_columns),
+            columns=[str(column) for column in columns],
+            column_types={str(column): value for column, value in column_types.items()},
+            row_count=row_count,
+            error_row_count=len(error_rows),
+            column_error_counts={str(column): len(rows) for column, rows in column_rows.items()},
+        )
+        ValidationIssue.objects.bulk_create((
+            ValidationIssue(run=run, row=int(row), column=str(column), rule=rule, message=message)
+            for rule, errors in rule_errors.items()
+            for row, row_errors in errors.items()
+            for column, message in row_errors.items()
+        ), batch_size=5000)
+        return run
+
+
+class ValidationIssue(models.Model):
+    run = models.ForeignKey(ValidationRun, related_name='issues', on_delete=models.CASCADE)
+    row = models.PositiveIntegerField()  # 0-based data row position in the sheet
+    column = models.CharField(max_length=255)
+    rule = models.CharField(max_length=50)
+    message = models.CharField(max_length=255)
+
+    class Meta:
+        indexes = [models.Index(fields=['run', 'row'])]
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress: chunks are appended to `stored_name` until
+    `received_bytes` reaches `total_size`, then an UploadedFile is created for it.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)  # name given by the client
+    stored_name = models.CharField(max_length=255)  # storage name under MEDIA_ROOT
+    total_size = models.PositiveBigIntegerField()
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    delimiter = models.CharField(max_length=5, blank=True, default='')
+    encoding = models.CharField(max_length=20, blank=True, default='')
+    uploaded_file = models.OneToOneField(UploadedFile, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self):
+        return self.received_bytes >= self.total_size
@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse
+
+# Lanes of worker threads for the blocking part of views. Previews get their own
+# lane so they stay fast while uploads and validations of large files run.
+OFFLOAD_LANES = {
+    'preview': 'CONVERTER_PREVIEW_WORKERS',
+    'heavy': 'CONVERTER_HEAVY_WORKERS',
+}
+
+
+class _Lane:
+    """
+    A bounded thread pool plus the admission counters in front of it.
+    """
+
+    def __init__(self, name, workers):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"offload-{name}")
+        self.in_flight = 0
+        self.per_client = {}
+
+
+_lanes = {}
+_lock = threading.Lock()
+
+
+def _get_lane(name):
+    with _lock:
+        lane = _lanes.get(name)
+        if lane is None:
+            lane = _lanes[name] = _Lane(name, max(getattr(settings, OFFLOAD_LANES[name], 2), 1))
+        return lane
+
+
+def client_address(request):
+    """
+    Returns the address of the client behind a request. When it comes from one of
+    CONVERTER_TRUSTED_PROXIES, the address is taken from X-Forwarded-For: the last
+    one there not added by a trusted proxy, since clients can forge the others.
+    """
+    trusted = set(getattr(settings, 'CONVERTER_TRUSTED_PROXIES', ()))
+    address = request.META.get('REMOTE_ADDR', '')
+    if address not in trusted:
+        return address
+    forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if hop not in trusted:
+            break
+    return address
+
+
+def client_key(request):
+    """
+    Identifies who a request counts against: the signed-in user, else the session,
+    else the client address (see client_address).
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f"session:{session.session_key}"
+    return f"addr:{client_address(request)}"
+
+
+def _admit(lane, client):
+    """
+    Counts a request in if the lane's queue and the client's share have room.
+    Returns False if it should be turned away.
+    """
+    per_client = getattr(settings, 'CONVERTER_CLIENT_CONCURRENCY', 2)
+    queue_depth = getattr(settings, 'CONVERTER_OFFLOAD_QUEUE_DEPTH', 4)
+    with _lock:
+        if lane.in_flight >= lane.workers * (1 + queue_depth):
+            return False
+        if per_client and lane.per_client.get(client, 0) >= per_client:
+            return False
+        lane.in_flight += 1
+        lane.per_client[client] = lane.per_client.get(client, 0) + 1
+    return True
+
+
+def _release(lane, client):
+    with _lock:
+        lane.in_flight -= 1
+        lane.per_client[client] -= 1
+        if not lane.per_client[client]:
+            del lane.per_client[client]
+
+
+def _busy_response(json):
+    message = "Too many requests are in progress. Please try again shortly."
+    response = JsonResponse({'error': message}, status=429) if json else HttpResponse(message, status=429)
+    response['Retry-After'] = str(getattr(settings, 'CONVERTER_OFFLOAD_RETRY_AFTER', 5))
+    return response
+
+
+def _run_view(view, request, args, kwargs):
+    # Worker threads outlive requests, so stale connections are dropped as Django does per request
+    close_old_connections()
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def offloaded(lane_name, json=False):
+    """
+    Turns a blocking view into an async view that runs it on a bounded thread pool,
+    so pandas work never blocks the event loop under ASGI. Requests beyond the
+    lane's queue, or beyond CONVERTER_CLIENT_CONCURRENCY in progress for one client,
+    get a 429 with Retry-After (as JSON when `json` is set).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            lane = _get_lane(lane_name)
+            # Resolving request.user may query the database, which is not allowed on the event loop
+            client = await sync_to_async(client_key)(request)
+            if not _admit(lane, client):
+                return _busy_response(json)
+            try:
+                # The context carries the request's timing spans into the worker thread
+                context = contextvars.copy_context()
+                future = lane.executor.submit(context.run, _run_view, view, request, args, kwargs)
+            except BaseException:
+                _release(lane, client)
+                raise
+            # Released when the work ends, not when the client goes away, so the counts match busy threads
+            future.add_done_callback(lambda _: _release(lane, client))
+            return await asyncio.wrap_future(future)
+        return wrapper
+    return decorator
+
+
+def offload_stats():
+    """
+    Returns the in-flight requests and distinct clients per lane.
+    """
+    with _lock:
+        return {name: {'workers': lane.workers, 'in_flight': lane.in_flight, 'clients': len(lane.per_client)}
+                for name, lane in _lanes.items()}
@@ -0,0 +1,260 @@
+import datetime
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection
+from django.db.models import Max, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .jobs import DOWNLOAD_PATH
+from .models import ConversionJob, UploadedFile, UploadSession
+from .utils.dataset_cache import get_dataset_cache
+from .utils.timing import span
+
+# Jobs holding these statuses still need their upload's file
+_ACTIVE_STATUSES = (ConversionJob.STATUS_QUEUED, ConversionJob.STATUS_RUNNING)
+
+
+class Artifact:
+    """
+    One stored file and the database rows that depend on it.
+    """
+
+    def __init__(self, path, last_access, delete, in_use=False):
+        self.path = path
+        self.last_access = last_access
+        self.delete = delete  # removes the rows, then the file
+        self.in_use = in_use
+        try:
+            self.size = os.path.getsize(path)
+        except OSError:
+            self.size = 0
+
+
+def _mtime(path):
+    return datetime.datetime.fromtimestamp(os.path.getmtime(path), tz=datetime.timezone.utc)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _listing(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, name))]
+
+
+def upload_artifacts():
+    """
+    Lists the stored uploads. Repeated uploads of the same content share one file,
+    which was last accessed when any of them was. Unfinished chunked uploads and
+    files no row refers to are listed too.
+    """
+    blobs = (UploadedFile.objects.values('file')
+             .annotate(last_access=Max(Coalesce('last_accessed_at', 'uploaded_at'))))
+    active = ConversionJob.objects.filter(status__in=_ACTIVE_STATUSES)
+    busy = set(active.values_list('uploaded_file__file', flat=True))
+    # Delta jobs also read the earlier upload they compare against
+    busy |= set(active.filter(base_file__isnull=False).values_list('base_file__file', flat=True))
+    artifacts = []
+    known = set()
+    for blob in blobs:
+        path = default_storage.path(blob['file'])
+        known.add(path)
+        artifacts.append(Artifact(path, blob['last_access'], _upload_deleter(blob['file'], path),
+                                  in_use=blob['file'] in busy))
+
+    for session in UploadSession.objects.filter(uploaded_file__isnull=True):
+        path = default_storage.path(session.stored_name)
+        known.add(path)
+        artifacts.append(Artifact(path, session.updated_at, _session_deleter(session.id, path)))
+
+    for path in _listing(default_storage.path('uploads')):
+        if path not in known:
+            artifacts.append(Artifact(path, _mtime(path), lambda path=path: _remove(path)))
+    return artifacts
+
+
+def _upload_deleter(name, path):
+    def delete():
+        uploads = UploadedFile.objects.filter(file=name)
+        owners = {upload.content_hash or upload.id for upload in uploads}
+        outputs = set(ConversionJob.objects.filter(Q(uploaded_file__in=uploads) | Q(base_file__in=uploads))
+                      .values_list('output_filename', flat=True))
+        # Deleting the uploads also deletes their sheets, jobs (deltas against them too) and validation runs
+        UploadSession.objects.filter(uploaded_file__in=uploads).delete()
+        uploads.delete()
+        _remove(path)
+        cache = get_dataset_cache()
+        for owner in owners:
+            cache.forget(owner)
+        # Outputs are shared between repeated conversions; keep those another job still serves
+        still_served = set(ConversionJob.objects.filter(output_filename__in=outputs)
+                           .values_list('output_filename', flat=True))
+        for output in outputs - still_served - {''}:
+            _remove(os.path.join(DOWNLOAD_PATH, output))
+    return delete
+
+
+def _session_deleter(session_id, path):
+    def delete():
+        UploadSession.objects.filter(id=session_id).delete()
+        _remove(path)
+    return delete
+
+
+def download_artifacts():
+    """
+    Lists the generated scripts. An output shared by repeated conversions was last
+    accessed when any of their jobs was. Scripts still being written are skipped.
+    """
+    outputs = (ConversionJob.objects.filter(status=ConversionJob.STATUS_DONE).exclude(output_filename='')
+               .values('output_filename')
+               .annotate(last_access=Max(Coalesce('last_accessed_at', 'finished_at', 'created_at'))))
+    artifacts = []
+    known = set()
+    for output in outputs:
+        path = os.path.join(DOWNLOAD_PATH, output['output_filename'])
+        known.add(path)
+        artifacts.append(Artifact(path, output['last_access'], _output_deleter(output['output_filename'], path)))
+
+    for path in _listing(DOWNLOAD_PATH):
+        if path not in known and not path.endswith('.part'):
+            artifacts.append(Artifact(path, _mtime(path), lambda path=path: _remove(path)))
+    return artifacts
+
+
+def snapshot_artifacts():
+    """
+    Lists the parsed-dataset snapshots of the dataset cache, last accessed when they
+    were last loaded. Snapshots being written are skipped unless they were abandoned.
+    """
+    artifacts = []
+    for path in _listing(get_dataset_cache().cache_dir):
+        if path.endswith('.part') and time.time() - os.path.getmtime(path) < 3600:
+            continue
+        artifacts.append(Artifact(path, _mtime(path), lambda path=path: _remove(path)))
+    return artifacts
+
+
+def _output_deleter(filename, path):
+    def delete():
+        ConversionJob.objects.filter(output_filename=filename).update(
+            status=ConversionJob.STATUS_EXPIRED, output_filename='',
+            error='The generated script was removed to free disk space. Generate it again.',
+        )
+        _remove(path)
+    return delete
+
+
+def select_evictions(artifacts, max_bytes=None, ttl=None, now=None):
+    """
+    Picks the artifacts to delete: every one not accessed within `ttl`, then the
+    least recently used until the rest fit in `max_bytes`. Artifacts in use are kept.
+    """
+    now = now or timezone.now()
+    candidates = sorted((a for a in artifacts if not a.in_use), key=lambda a: a.last_access)
+    total = sum(a.size for a in artifacts)
+    evicted = []
+    for artifact in candidates:
+        expired = ttl is not None and artifact.last_access < now - ttl
+        over_quota = max_bytes is not None and total > max_bytes
+        if not (expired or over_quota):
+            # Candidates are oldest first, so no later one is expired either
+            break
+        evicted.append(artifact)
+        total -= artifact.size
+    return evicted
+
+
+def _days(value):
+    return None if value is None else datetime.timedelta(days=value)
+
+
+def storage_policies():
+    """
+    Returns {area: (artifact lister, max_bytes, ttl)} from settings. A quota or
+    TTL of None is not enforced.
+    """
+    return {
+        'downloads': (download_artifacts,
+                      getattr(settings, 'CONVERTER_DOWNLOADS_MAX_BYTES', None),
+                      _days(getattr(settings, 'CONVERTER_DOWNLOADS_TTL_DAYS', None))),
+        'uploads': (upload_artifacts,
+                    getattr(settings, 'CONVERTER_UPLOADS_MAX_BYTES', None),
+                    _days(getattr(settings, 'CONVERTER_UPLOADS_TTL_DAYS', None))),
+        'snapshots': (snapshot_artifacts,
+                      getattr(settings, 'CONVERTER_SNAPSHOTS_MAX_BYTES', None),
+                      _days(getattr(settings, 'CONVERTER_SNAPSHOTS_TTL_DAYS', None))),
+    }
+
+
+def enforce_retention(dry_run=False, now=None):
+    """
+    Applies the storage quotas and TTLs. Downloads are pruned first and snapshots
+    last, since removing an upload also removes its outputs and snapshots.
+    Returns {area: {'files', 'bytes', 'evicted', 'freed_bytes', 'evicted_paths'}}.
+    """
+    report = {}
+    with span('retention', dry_run=dry_run):
+        for area, (lister, max_bytes, ttl) in storage_policies().items():
+            artifacts = lister()
+            evicted = select_evictions(artifacts, max_bytes, ttl, now)
+            for artifact in evicted:
+                if not dry_run:
+                    try:
+                        artifact.delete()
+                    except Exception as e:
+                        print(f"Error removing {artifact.path}: {e}", flush=True)
+            report[area] = {
+                'files': len(artifacts),
+                'bytes': sum(a.size for a in artifacts),
+                'evicted': len(evicted),
+                'freed_bytes': sum(a.size for a in evicted),
+                'evicted_paths': [a.path for a in evicted],
+            }
+    return report
+
+
+_last_run = 0.0
+_running = False
+_lock = threading.Lock()
+
+
+def schedule_retention():
+    """
+    Starts a background retention pass if CONVERTER_RETENTION_INTERVAL seconds have
+    passed since the last one. Called whenever new files are stored; cheap otherwise.
+    """
+    global _last_run, _running
+    interval = getattr(settings, 'CONVERTER_RETENTION_INTERVAL', 3600)
+    if not interval:
+        return
+    with _lock:
+        if _running or time.monotonic() - _last_run < interval:
+            return
+        _running = True
+        _last_run = time.monotonic()
+    threading.Thread(target=_run_retention, name='retention', daemon=True).start()
+
+
+def _run_retention():
+    global _running
+    close_old_connections()
+    try:
+        enforce_retention()
+    except Exception as e:
+        print(f"Storage retention failed: {e}", flush=True)
+    finally:
+        with _lock:
+            _running = False
+        connection.close()
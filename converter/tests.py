@@ -1,3 +1,823 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from . import jobs, middleware, offload, retention, uploads
+from .models import ConversionJob, UploadedFile, ValidationRun
+from .utils import dataset_cache
+from .utils.delta import diff_tables, frame_rows, iter_delta_script
+from .utils.duplicates import file_key_chunks, find_duplicate_rows, frame_chunks
+from .utils.file_parser import count_rows, parse_file, pyarrow, read_csv
+from .utils.script_generator import OUTPUT_FORMATS, block_size, format_options, iter_script, iter_script_chunks
+from .utils import row_window, streaming, timing
+from .utils.streaming import CsvStream
+from .utils.validator import validate_chunks, validate_dataframe
+from .utils.xlsx_reader import iter_xlsx_chunks, read_xlsx
+
+
+class TempDirMixin:
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class CsvEngineTests(TempDirMixin, SimpleTestCase):
+    def assert_engines_match(self, path):
+        pd.testing.assert_frame_equal(read_csv(path, engine='pyarrow'), read_csv(path, engine='c'))
+
+    def test_times_stay_text(self):
+        path = self.write('times.csv', "id,t,d\n1,12:30:00,2020-01-01\n2,,2020-01-02\n3,01:02:03,\n")
+        self.assert_engines_match(path)
+        self.assertEqual(read_csv(path, engine='pyarrow')['t'][0], '12:30:00')
+
+    def test_integers_beyond_int64(self):
+        path = self.write('big.csv', "id,big,mixed,f\n1,12345678901234567890,-1,1.5\n2,5,12345678901234567890,2.25\n")
+        self.assert_engines_match(path)
+        df = read_csv(path, engine='pyarrow')
+        self.assertEqual(df['big'].dtype, 'uint64')
+        self.assertEqual(df['big'][0], 12345678901234567890)
+        self.assertEqual(df['mixed'][1], '12345678901234567890')
+
+    def test_plain_columns(self):
+        self.assert_engines_match(self.write('plain.csv', "a,b,c,,a\n1,x,1.1,True,3\n2,,2.5,False,\n"))
+
+
+class StreamingOutputTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        lines = ['id,name,amount,day,at,flag,maybe,note']
+        for i in range(60):
+            lines.append(','.join([
+                str(i), f"name {i % 7}", '' if i % 9 == 0 else str(i * 1.25), f"2020-01-{i % 28 + 1:02d}",
+                f"{i % 24:02d}:{i % 60:02d}:00", str(i % 2 == 0), '' if i % 11 == 0 else str(i % 3 == 0),
+                f" padded {i} " if i % 5 else '',
+            ]))
+        self.path = self.write('table.csv', '\n'.join(lines) + '\n')
+
+    def test_every_format_matches_in_memory_output(self):
+        for output_format in OUTPUT_FORMATS:
+            with self.subTest(output_format=output_format):
+                options = format_options(output_format, {'batch_size': 4})
+                df = parse_file(self.path, trim_whitespace=True, optimize=True)
+                in_memory = ''.join(text for _, text in iter_script(df, output_format, 'Table', chunk_size=7,
+                                                                    options=options))
+                stream = CsvStream(self.path, trim_whitespace=True, chunk_size=block_size(7, options))
+                self.assertTrue(stream.resolve())
+                streamed = ''.join(text for _, text in iter_script_chunks(stream.chunks(), stream.rows,
+                                                                          output_format, 'Table', options=options))
+                self.assertEqual(streamed, in_memory)
+
+
+class StreamRowsTests(TempDirMixin, SimpleTestCase):
+    def test_indexed_rows_match_the_file(self):
+        lines = ['id,"multi\nline",amount']
+        for i in range(200):
+            note = f'"note\n{i}, ""quoted"""' if i % 13 == 0 else f"n{i}"
+            lines.append(f"{i},{note},{'' if i % 7 == 0 else i * 1.5}")
+            if i % 31 == 0:
+                lines.append('')
+        path = self.write('rows.csv', '\r\n'.join(lines) + '\r\n')
+
+        with mock.patch.object(streaming, 'STREAM_INDEX_ROWS', 16):
+            indexed = CsvStream(path, trim_whitespace=True)
+            self.assertTrue(indexed.resolve())
+            self.assertEqual(len(indexed.index_rows()), 13)
+            scanned = CsvStream(path, trim_whitespace=True, offsets=False)
+            scanned.resolve()
+            whole = pd.concat(list(scanned.chunks()))
+            for rows in (range(0, 10), range(15, 40), range(190, 205), [3, 17, 90, 91, 150, 199]):
+                with self.subTest(rows=rows):
+                    expected = whole.loc[[row for row in rows if row < 200]]
+                    pd.testing.assert_frame_equal(indexed.read_rows(rows), expected, check_index_type=False)
+                    pd.testing.assert_frame_equal(scanned.read_rows(rows), expected, check_index_type=False)
+
+
+class CountRowsTests(TempDirMixin, SimpleTestCase):
+    def test_csv_rows_are_counted_as_pandas_reads_them(self):
+        texts = {
+            'plain': "a,b\n1,2\n3,4\n",
+            'no_final_break': "a,b\n1,2\n3,4",
+            'blank_lines': "a,b\n\n1,2\n\n\n3,4\n\n",
+            'multiline': 'a,b\n1,"x\ny"\n2,"p\n\nq"\n3,""""\n',
+            'crlf': 'a,b\r\n1,2\r\n\r\n3,"a\r\nb"',
+            'header_only': "a,b\n",
+        }
+        for name, text in texts.items():
+            with self.subTest(name=name):
+                path = self.write(f"{name}.csv", text)
+                self.assertEqual(count_rows(path), len(pd.read_csv(path)))
+
+
+class JsonOutputTests(SimpleTestCase):
+    def test_infinity_is_written_as_null(self):
+        df = pd.DataFrame({'f': [1.5, np.inf, -np.inf, np.nan],
+                           'o': pd.Series(['x', float('inf'), None, 2], dtype=object)})
+        expected = [{'f': 1.5, 'o': 'x'}, {'f': None, 'o': None}, {'f': None, 'o': None}, {'f': None, 'o': 2}]
+
+        def strict(constant):
+            raise ValueError(f"Not valid JSON: {constant}")
+
+        for output_format in ('json', 'ndjson', 'json_compact'):
+            with self.subTest(output_format=output_format):
+                text = ''.join(piece for _, piece in iter_script(df, output_format))
+                if output_format == 'ndjson':
+                    records = [json.loads(line, parse_constant=strict) for line in text.splitlines()]
+                else:
+                    records = json.loads(text, parse_constant=strict)
+                self.assertEqual(records, expected)
+
+
+def _baseline_sql(df, table_name):
+    # The row-by-row SQL formatter the vectorized one replaced
+    statements = []
+    for _, row in df.iterrows():
+        values = ', '.join([
+            f"""'{str(val).replace("'", "''").replace(" - ", "-")}'""" if pd.notna(val) else "NULL"
+            for val in row
+        ])
+        statements.append(f"INSERT INTO {table_name} VALUES ({values});")
+    return '\n'.join(statements)
+
+
+class ScriptOutputTests(SimpleTestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'id': range(40),
+            'name': [f"it's {i} - x" if i % 6 else None for i in range(40)],
+            'amount': [i * 1.5 if i % 4 else np.nan for i in range(40)],
+            'day': pd.to_datetime('2020-01-01') + pd.to_timedelta(range(40), unit='D'),
+            'flag': [i % 2 == 0 for i in range(40)],
+        })
+
+    def test_vectorized_sql_matches_row_by_row_baseline(self):
+        df = self.df.drop(columns=['day'])
+        script = ''.join(text for _, text in iter_script(df, 'sql', 'items', chunk_size=7))
+        self.assertEqual(script, _baseline_sql(df, 'items'))
+
+    def test_process_pool_matches_serial_output(self):
+        for output_format in OUTPUT_FORMATS:
+            with self.subTest(output_format=output_format):
+                options = {'batch_size': 3}
+                serial = ''.join(text for _, text in iter_script(self.df, output_format, 'Items', chunk_size=6,
+                                                                 options=options))
+                parallel = ''.join(text for _, text in iter_script(self.df, output_format, 'Items', chunk_size=6,
+                                                                   workers=2, parallel_min_rows=0, options=options))
+                self.assertEqual(parallel, serial)
+
+
+class XlsxReaderTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = 'mixed'
+        sheet.append(['day', 'when', 'num', 'text_num', 'flag', 'flag_text', 'na', 'error', None, 'a', 'a', 'a.1'])
+        sheet.append([datetime.datetime(2020, 1, 1), datetime.time(1, 2), 1, '12', True, 'TRUE', 'NA', '#DIV/0!',
+                      None, 1.0, 2, 'x'])
+        sheet.append([datetime.datetime(2020, 1, 2, 3, 4), datetime.time(3, 4), 'abc', '1.5', False, 'false', 'n/a',
+                      3, None, 2.5, 3])
+        sheet.append([])
+        sheet.append([None, None, 2.0, ' 7 ', True, None, 'x', 4, 'late', 3, 4])
+        sheet.append([])
+        one = workbook.create_sheet('one')
+        for row in (['x'], [1], [], [2], ['  ']):
+            one.append(row)
+        workbook.create_sheet('empty')
+        workbook.create_sheet('header').append(['a', 'b'])
+        wide = workbook.create_sheet('wide')
+        for row in (['a'], [1, 2, 3], [4]):
+            wide.append(row)
+        wider_later = workbook.create_sheet('wider_later')
+        for row in (['a', 'b'], [1, 'x'], [2], [], [3, 'y', 4.5, None, 'z'], [5]):
+            wider_later.append(row)
+        self.path = os.path.join(self.tmp, 'book.xlsx')
+        workbook.save(self.path)
+
+    def test_matches_read_excel(self):
+        for sheet_name in (None, 'one', 'empty', 'header', 'wide', 'wider_later'):
+            for nrows in (None, 0, 2):
+                with self.subTest(sheet=sheet_name, nrows=nrows):
+                    expected = pd.read_excel(self.path, sheet_name=sheet_name or 0, nrows=nrows)
+                    pd.testing.assert_frame_equal(read_xlsx(self.path, sheet_name, nrows), expected)
+
+    def test_chunks_cover_the_sheet(self):
+        chunks = list(iter_xlsx_chunks(self.path, 'one', chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2])
+        self.assertEqual(list(pd.concat(chunks).index), [0, 1, 2, 3])
+
+    def test_rows_wider_than_earlier_chunks_add_columns(self):
+        chunks = list(iter_xlsx_chunks(self.path, 'wider_later', chunk_size=2))
+        wide = ['a', 'b', 'Unnamed: 2', 'Unnamed: 3', 'Unnamed: 4']
+        self.assertEqual([list(chunk.columns) for chunk in chunks], [['a', 'b'], wide, wide])
+        pd.testing.assert_frame_equal(pd.concat(chunks), pd.read_excel(self.path, sheet_name='wider_later'))
+
+
+class ValidationIndexTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = pd.DataFrame({
+            'id': [1, 2, 2, 4, 5, 6],
+            'name': ['a', None, 'c', '', 'e', 'f'],
+            'amount': ['1', '2', 'x', '4', '5', '6'],
+        })
+
+    def test_errors_are_keyed_by_row_number(self):
+        _, rule_errors = validate_dataframe(self.df, ['name'], ['id'])
+        flat = {}
+        for errors in rule_errors.values():
+            for row, row_errors in errors.items():
+                flat.setdefault(row, {}).update(row_errors)
+        self.assertEqual(set(flat), {1, 2, 3})
+        self.assertEqual(set(flat[1]), {'name', 'id'})
+        self.assertEqual(set(flat[2]), {'id'})
+        self.assertEqual(set(flat[3]), {'name'})
+
+    def test_chunked_validation_matches_whole_frame(self):
+        whole = validate_dataframe(self.df, ['name'], ['id'])
+        chunks = lambda: (self.df.iloc[start:start + 4] for start in range(0, len(self.df), 4))
+        column_types, rule_errors, rows = validate_chunks(chunks, ['name'], ['id'])
+        self.assertEqual((column_types, rule_errors, rows), (*whole, len(self.df)))
+
+    def test_chunked_date_checks_match_whole_frame(self):
+        days = [f"2020-01-{i % 28 + 1:02d}" for i in range(120)]
+        days[3], days[90] = '2020-13-45', 'soon'
+        mixed = ['Jan 5 2020', '2020-02-03', '03/04/2020', '5 March 2021'] * 30
+        df = pd.DataFrame({'day': days, 'mixed': mixed})
+        whole = validate_dataframe(df, [], [])
+        chunks = lambda: (df.iloc[start:start + 25] for start in range(0, len(df), 25))
+        self.assertEqual(validate_chunks(chunks, [], []), (*whole, len(df)))
+        self.assertEqual(whole[1]['data_types'], {3: {'day': 'Expected date.'}, 90: {'day': 'Expected date.'}})
+
+    def test_stored_errors_are_served_with_their_rows(self):
+        cache = dataset_cache.DatasetCache(64 * 1024 * 1024, os.path.join(self.tmp, 'cache'))
+        with override_settings(MEDIA_ROOT=self.tmp), mock.patch.object(dataset_cache, '_cache', cache):
+            uploaded = UploadedFile.objects.create()
+            uploaded.file.save('people.csv', ContentFile(self.df.to_csv(index=False).encode('utf-8')))
+            df = dataset_cache.load_dataset(uploaded)
+            column_types, rule_errors = validate_dataframe(df, ['name'], ['id'])
+            run = ValidationRun.record(uploaded, None, ['name'], ['id'], df.columns, column_types, len(df),
+                                       rule_errors)
+            self.assertEqual(run.error_row_count, 3)
+
+            response = self.client.get(reverse('validation_rows', args=[run.id]), {'errors_only': '1'})
+            rows = response.json()['rows']
+            self.assertEqual([row['row'] for row in rows], [1, 2, 3])
+            self.assertEqual(rows[0]['values'][:2], ['2', ''])
+            self.assertEqual(rows[1]['values'][0], '2')
+            self.assertEqual(set(rows[0]['errors']), {'id', 'name'})
+
+
+class DeltaTests(SimpleTestCase):
+    def setUp(self):
+        self.old = pd.DataFrame({'id': [1, 2, 3, 4], 'name': ['a', 'b', 'c', 'd'], 'amount': [1.5, 2.0, None, 4.0]})
+        self.new = pd.DataFrame({'id': [2, 5, 3, 1], 'name': ['b', 'e', "c'x", 'a'], 'amount': [2.0, 5.0, None, 1.0]})
+
+    def delta_script(self, old, new):
+        delta = diff_tables(frame_chunks(old), frame_chunks(new), ['id'])
+        return delta, ''.join(text for _, text in iter_delta_script(delta, frame_rows(old), frame_rows(new), 'items',
+                                                                    chunk_size=2))
+
+    def table(self, *frames_or_scripts):
+        # The rows left after running the full scripts of the frames, then the given scripts
+        db = sqlite3.connect(':memory:')
+        self.addCleanup(db.close)
+        db.execute('CREATE TABLE items (id, name, amount)')
+        for item in frames_or_scripts:
+            if isinstance(item, pd.DataFrame):
+                item = ''.join(text for _, text in iter_script(item, 'sql', 'items')) if len(item) else ''
+            db.executescript(item)
+        return sorted(db.execute('SELECT * FROM items').fetchall())
+
+    def test_inserts_updates_and_deletes(self):
+        delta, script = self.delta_script(self.old, self.new)
+        self.assertEqual(list(delta.inserted), [1])
+        self.assertEqual((list(delta.updated_old), list(delta.updated_new)), ([2, 0], [2, 3]))
+        self.assertEqual(delta.deleted.iloc[:, 0].tolist(), ["'4'"])
+        self.assertEqual(self.table(self.old, script), self.table(self.new))
+
+    def test_empty_previous_upload_inserts_every_row(self):
+        delta, script = self.delta_script(self.old.iloc[:0], self.new)
+        self.assertEqual((list(delta.inserted), len(delta.updated_new), len(delta.deleted)), ([0, 1, 2, 3], 0, 0))
+        self.assertEqual(self.table(script), self.table(self.new))
+
+    def test_empty_new_upload_deletes_every_row(self):
+        delta, script = self.delta_script(self.old, self.new.iloc[:0])
+        self.assertEqual((len(delta.inserted), len(delta.updated_new), len(delta.deleted)), (0, 0, 4))
+        self.assertEqual(self.table(self.old, script), [])
+
+
+@override_settings(CONVERTER_HEAVY_WORKERS=1, CONVERTER_OFFLOAD_QUEUE_DEPTH=0, CONVERTER_CLIENT_CONCURRENCY=0,
+                   CONVERTER_OFFLOAD_RETRY_AFTER=7)
+class OffloadTests(SimpleTestCase):
+    def setUp(self):
+        # Fresh lanes, so the settings above apply
+        patcher = mock.patch.dict(offload._lanes, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [lane.executor.shutdown() for lane in offload._lanes.values()])
+        self.started, self.finish = threading.Event(), threading.Event()
+
+        @offload.offloaded('heavy', json=True)
+        def slow(request):
+            self.started.set()
+            self.finish.wait(10)
+            return JsonResponse({'ok': True})
+        self.view = async_to_sync(slow)
+
+    def assert_busy(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(set(json.loads(response.content)), {'error'})
+
+    def test_full_lane_is_turned_away(self):
+        responses = []
+        worker = threading.Thread(target=lambda: responses.append(self.view(RequestFactory().get('/'))))
+        worker.start()
+        self.assertTrue(self.started.wait(10))
+        self.assertEqual(offload.offload_stats()['heavy']['in_flight'], 1)
+        self.assert_busy(self.view(RequestFactory().get('/', REMOTE_ADDR='10.0.0.2')))
+        self.finish.set()
+        worker.join(10)
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(offload.offload_stats()['heavy'], {'workers': 1, 'in_flight': 0, 'clients': 0})
+        self.assertEqual(self.view(RequestFactory().get('/')).status_code, 200)
+
+    @override_settings(CONVERTER_HEAVY_WORKERS=2, CONVERTER_CLIENT_CONCURRENCY=1)
+    def test_one_client_cannot_take_the_whole_lane(self):
+        lane = offload._get_lane('heavy')
+        self.assertTrue(offload._admit(lane, 'addr:10.0.0.1'))
+        self.addCleanup(offload._release, lane, 'addr:10.0.0.1')
+        self.assert_busy(self.view(RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')))
+        self.finish.set()
+        self.assertEqual(self.view(RequestFactory().get('/', REMOTE_ADDR='10.0.0.2')).status_code, 200)
+
+    def test_views_answer_busy_as_json(self):
+        lane = offload._get_lane('heavy')
+        self.assertTrue(offload._admit(lane, 'someone else'))
+        self.addCleanup(offload._release, lane, 'someone else')
+        response = self.client.get(reverse('chunked_upload', args=['00000000-0000-0000-0000-000000000000']))
+        self.assert_busy(response)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.uploaded = UploadedFile.objects.create()
+        self.executor = mock.Mock()
+        for patcher in (mock.patch.object(jobs, '_pending', 0),
+                        mock.patch.object(jobs, '_get_executor', return_value=self.executor)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_jobs_are_handed_to_the_pool(self):
+        job = jobs.enqueue_conversion(self.uploaded, 'sql')
+        self.executor.submit.assert_called_once_with(jobs._run_job, job.id)
+        self.assertEqual((job.status, jobs._pending), (ConversionJob.STATUS_QUEUED, 1))
+
+    @override_settings(CONVERTER_JOB_QUEUE_DEPTH=1)
+    def test_full_queue_is_refused(self):
+        jobs.enqueue_conversion(self.uploaded, 'sql')
+        with self.assertRaises(jobs.QueueFull):
+            jobs.enqueue_conversion(self.uploaded, 'json')
+        self.assertEqual((ConversionJob.objects.count(), jobs._pending), (1, 1))
+
+    @override_settings(CONVERTER_JOB_QUEUE_DEPTH=1)
+    def test_failed_submit_gives_the_slot_back(self):
+        self.executor.submit.side_effect = RuntimeError('cannot schedule new futures after shutdown')
+        with self.assertRaises(RuntimeError):
+            jobs.enqueue_conversion(self.uploaded, 'sql')
+        self.assertEqual(jobs._pending, 0)
+        self.assertEqual(ConversionJob.objects.get().status, ConversionJob.STATUS_FAILED)
+
+        self.executor.submit.side_effect = None
+        self.assertEqual(jobs.enqueue_conversion(self.uploaded, 'sql').status, ConversionJob.STATUS_QUEUED)
+
+
+class DuplicateRowsTests(TempDirMixin, SimpleTestCase):
+    def assert_matches(self, df, chunks, columns):
+        expected = np.flatnonzero(df.duplicated(subset=columns, keep=False).to_numpy())
+        for memory_rows in (1000, 3):
+            with self.subTest(memory_rows=memory_rows):
+                rows = find_duplicate_rows(chunks, columns, memory_rows=memory_rows, spill_dir=self.tmp)
+                self.assertEqual(rows.tolist(), expected.tolist())
+
+    def test_frame_keys(self):
+        df = pd.DataFrame({'a': [i % 7 for i in range(50)], 'b': [None if i % 5 else f"x{i % 3}" for i in range(50)]})
+        self.assert_matches(df, frame_chunks(df, chunk_size=6), ['a', 'b'])
+        self.assert_matches(df, frame_chunks(df, chunk_size=6), ['b'])
+
+    def test_csv_keys_compare_as_parsed(self):
+        # 1 and 1.0 are the same number, and blanks are equal to each other but not to text
+        path = self.write('keys.csv', "id,code,n,m\n1,a,1,1\n2,,1.0,1.0\n3,a,2,x\n\n4,,3,2\n5,b,,\n6,b,,2.0\n"
+                                      "7,\"a\",2.0,\n8,,4,1\n")
+        df = parse_file(path)
+        for columns in (['code'], ['n'], ['m'], ['code', 'n']):
+            with self.subTest(columns=columns):
+                self.assert_matches(df, file_key_chunks(path, columns, chunk_size=2), columns)
+
+    def test_xlsx_keys_compare_as_parsed(self):
+        workbook = Workbook()
+        for row in (['id', 'n', 'mixed'], [1, 1, 1], [2, 1.5, 'x'], [3, 1.0, None], [4, None, 1.0], [5, 2, 'x'],
+                    [6, 1.5, 2], [7, 2.0, None]):
+            workbook.active.append(row)
+        path = os.path.join(self.tmp, 'keys.xlsx')
+        workbook.save(path)
+        df = pd.read_excel(path)
+        for columns in (['n'], ['mixed'], ['n', 'mixed']):
+            with self.subTest(columns=columns):
+                self.assert_matches(df, file_key_chunks(path, columns, chunk_size=2), columns)
+
+
+class DatasetCacheTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        self.df = pd.DataFrame({'id': range(100), 'name': [f"name {i}" for i in range(100)]})
+        self.nbytes = int(self.df.memory_usage(deep=True).sum())
+
+    def test_evicted_frames_are_reloaded_from_their_snapshot(self):
+        cache = dataset_cache.DatasetCache(self.nbytes, self.cache_dir)
+        cache.put(('a', '', False), self.df)
+        self.assertIs(cache.get(('a', '', False)), self.df)
+        cache.put(('b', '', False), self.df.head(50))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        pd.testing.assert_frame_equal(cache.get(('a', '', False)), self.df)
+        self.assertIsNone(cache.get(('c', '', False)))
+        self.assertEqual({key: cache.stats()[key] for key in ('hits', 'disk_hits', 'misses')},
+                         {'hits': 1, 'disk_hits': 1, 'misses': 1})
+        self.assertFalse([name for name in os.listdir(self.cache_dir) if name.endswith('.part')])
+
+    def test_snapshots_outlive_the_process_until_forgotten(self):
+        dataset_cache.DatasetCache(self.nbytes, self.cache_dir).put(('a', '', False), self.df)
+        restarted = dataset_cache.DatasetCache(self.nbytes, self.cache_dir)
+        pd.testing.assert_frame_equal(restarted.get(('a', '', False)), self.df)
+        restarted.forget('a')
+        self.assertIsNone(restarted.get(('a', '', False)))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_uploads_are_parsed_once(self):
+        cache = dataset_cache.DatasetCache(64 * 1024 * 1024, self.cache_dir)
+        with override_settings(MEDIA_ROOT=self.tmp), mock.patch.object(dataset_cache, '_cache', cache), \
+                mock.patch.object(dataset_cache, 'parse_file', wraps=dataset_cache.parse_file) as parse:
+            uploaded = UploadedFile.objects.create()
+            uploaded.file.save('people.csv', ContentFile(self.df.to_csv(index=False).encode('utf-8')))
+            first = dataset_cache.load_dataset(uploaded)
+            self.assertIs(dataset_cache.load_dataset(uploaded), first)
+            dataset_cache.load_dataset(uploaded, trim_whitespace=True)
+        self.assertEqual(parse.call_count, 2)
+        pd.testing.assert_frame_equal(first, self.df, check_dtype=False)
+
+
+@override_settings(CONVERTER_RETENTION_INTERVAL=0)
+class ChunkedUploadTests(TempDirMixin, TransactionTestCase):
+    # Offloaded views run on worker threads, which only see committed rows
+
+    def setUp(self):
+        super().setUp()
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.content = ''.join(f"{i},name {i},{i * 1.5}\n" for i in range(2000)).encode('utf-8')
+        self.content = b'id,name,amount\n' + self.content
+
+    def send(self, url, offset, data):
+        return self.client.post(url, data=data, content_type='application/octet-stream',
+                                HTTP_X_UPLOAD_OFFSET=str(offset))
+
+    def test_interrupted_upload_resumes_and_is_hashed(self):
+        started = self.client.post(reverse('start_chunked_upload'),
+                                   {'filename': 'people.csv', 'size': len(self.content)}).json()
+        url = started['upload_url']
+        half = len(self.content) // 2
+        self.assertEqual(self.send(url, 0, self.content[:half]).json()['offset'], half)
+
+        mismatch = self.send(url, 0, self.content[half:])
+        self.assertEqual((mismatch.status_code, mismatch.json()['offset']), (409, half))
+
+        # A restarted process has lost the running hash and rebuilds it from the stored bytes
+        uploads._hashers.clear()
+        self.assertEqual(self.client.get(url).json(), {'upload_id': started['upload_id'], 'offset': half,
+                                                       'size': len(self.content), 'complete': False})
+        finished = self.send(url, half, self.content[half:])
+        self.assertEqual(finished.status_code, 200)
+        self.assertIn('redirect_url', finished.json())
+
+        uploaded = UploadedFile.objects.get()
+        self.assertEqual(uploaded.content_hash, hashlib.sha256(self.content).hexdigest())
+        with open(uploaded.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(self.client.get(url).json()['complete'], True)
+
+    def test_bytes_beyond_the_declared_size_are_dropped(self):
+        url = self.client.post(reverse('start_chunked_upload'),
+                               {'filename': 'people.csv', 'size': len(self.content)}).json()['upload_url']
+        self.assertEqual(self.send(url, 0, self.content + b'extra').status_code, 200)
+        with open(UploadedFile.objects.get().file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+
+class ServerTimingTests(SimpleTestCase):
+    def setUp(self):
+        self.metrics = timing.Metrics()
+        for module in ('converter.utils.timing', 'converter.middleware', 'converter.views'):
+            patcher = mock.patch(f"{module}.metrics", self.metrics)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def view(self, request):
+        for rows in (10, 20):
+            with timing.span('parse') as parsing:
+                parsing.add(rows=rows)
+        with timing.span('generate'):
+            pass
+        return JsonResponse({})
+
+    def assert_header(self, response):
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['parse', 'generate', 'total'])
+
+    def test_spans_of_a_request_are_summed_into_the_header(self):
+        response = middleware.ServerTimingMiddleware(self.view)(RequestFactory().get('/'))
+        self.assert_header(response)
+        stats = self.metrics.snapshot()
+        self.assertEqual((stats['stages']['parse']['count'], stats['stages']['parse']['rows']), (2, 30))
+        self.assertEqual(stats['requests']['total'], 1)
+        self.assertEqual(sum(stats['stages']['request']['histogram_ms'].values()), 1)
+
+    def test_spans_of_offloaded_views_reach_the_header(self):
+        handler = middleware.ServerTimingMiddleware(offload.offloaded('preview')(self.view))
+        self.assert_header(async_to_sync(handler)(RequestFactory().get('/')))
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('timing_metrics'))
+        data = self.client.get(reverse('timing_metrics')).json()
+        self.assertEqual(set(data), {'requests', 'stages', 'enabled', 'offload'})
+        self.assertEqual(data['requests']['by_view'], {'timing_metrics': 1})
+
+
+class SheetBundleTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        workbook = Workbook()
+        workbook.active.title = 'People'
+        for row in (['id', 'name'], [1, ' ann '], [2, "o'neil"]):
+            workbook.active.append(row)
+        for title, rows in (('people!', (['id'], [3])), ('Orders', (['id', 'total'], [1, 9.5], [2, None]))):
+            sheet = workbook.create_sheet(title)
+            for row in rows:
+                sheet.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.uploaded = UploadedFile.objects.create()
+        self.uploaded.file.save('book.xlsx', ContentFile(buffer.getvalue()))
+        self.uploaded.record_metadata()
+
+    def test_every_sheet_gets_its_own_entry(self):
+        job = ConversionJob.objects.create(uploaded_file=self.uploaded, output_format='sql', all_sheets=True,
+                                           sheet_tables={'Orders': 'purchases'}, options=format_options('sql'))
+        with mock.patch.object(jobs, 'DOWNLOAD_PATH', self.tmp):
+            job = jobs.run_conversion(job)
+        self.assertEqual((job.status, job.rows_total, job.rows_processed), (ConversionJob.STATUS_DONE, 5, 5))
+
+        with zipfile.ZipFile(os.path.join(self.tmp, job.output_filename)) as bundle:
+            entries = {name: bundle.read(name).decode('utf-8') for name in bundle.namelist()}
+        self.assertEqual(list(entries), ['people.sql', 'people_2.sql', 'purchases.sql'])
+        for (sheet, name), entry in zip((('People', 'people'), ('people!', 'people'), ('Orders', 'purchases')),
+                                        entries.values()):
+            df = parse_file(self.uploaded.file.path, sheet_name=sheet, trim_whitespace=True, optimize=True)
+            self.assertEqual(entry, ''.join(text for _, text in iter_script(df, 'sql', name)))
+
+
+class PreviewRowsTests(TempDirMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        cache = dataset_cache.DatasetCache(64 * 1024 * 1024, os.path.join(self.tmp, 'cache'))
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        for patcher in (mock.patch.object(dataset_cache, '_cache', cache),
+                        mock.patch.dict(row_window._orders, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lines = ['id,name,amount'] + [f"{i},{'ab'[i % 2]}{i},{'' if i % 4 == 0 else i % 5}" for i in range(12)]
+        uploaded = UploadedFile.objects.create()
+        uploaded.file.save('rows.csv', ContentFile('\n'.join(lines).encode('utf-8')))
+        self.url = reverse('preview_rows', args=[uploaded.id])
+
+    def rows(self, **params):
+        data = self.client.get(self.url, params).json()
+        return data['total'], [row['row'] for row in data['rows']]
+
+    def test_pages(self):
+        data = self.client.get(self.url, {'offset': 2, 'limit': 3}).json()
+        self.assertEqual((data['total'], data['columns']), (12, ['id', 'name', 'amount']))
+        self.assertEqual(data['rows'][0], {'row': 2, 'values': ['2', 'a2', '2.0']})
+        self.assertEqual([row['row'] for row in data['rows']], [2, 3, 4])
+        self.assertEqual(self.rows(offset=10, limit=5), (12, [10, 11]))
+        self.assertEqual(self.client.get(self.url, {'limit': 10 ** 6}).json()['limit'], 1000)
+
+    def test_sort_keeps_file_row_numbers_and_puts_blanks_last(self):
+        self.assertEqual(self.rows(sort='amount', desc='1', limit=12),
+                         (12, [9, 3, 2, 7, 1, 6, 11, 5, 10, 0, 4, 8]))
+        self.assertEqual(self.rows(sort='amount', offset=7, limit=3), (12, [3, 9, 0]))
+
+    def test_filters(self):
+        self.assertEqual(self.rows(filter_column='amount', filter_op='ge', filter_value='3'), (2, [3, 9]))
+        self.assertEqual(self.rows(filter_column='name', filter_op='contains', filter_value='B1', limit=12),
+                         (2, [1, 11]))
+        self.assertEqual(self.rows(filter_column='amount', filter_op='blank', sort='id', desc='1'), (3, [8, 4, 0]))
+        for params in ({'filter_column': 'amount', 'filter_op': 'gt', 'filter_value': 'x'},
+                       {'filter_column': 'amount', 'filter_op': 'like'}, {'sort': 'missing'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    @override_settings(CONVERTER_STREAMING_ROWS=5)
+    def test_large_files_page_in_file_order(self):
+        data = self.client.get(self.url, {'offset': 9, 'limit': 5}).json()
+        self.assertEqual((data['total'], [row['row'] for row in data['rows']]), (12, [9, 10, 11]))
+        self.assertEqual(data['rows'][0]['values'], ['9', 'b9', '4.0'])
+        self.assertEqual(self.client.get(self.url, {'sort': 'id'}).status_code, 400)
+
+
+@override_settings(CONVERTER_RETENTION_INTERVAL=0)
+class ContentDedupTests(TempDirMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.downloads = os.path.join(self.tmp, 'downloads')
+        os.makedirs(self.downloads)
+        self.executor = mock.Mock()
+        cache = dataset_cache.DatasetCache(64 * 1024 * 1024, os.path.join(self.tmp, 'cache'))
+        for patcher in (mock.patch.object(jobs, 'DOWNLOAD_PATH', self.downloads),
+                        mock.patch.object(dataset_cache, '_cache', cache),
+                        mock.patch.object(jobs, '_pending', 0),
+                        mock.patch.object(jobs, '_get_executor', return_value=self.executor)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.content = b'id,name\n1,a\n2,b\n'
+
+    def upload(self, name):
+        response = self.client.post(reverse('upload_file'), {'file': SimpleUploadedFile(name, self.content)})
+        self.assertIn('redirect_url', response.json())
+        return UploadedFile.objects.order_by('-id').first()
+
+    def test_repeated_content_is_stored_once(self):
+        first = self.upload('people.csv')
+        second = self.upload('people copy.csv')
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual((second.file.name, second.content_hash), (first.file.name, first.content_hash))
+        self.assertEqual(os.listdir(os.path.join(self.tmp, 'uploads')), [os.path.basename(first.file.name)])
+        self.assertEqual([(sheet.row_count, sheet.columns) for sheet in second.sheets.all()],
+                         [(sheet.row_count, sheet.columns) for sheet in first.sheets.all()])
+
+    def test_conversions_of_the_same_content_share_the_output(self):
+        first = self.upload('people.csv')
+        earlier = jobs.enqueue_conversion(first, 'sql_bulk', options={'batch_size': 2})
+        earlier = jobs.run_conversion(earlier)
+        self.executor.submit.reset_mock()
+
+        shared = jobs.enqueue_conversion(self.upload('again.csv'), 'sql_bulk', options={'batch_size': 2})
+        self.assertEqual((shared.status, shared.output_filename), (ConversionJob.STATUS_DONE, earlier.output_filename))
+        self.executor.submit.assert_not_called()
+
+        other_options = jobs.enqueue_conversion(first, 'sql_bulk', options={'batch_size': 3})
+        self.assertEqual(other_options.status, ConversionJob.STATUS_QUEUED)
+        os.remove(os.path.join(self.downloads, shared.output_filename))
+        self.assertEqual(jobs.enqueue_conversion(first, 'sql_bulk', options={'batch_size': 2}).status,
+                         ConversionJob.STATUS_QUEUED)
+
+
+class RetentionTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.downloads = os.path.join(self.tmp, 'downloads')
+        os.makedirs(self.downloads)
+        cache = dataset_cache.DatasetCache(64 * 1024 * 1024, os.path.join(self.tmp, 'cache'))
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        for patcher in (mock.patch.object(retention, 'DOWNLOAD_PATH', self.downloads),
+                        mock.patch.object(dataset_cache, '_cache', cache)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload(self, name, content, days_ago):
+        uploaded = UploadedFile.objects.create(content_hash=hashlib.sha256(content).hexdigest(),
+                                               last_accessed_at=self.now - datetime.timedelta(days=days_ago))
+        uploaded.file.save(name, ContentFile(content))
+        dataset_cache.load_dataset(uploaded)
+        return uploaded
+
+    def output(self, uploaded, name, size, days_ago, status=ConversionJob.STATUS_DONE):
+        with open(os.path.join(self.downloads, name), 'w') as f:
+            f.write('x' * size)
+        return ConversionJob.objects.create(uploaded_file=uploaded, output_format='sql', status=status,
+                                            output_filename=name,
+                                            last_accessed_at=self.now - datetime.timedelta(days=days_ago))
+
+    def test_least_recently_used_are_evicted_first(self):
+        artifacts = [retention.Artifact(self.write(name, 'x' * 100), self.now - datetime.timedelta(days=days), None,
+                                        in_use=in_use)
+                     for name, days, in_use in (('a', 5, False), ('b', 9, True), ('c', 1, False), ('d', 3, False))]
+        picked = retention.select_evictions(artifacts, max_bytes=250, now=self.now)
+        self.assertEqual([os.path.basename(a.path) for a in picked], ['a', 'd'])
+        picked = retention.select_evictions(artifacts, ttl=datetime.timedelta(days=2), now=self.now)
+        self.assertEqual([os.path.basename(a.path) for a in picked], ['a', 'd'])
+
+    @override_settings(CONVERTER_DOWNLOADS_MAX_BYTES=150, CONVERTER_UPLOADS_TTL_DAYS=30)
+    def test_retention_removes_files_and_the_rows_that_need_them(self):
+        old = self.upload('old.csv', b'id\n1\n', days_ago=40)
+        recent = self.upload('recent.csv', b'id\n2\n', days_ago=1)
+        busy = self.upload('busy.csv', b'id\n3\n', days_ago=40)
+        self.output(busy, 'busy.sql', 10, days_ago=40, status=ConversionJob.STATUS_QUEUED)
+        self.output(old, 'old.sql', 100, days_ago=40)
+        stale = self.output(recent, 'stale.sql', 100, days_ago=5)
+        fresh = self.output(recent, 'fresh.sql', 100, days_ago=0)
+
+        report = retention.enforce_retention(now=self.now)
+        self.assertEqual({area: report[area]['evicted'] for area in report},
+                         {'downloads': 2, 'uploads': 1, 'snapshots': 0})
+        self.assertEqual(sorted(os.listdir(self.downloads)), ['busy.sql', 'fresh.sql'])
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, stale.output_filename), (ConversionJob.STATUS_EXPIRED, ''))
+        self.assertEqual(fresh.status, ConversionJob.STATUS_DONE)
+
+        self.assertFalse(UploadedFile.objects.filter(id=old.id).exists())
+        self.assertFalse(os.path.exists(old.file.path))
+        self.assertEqual(set(UploadedFile.objects.values_list('id', flat=True)), {recent.id, busy.id})
+        snapshots = os.listdir(os.path.join(self.tmp, 'cache'))
+        self.assertFalse([name for name in snapshots if name.startswith(old.content_hash)])
+        self.assertEqual(len(snapshots), 2)
+
+
+class BatchConvertTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.inputs = os.path.join(self.tmp, 'in')
+        self.output_dir = os.path.join(self.tmp, 'out')
+        os.makedirs(self.inputs)
+        self.people = self.write('in/people.csv', "id,name\n1,ann\n2,bob\n")
+        self.write('in/orders.csv', "id,name\n1,\n2,x\n")
+
+    def run_batch(self, *args):
+        call_command('batch_convert', self.inputs, '--output-dir', self.output_dir, '--required', 'name',
+                     '--workers', '1', *args, stdout=io.StringIO())
+        with open(os.path.join(self.output_dir, 'batch_summary.json'), encoding='utf-8') as f:
+            return {os.path.basename(summary['input']): summary['status'] for summary in json.load(f)['files']}
+
+    def outputs(self):
+        return sorted(name for name in os.listdir(self.output_dir) if not name.startswith(('.', 'batch_')))
+
+    def test_up_to_date_files_are_skipped(self):
+        self.assertEqual(self.run_batch(), {'orders.csv': 'invalid', 'people.csv': 'done'})
+        self.assertEqual(self.outputs(), ['people.sql'])
+        self.assertEqual(self.run_batch(), {'orders.csv': 'skipped', 'people.csv': 'skipped'})
+
+        self.write('in/orders.csv', "id,name\n1,y\n2,x\n")
+        self.assertEqual(self.run_batch(), {'orders.csv': 'done', 'people.csv': 'skipped'})
+        os.remove(os.path.join(self.output_dir, 'people.sql'))
+        self.assertEqual(self.run_batch(), {'orders.csv': 'skipped', 'people.csv': 'done'})
+        self.assertEqual(self.run_batch('--force'), {'orders.csv': 'done', 'people.csv': 'done'})
+
+    def test_changed_settings_replace_the_outputs(self):
+        self.run_batch('--allow-errors')
+        self.assertEqual(self.outputs(), ['orders.sql', 'people.sql'])
+        self.assertEqual(self.run_batch('--allow-errors', '--format', 'json'),
+                         {'orders.csv': 'done', 'people.csv': 'done'})
+        self.assertEqual(self.outputs(), ['orders.json', 'people.json'])
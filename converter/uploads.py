@@ -0,0 +1,152 @@
+import hashlib
+import os
+import threading
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .models import UploadSession, UploadedFile
+from .utils.file_parser import CSV_SNIFF_BYTES, sniff_csv_format
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xls', '.xlsx')
+READ_BLOCK = 64 * 1024
+
+
+class OffsetMismatch(Exception):
+    """Raised when a chunk does not start where the stored upload currently ends."""
+
+    def __init__(self, expected):
+        super().__init__(f"Expected a chunk starting at byte {expected}")
+        self.expected = expected
+
+
+# Running sha256 state per upload session, with the number of bytes it has hashed.
+# Another process may have appended chunks since, so the state is rebuilt from
+# disk whenever that count differs from the session's received bytes.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+def _session_path(session):
+    return default_storage.path(session.stored_name)
+
+
+def _get_hasher(session):
+    with _hashers_lock:
+        hasher, hashed = _hashers.get(session.id, (None, None))
+        if hasher is None or hashed != session.received_bytes:
+            hasher = hashlib.sha256()
+            with open(_session_path(session), 'rb') as f:
+                remaining = session.received_bytes
+                while remaining:
+                    block = f.read(min(READ_BLOCK, remaining))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    remaining -= len(block)
+            _hashers[session.id] = (hasher, session.received_bytes)
+        return hasher
+
+
+def start_upload(filename, total_size):
+    """
+    Reserves a file under MEDIA_ROOT/uploads and returns a new UploadSession for it.
+    """
+    filename = os.path.basename(filename)
+    if os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+        raise ValueError('Unsupported file format')
+    if total_size <= 0:
+        raise ValueError('Empty files cannot be uploaded')
+
+    stored_name = default_storage.get_available_name(os.path.join('uploads', filename))
+    path = default_storage.path(stored_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+    session = UploadSession.objects.create(filename=filename, stored_name=stored_name, total_size=total_size)
+    with _hashers_lock:
+        _hashers[session.id] = (hashlib.sha256(), 0)
+    return session
+
+
+def append_chunk(session_id, offset, stream):
+    """
+    Appends the bytes read from `stream` to the upload, which must currently end at
+    `offset`. Hashing and CSV sniffing happen as the bytes arrive. When the last byte
+    lands, the UploadedFile is created with its content hash and the session is
+    returned complete.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(id=session_id)
+        if session.is_complete:
+            return session
+        if offset != session.received_bytes:
+            raise OffsetMismatch(session.received_bytes)
+
+        hasher = _get_hasher(session)
+        path = _session_path(session)
+        try:
+            with open(path, 'r+b') as f:
+                # Drop anything left over from an interrupted chunk before appending
+                f.truncate(session.received_bytes)
+                f.seek(session.received_bytes)
+                received = session.received_bytes
+                for block in iter(lambda: stream.read(READ_BLOCK), b''):
+                    block = block[:session.total_size - received]
+                    if not block:
+                        break
+                    f.write(block)
+                    hasher.update(block)
+                    received += len(block)
+        except Exception:
+            # The running hash has seen bytes that will not be kept; rebuild it on retry
+            with _hashers_lock:
+                _hashers.pop(session.id, None)
+            raise
+        session.received_bytes = received
+        with _hashers_lock:
+            _hashers[session.id] = (hasher, received)
+
+        is_csv = session.filename.lower().endswith('.csv')
+        if is_csv and not session.encoding and (received >= CSV_SNIFF_BYTES or session.is_complete):
+            with open(path, 'rb') as f:
+                session.encoding, session.delimiter = sniff_csv_format(f.read(CSV_SNIFF_BYTES))
+
+        if session.is_complete:
+            # The hash was computed as the chunks arrived, so it is stored right away.
+            # Content already stored by an earlier upload is kept only once.
+            content_hash = hasher.hexdigest()
+            stored = UploadedFile.find_stored(content_hash)
+            if stored is not None:
+                os.remove(path)
+                session.stored_name = stored.file.name
+                session.uploaded_file = stored.share()
+            else:
+                session.uploaded_file = UploadedFile.objects.create(
+                    file=session.stored_name,
+                    content_hash=content_hash,
+                    delimiter=session.delimiter,
+                    encoding=session.encoding,
+                )
+            with _hashers_lock:
+                _hashers.pop(session.id, None)
+        session.save()
+    return session
+
+
+def save_upload(uploaded):
+    """
+    Stores a file posted through the upload form and returns its UploadedFile.
+    The content is hashed first; if the same content is already stored, the new
+    UploadedFile shares that file and its metadata instead of storing a copy.
+    """
+    digest = hashlib.sha256()
+    for block in uploaded.chunks():
+        digest.update(block)
+    content_hash = digest.hexdigest()
+
+    stored = UploadedFile.find_stored(content_hash)
+    if stored is not None:
+        return stored.share()
+    uploaded.seek(0)
+    return UploadedFile.objects.create(file=uploaded, content_hash=content_hash)
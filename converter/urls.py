@@ -4,9 +4,18 @@ from . import views
 urlpatterns = [
     path('', views.upload_file, name='upload_file'),
     path('upload/', views.upload_file, name='upload_file'),
+    path('upload/chunked/', views.start_chunked_upload, name='start_chunked_upload'),
+    path('upload/chunked/<uuid:upload_id>/', views.chunked_upload, name='chunked_upload'),
     path('select-sheet/<int:file_id>/', views.select_sheet, name='select_sheet'),
     path('preview/<int:file_id>/', views.preview_file, name='preview_file'),
+    path('preview/<int:file_id>/rows/', views.preview_rows, name='preview_rows'),
     path('generate/<int:file_id>/', views.generate_script, name='generate_script'),
+    path('jobs/<int:job_id>/', views.conversion_job, name='conversion_job'),
+    path('jobs/<int:job_id>/status/', views.conversion_job_status, name='conversion_job_status'),
     path('download/<str:filename>/', views.download_script, name='download_script'),
     path('validate/<int:file_id>/', views.validate_file_view, name='validate_file'), 
+    path('validate/runs/<int:run_id>/', views.validation_run, name='validation_run'),
+    path('validate/runs/<int:run_id>/rows/', views.validation_rows, name='validation_rows'),
+    path('cache/stats/', views.dataset_cache_stats, name='dataset_cache_stats'),
+    path('metrics/', views.timing_metrics, name='timing_metrics'),
 ]
\ No newline at end of file
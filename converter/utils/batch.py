@@ -0,0 +1,274 @@
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+
+from .duplicates import file_key_chunks, find_duplicate_rows
+from .file_parser import count_rows, get_sheet_names, iter_sheets
+from .script_generator import OUTPUT_FORMATS, block_size, format_options, iter_script, iter_script_chunks, sheet_identifier
+from .streaming import CsvStream
+from .validator import validate_chunks, validate_dataframe
+
+BATCH_EXTENSIONS = ('.csv', '.xls', '.xlsx')
+# Kept in the output directory; records what each output was generated from
+MANIFEST_NAME = '.batch_manifest.json'
+
+
+def expand_inputs(patterns):
+    """
+    Returns the sorted input files matched by `patterns`: file paths, glob patterns
+    (** matches subdirectories) or directories, whose supported files are all taken.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        for path in glob.glob(pattern, recursive=True):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in BATCH_EXTENSIONS:
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+
+def batch_settings(output_format, table_name=None, sheet=None, all_sheets=False, options=None,
+                   required_columns=(), unique_columns=(), allow_errors=False):
+    """
+    Collects the settings shared by every file of a batch. They are stored with
+    each output, so a change of settings regenerates it.
+    """
+    return {
+        'format': output_format,
+        'table_name': table_name or None,
+        'sheet': sheet or None,
+        'all_sheets': all_sheets,
+        'options': format_options(output_format, options),
+        'required_columns': list(required_columns),
+        'unique_columns': list(unique_columns),
+        'allow_errors': allow_errors,
+    }
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.part', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.part', path)
+
+
+def _source_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def is_up_to_date(entry, input_path, output_dir, batch):
+    """
+    Returns True if the manifest `entry` of an input shows its outputs were generated
+    from the file as it is now, with the same settings, and are all still there.
+    """
+    return bool(
+        entry
+        and entry.get('source') == _source_state(input_path)
+        and entry.get('settings') == batch
+        and all(os.path.exists(os.path.join(output_dir, name)) for name in entry['outputs'])
+    )
+
+
+def _output_name(input_path, sheet_name, batch):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    extension = OUTPUT_FORMATS[batch['format']]['extension']
+    if batch['all_sheets'] and sheet_name:
+        return f"{stem}_{sheet_identifier(sheet_name, 'sql')}.{extension}"
+    return f"{stem}.{extension}"
+
+
+def _table_name(input_path, sheet_name, batch):
+    if batch['table_name']:
+        return batch['table_name']
+    if batch['all_sheets'] and sheet_name:
+        return sheet_identifier(sheet_name, batch['format'])
+    return sheet_identifier(os.path.splitext(os.path.basename(input_path))[0], batch['format'])
+
+
+def _write_output(path, pieces):
+    # Written under a temporary name so an interrupted run never leaves a partial output
+    with open(path + '.part', 'w', encoding='utf-8') as f:
+        for _, text in pieces:
+            f.write(text)
+    os.replace(path + '.part', path)
+    return os.path.getsize(path)
+
+
+def _error_counts(rule_errors):
+    failing = set()
+    for errors in rule_errors.values():
+        failing.update(errors)
+    return len(failing), {rule: len(errors) for rule, errors in rule_errors.items() if errors}
+
+
+def _convert_stream(input_path, output_dir, batch, timings):
+    """
+    Validates and converts a CSV too large to load whole, chunk by chunk.
+    Returns the summary of its single output, or None if it cannot be streamed.
+    """
+    start = time.perf_counter()
+    stream = CsvStream(input_path)
+    if not stream.resolve():
+        return None
+    timings['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    duplicate_rows = None
+    if batch['unique_columns']:
+        duplicate_rows = find_duplicate_rows(
+            file_key_chunks(input_path, batch['unique_columns'], stream=stream),
+            batch['unique_columns'],
+            memory_rows=getattr(settings, 'CONVERTER_DUPLICATE_MEMORY_ROWS', 5000000),
+        )
+    _, rule_errors, rows = validate_chunks(stream.chunks, batch['required_columns'], batch['unique_columns'],
+                                           duplicate_rows)
+    timings['validate'] = time.perf_counter() - start
+    error_rows, rule_counts = _error_counts(rule_errors)
+    result = {'sheet': None, 'rows': rows, 'error_rows': error_rows, 'rule_errors': rule_counts,
+              'output': None, 'bytes': None}
+    if error_rows and not batch['allow_errors']:
+        return result
+
+    start = time.perf_counter()
+    chunk_size = block_size(getattr(settings, 'CONVERTER_PARTITION_ROWS', 10000), batch['options'])
+    converted = CsvStream(input_path, stream.delimiter, stream.encoding, trim_whitespace=True,
+                          chunk_size=chunk_size, dtypes=stream.dtypes, rows=stream.rows)
+    name = _output_name(input_path, None, batch)
+    result['bytes'] = _write_output(os.path.join(output_dir, name), iter_script_chunks(
+        converted.chunks(), converted.rows, batch['format'], _table_name(input_path, None, batch),
+        options=batch['options'],
+    ))
+    result['output'] = name
+    timings['generate'] = time.perf_counter() - start
+    return result
+
+
+def convert_file(input_path, output_dir, batch):
+    """
+    Parses, validates and converts one input file with the batch settings. Runs in
+    a worker process. Sheets whose rows fail validation get no output unless
+    `allow_errors` is set. Returns a summary dict; errors are reported in it, not raised.
+    """
+    summary = {'input': input_path, 'status': 'done', 'sheets': [], 'error': None}
+    timings = {'parse': 0.0, 'validate': 0.0, 'generate': 0.0}
+    summary['seconds'] = timings
+    try:
+        if input_path.lower().endswith('.csv') and \
+                (count_rows(input_path) or 0) > getattr(settings, 'CONVERTER_STREAMING_ROWS', 1000000):
+            result = _convert_stream(input_path, output_dir, batch, timings)
+            if result is not None:
+                summary['sheets'].append(result)
+                return _finish(summary)
+
+        sheet_names = None  # every sheet; a CSV has just one
+        if not input_path.lower().endswith('.csv') and not batch['all_sheets']:
+            first_sheet = batch['sheet'] or next(iter(get_sheet_names(input_path)), None)
+            if first_sheet is None:
+                raise ValueError("Cannot read the sheets of this workbook.")
+            sheet_names = [first_sheet]
+        sheets = iter_sheets(input_path, sheet_names, trim_whitespace=True,
+                             optimize=getattr(settings, 'CONVERTER_OPTIMIZE_DTYPES', True))
+        while True:
+            start = time.perf_counter()
+            try:
+                sheet_name, df = next(sheets)
+            except StopIteration:
+                break
+            timings['parse'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            _, rule_errors = validate_dataframe(df, batch['required_columns'], batch['unique_columns'])
+            timings['validate'] += time.perf_counter() - start
+            error_rows, rule_counts = _error_counts(rule_errors)
+            result = {'sheet': sheet_name or None, 'rows': len(df), 'error_rows': error_rows,
+                      'rule_errors': rule_counts, 'output': None, 'bytes': None}
+            summary['sheets'].append(result)
+            if error_rows and not batch['allow_errors']:
+                continue
+
+            start = time.perf_counter()
+            name = _output_name(input_path, sheet_name, batch)
+            result['bytes'] = _write_output(os.path.join(output_dir, name), iter_script(
+                df, batch['format'], _table_name(input_path, sheet_name, batch),
+                chunk_size=getattr(settings, 'CONVERTER_PARTITION_ROWS', 10000), options=batch['options'],
+            ))
+            result['output'] = name
+            timings['generate'] += time.perf_counter() - start
+    except Exception as e:
+        summary['status'] = 'failed'
+        summary['error'] = str(e)
+    return _finish(summary)
+
+
+def _finish(summary):
+    sheets = summary['sheets']
+    summary['rows'] = sum(sheet['rows'] for sheet in sheets)
+    summary['error_rows'] = sum(sheet['error_rows'] for sheet in sheets)
+    summary['outputs'] = [sheet['output'] for sheet in sheets if sheet['output']]
+    if summary['status'] == 'done' and any(sheet['output'] is None for sheet in sheets):
+        summary['status'] = 'invalid'
+    summary['seconds'] = {stage: round(seconds, 3) for stage, seconds in summary['seconds'].items()}
+    return summary
+
+
+def run_batch(input_paths, output_dir, batch, workers=1, force=False, log=None):
+    """
+    Converts every input file into `output_dir`, one file per worker process.
+    Inputs whose outputs are up to date (see is_up_to_date) are skipped unless
+    `force` is set. `log` is called with each file's summary as it finishes.
+    Returns the summaries in input order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    summaries = {}
+    pending = []
+    for path in input_paths:
+        if not force and is_up_to_date(manifest.get(path), path, output_dir, batch):
+            summaries[path] = {'input': path, 'status': 'skipped', 'outputs': manifest[path]['outputs']}
+            if log:
+                log(summaries[path])
+        else:
+            pending.append(path)
+
+    def record(summary):
+        path = summary['input']
+        summaries[path] = summary
+        # Outputs of an earlier run that this run did not write again are out of date
+        for name in set(manifest.get(path, {}).get('outputs', [])) - set(summary['outputs']):
+            if os.path.exists(os.path.join(output_dir, name)):
+                os.remove(os.path.join(output_dir, name))
+        if summary['status'] == 'failed':
+            manifest.pop(path, None)
+        else:
+            # Files failing validation are recorded too, so they are not retried until they change
+            manifest[path] = {'source': _source_state(path), 'settings': batch, 'outputs': summary['outputs']}
+        if log:
+            log(summary)
+
+    try:
+        if workers <= 1 or len(pending) <= 1:
+            for path in pending:
+                record(convert_file(path, output_dir, batch))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(convert_file, path, output_dir, batch) for path in pending]
+                for future in as_completed(futures):
+                    record(future.result())
+    finally:
+        # Whatever finished is remembered even if the run is interrupted
+        save_manifest(output_dir, manifest)
+    return [summaries[path] for path in input_paths if path in summaries]
@@ -0,0 +1,241 @@
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from .file_parser import parse_file
+from .script_generator import OUTPUT_FORMATS, iter_script
+from .validator import validate_file
+
+BENCHMARK_SCALES = [10000, 100000, 1000000]
+BENCHMARK_SHAPES = ['narrow', 'wide', 'mixed']
+BENCHMARK_FILE_TYPES = ['csv', 'xlsx']
+BENCHMARK_OUTPUT_FORMATS = ['sql', 'orm', 'json']
+# Columns in the wide shape
+WIDE_COLUMNS = 60
+# A stage is reported as a regression when it is this much slower than the baseline
+REGRESSION_TOLERANCE = 0.2
+
+
+def _narrow_frame(rows, rng):
+    return pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        'name': pd.Series(rng.integers(0, 5000, rows)).map('name {}'.format),
+        'amount': rng.normal(1000, 250, rows).round(2),
+        'created': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 3650, rows), unit='D'),
+        'active': rng.integers(0, 2, rows).astype(bool),
+    })
+
+
+def _wide_frame(rows, rng):
+    columns = {'id': np.arange(1, rows + 1)}
+    for i in range(1, WIDE_COLUMNS):
+        kind = i % 4
+        if kind == 0:
+            columns[f'int_{i}'] = rng.integers(-10000, 10000, rows)
+        elif kind == 1:
+            columns[f'float_{i}'] = rng.random(rows).round(4)
+        elif kind == 2:
+            columns[f'text_{i}'] = pd.Series(rng.integers(0, 500, rows)).map('value {}'.format)
+        else:
+            columns[f'code_{i}'] = pd.Series(rng.integers(0, 26, rows)).map(lambda n: chr(65 + n) * 3)
+    return pd.DataFrame(columns)
+
+
+def _mixed_frame(rows, rng):
+    """Dirty data: blanks, numbers and dates stored as text with a few bad values, duplicates."""
+    df = _narrow_frame(rows, rng)
+    blanks = rng.random(rows) < 0.02
+    df['name'] = df['name'].mask(blanks)
+    amount_text = df['amount'].astype(str)
+    amount_text[rng.random(rows) < 0.01] = 'n/a'
+    df['amount'] = amount_text
+    created_text = df['created'].dt.strftime('%Y-%m-%d')
+    created_text[rng.random(rows) < 0.01] = 'unknown'
+    df['created'] = created_text
+    df['code'] = pd.Series(rng.integers(0, max(rows // 2, 1), rows)).map('C{:07d}'.format)
+    df['note'] = np.where(rng.random(rows) < 0.5, ' padded text ', '')
+    return df
+
+
+SHAPE_BUILDERS = {
+    'narrow': _narrow_frame,
+    'wide': _wide_frame,
+    'mixed': _mixed_frame,
+}
+
+# Columns passed to validation as required / unique for each shape
+SHAPE_VALIDATION = {
+    'narrow': (['id', 'name'], ['id']),
+    'wide': (['id'], ['id']),
+    'mixed': (['name', 'amount'], ['code']),
+}
+
+
+def make_dataset(rows, shape='narrow', seed=0):
+    """
+    Builds a synthetic DataFrame. The same (rows, shape, seed) always gives the same data.
+    """
+    if shape not in SHAPE_BUILDERS:
+        raise ValueError(f"Unknown dataset shape: {shape}")
+    return SHAPE_BUILDERS[shape](rows, np.random.default_rng(seed))
+
+
+def dataset_path(data_dir, rows, shape, file_type, seed=0):
+    """
+    Writes the synthetic dataset to data_dir unless it is already there, and returns its path.
+    """
+    path = os.path.join(data_dir, f"bench_{shape}_{rows}_{seed}.{file_type}")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        df = make_dataset(rows, shape, seed)
+        partial_path = os.path.join(data_dir, f"bench_{shape}_{rows}_{seed}.part.{file_type}")
+        if file_type == 'csv':
+            df.to_csv(partial_path, index=False)
+        elif file_type == 'xlsx':
+            df.to_excel(partial_path, index=False, engine='openpyxl')
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        os.replace(partial_path, path)
+    return path
+
+
+def measure(func, repeat=1, memory=True):
+    """
+    Calls func() `repeat` times and returns (result, best_seconds, peak_bytes).
+    Peak memory comes from one extra tracemalloc run, so tracing never skews the timings.
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, best, peak
+
+
+def _consume_script(df, output_format):
+    size = 0
+    for _, text in iter_script(df, output_format, options=OUTPUT_FORMATS[output_format]['defaults']):
+        size += len(text)
+    return size
+
+
+def run_benchmarks(data_dir, scales=None, shapes=None, file_types=None, output_formats=None,
+                   repeat=1, memory=True, seed=0, log=None):
+    """
+    Times parse, validate and generate for every combination of scale, shape and file type.
+    Returns a list of result dicts, one per stage and dataset.
+    """
+    results = []
+
+    def record(dataset_info, stage, seconds, peak, skipped=None):
+        result = dict(dataset_info, stage=stage,
+                      seconds=None if seconds is None else round(seconds, 4), peak_bytes=peak)
+        if skipped:
+            result['skipped'] = skipped
+        results.append(result)
+        if log:
+            log(result)
+
+    for file_type in file_types or BENCHMARK_FILE_TYPES:
+        for shape in shapes or BENCHMARK_SHAPES:
+            for rows in scales or BENCHMARK_SCALES:
+                path = dataset_path(data_dir, rows, shape, file_type, seed)
+                required, unique = SHAPE_VALIDATION[shape]
+
+                sheet_name = 'Sheet1' if file_type == 'xlsx' else None
+                df, seconds, peak = measure(
+                    lambda: parse_file(path, sheet_name=sheet_name, trim_whitespace=True), repeat, memory)
+                if df is None:
+                    raise ValueError(f"Failed to parse benchmark dataset {path}")
+                info = {
+                    'dataset': f"{file_type}/{shape}/{rows}",
+                    'file_type': file_type,
+                    'shape': shape,
+                    'rows': rows,
+                    'columns': len(df.columns),
+                }
+                record(info, 'parse', seconds, peak)
+
+                _, seconds, peak = measure(lambda: validate_file(path, required, unique, df=df), repeat, memory)
+                record(info, 'validate', seconds, peak)
+
+                for output_format in output_formats or BENCHMARK_OUTPUT_FORMATS:
+                    stage = f'generate_{output_format}'
+                    max_rows = OUTPUT_FORMATS[output_format].get('max_rows')
+                    if max_rows and len(df) > max_rows:
+                        record(info, stage, None, None, skipped=f'over the {max_rows} row limit')
+                        continue
+                    _, seconds, peak = measure(lambda: _consume_script(df, output_format), repeat, memory)
+                    record(info, stage, seconds, peak)
+                del df
+    return results
+
+
+def benchmark_report(results, **settings):
+    """
+    Wraps benchmark results with the environment they were measured in.
+    """
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': settings,
+        'results': results,
+    }
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline_results, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compares results with a baseline run, matching stages by dataset and stage name.
+    Each comparison has the time and memory ratios and a `regression` flag.
+    """
+    baseline = {(r['dataset'], r['stage']): r for r in baseline_results}
+    comparisons = []
+    for result in results:
+        base = baseline.get((result['dataset'], result['stage']))
+        if base is None or not result['seconds'] or not base.get('seconds'):
+            continue
+        time_ratio = result['seconds'] / base['seconds']
+        memory_ratio = None
+        if result['peak_bytes'] and base.get('peak_bytes'):
+            memory_ratio = result['peak_bytes'] / base['peak_bytes']
+        comparisons.append({
+            'dataset': result['dataset'],
+            'stage': result['stage'],
+            'seconds': result['seconds'],
+            'baseline_seconds': base['seconds'],
+            'time_ratio': round(time_ratio, 3),
+            'memory_ratio': None if memory_ratio is None else round(memory_ratio, 3),
+            'regression': time_ratio > 1 + tolerance
+                          or (memory_ratio is not None and memory_ratio > 1 + tolerance),
+        })
+    return comparisons
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from django.conf import settings
+
+from .file_parser import parse_file
+from .timing import span
+
+
+def _touch(path):
+    # A snapshot's modification time records its last use, for storage retention
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+class DatasetCache:
+    """
+    Two-level cache of parsed DataFrames.
+
+    Parsed frames are kept in an in-process LRU bounded by their in-memory size
+    and snapshotted to disk, so a frame evicted from memory (or lost on restart)
+    is reloaded from the snapshot instead of re-parsing the spreadsheet.
+    Cached frames are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes, cache_dir):
+        self.max_bytes = max_bytes
+        self.cache_dir = str(cache_dir)
+        self._entries = OrderedDict()  # key -> (df, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _snapshot_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key[0]}_{digest}.pkl")
+
+    def get(self, key):
+        snapshot = self._snapshot_path(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            _touch(snapshot)
+            return entry[0]
+
+        if os.path.exists(snapshot):
+            try:
+                df = pd.read_pickle(snapshot)
+            except Exception as e:
+                print(f"Error reading dataset snapshot: {e}", flush=True)
+            else:
+                _touch(snapshot)
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, df)
+                return df
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, df):
+        partial_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Written under a temporary name so a reader never loads a half-written snapshot
+            fd, partial_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+            os.close(fd)
+            df.to_pickle(partial_path, compression=None)
+            os.replace(partial_path, self._snapshot_path(key))
+        except Exception as e:
+            print(f"Error writing dataset snapshot: {e}", flush=True)
+            if partial_path is not None and os.path.exists(partial_path):
+                os.remove(partial_path)
+        self._remember(key, df)
+
+    def _remember(self, key, df):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (df, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+
+    def forget(self, owner):
+        """
+        Drops every cached frame and snapshot of one upload, given the first element
+        of its keys (a content hash, or an upload id for uploads without one).
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == owner]:
+                self._bytes -= self._entries.pop(key)[1]
+        prefix = f"{owner}_"
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except OSError as e:
+                        print(f"Error removing dataset snapshot: {e}", flush=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_dataset_cache():
+    """
+    Returns the process-wide DatasetCache configured from settings.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DatasetCache(
+                max_bytes=getattr(settings, 'DATASET_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+                cache_dir=getattr(settings, 'DATASET_CACHE_DIR',
+                                  os.path.join(settings.BASE_DIR, 'converter', 'cache')),
+            )
+        return _cache
+
+
+def dataset_key(uploaded, sheet_name=None, trim_whitespace=False):
+    """
+    Builds the cache key for an UploadedFile. Uploads are keyed by content hash, so
+    repeated uploads of the same file share one snapshot. Uploads without a hash
+    fall back to the file's mtime and size, so a replaced file never serves a stale snapshot.
+    """
+    if uploaded.content_hash:
+        return (uploaded.content_hash, sheet_name or '', bool(trim_whitespace))
+    stat = os.stat(uploaded.file.path)
+    return (uploaded.id, sheet_name or '', bool(trim_whitespace), stat.st_mtime_ns, stat.st_size)
+
+
+def load_dataset(uploaded, sheet_name=None, trim_whitespace=False):
+    """
+    Returns the parsed DataFrame for an UploadedFile, parsing it only on a cache miss.
+    Returns None if the file cannot be parsed, like parse_file.
+    Frames are dtype-optimized (CONVERTER_OPTIMIZE_DTYPES) and the memory saved is
+    recorded on the sheet's metadata.
+    """
+    cache = get_dataset_cache()
+    key = dataset_key(uploaded, sheet_name, trim_whitespace)
+    with span('cache_load'):
+        df = cache.get(key)
+    if df is None:
+        df = parse_file(uploaded.file.path, sheet_name=sheet_name, trim_whitespace=trim_whitespace,
+                        optimize=getattr(settings, 'CONVERTER_OPTIMIZE_DTYPES', True),
+                        **uploaded.parse_options())
+        if df is not None:
+            memory = df.attrs.get('memory')
+            if memory:
+                uploaded.sheets.filter(name=sheet_name or '').update(
+                    memory_bytes=memory['before'], optimized_memory_bytes=memory['after'],
+                )
+            with span('cache_store'):
+                cache.put(key, df)
+    return df
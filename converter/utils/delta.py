@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+
+from .file_parser import expand_categoricals
+from .script_generator import SQL_CHUNK_SIZE, _quote_identifier, _sql_literal_column, format_sql_rows
+from .timing import span
+
+# Output formats that can be generated as a delta against an earlier upload
+DELTA_FORMATS = ('sql', 'sql_bulk')
+
+
+class TableDelta:
+    """
+    The rows that differ between two versions of a table, matched on key columns.
+    Rows are 0-based row numbers; `deleted` holds the SQL literals of the keys of
+    removed rows, one column per key column.
+    """
+
+    def __init__(self, columns, key_columns, inserted, updated_old, updated_new, deleted):
+        self.columns = columns
+        self.key_columns = key_columns
+        self.inserted = inserted
+        self.updated_old = updated_old
+        self.updated_new = updated_new
+        self.deleted = deleted
+
+    @property
+    def changes(self):
+        return len(self.inserted) + len(self.updated_new) + len(self.deleted)
+
+
+def _literal_frame(df, dialect):
+    return pd.DataFrame({position: _sql_literal_column(df.iloc[:, position], dialect)
+                         for position in range(df.shape[1])}, index=df.index)
+
+
+def _fingerprints(chunks, columns, key_columns, dialect, side):
+    """
+    Returns one row per table row: the SQL literals of its key columns, a hash of
+    the literals of all its columns ('row_hash') and its row number ('row').
+    Cells are compared as the script would write them, so a value parsed as another
+    dtype in one version only counts as changed if its literal changes.
+    """
+    key_positions = [columns.index(key) for key in key_columns]
+    frames = []
+    offset = 0
+    for chunk in chunks:
+        if set(chunk.columns) != set(columns):
+            missing = [col for col in columns if col not in chunk.columns]
+            extra = [col for col in chunk.columns if col not in columns]
+            raise ValueError(
+                f"The {side} upload has different columns"
+                + (f"; missing: {', '.join(map(str, missing))}" if missing else '')
+                + (f"; extra: {', '.join(map(str, extra))}" if extra else '')
+            )
+        literals = _literal_frame(expand_categoricals(chunk[list(columns)]), dialect)
+        keys = literals[key_positions]
+        keys.columns = [f"key_{i}" for i in range(len(key_positions))]
+        for i, key in enumerate(key_columns):
+            if keys.iloc[:, i].eq('NULL').any():
+                raise ValueError(f"Key column '{key}' has blank values in the {side} upload.")
+        keys = keys.assign(row_hash=pd.util.hash_pandas_object(literals, index=False).to_numpy(),
+                           row=np.arange(offset, offset + len(chunk)))
+        frames.append(keys)
+        offset += len(chunk)
+    if not frames:
+        # An empty upload has no rows to match
+        frames.append(pd.DataFrame({**{f"key_{i}": pd.Series(dtype=object) for i in range(len(key_positions))},
+                                    'row_hash': pd.Series(dtype='uint64'), 'row': pd.Series(dtype='int64')}))
+    fingerprints = pd.concat(frames, ignore_index=True)
+    duplicated = fingerprints.duplicated(subset=[f"key_{i}" for i in range(len(key_positions))])
+    if duplicated.any():
+        raise ValueError(
+            f"Key columns {', '.join(map(str, key_columns))} are not unique in the {side} upload "
+            f"({int(duplicated.sum())} repeated keys)."
+        )
+    return fingerprints
+
+
+def diff_tables(old_chunks, new_chunks, key_columns, dialect='generic'):
+    """
+    Compares two versions of a table row by row, matching rows on `key_columns`.
+
+    `old_chunks` and `new_chunks` are callables returning iterators of DataFrames in
+    row order (see frame_chunks). Only the key literals and a hash of each row are
+    kept, so memory grows with the row count but not with the width of the rows.
+    The new version's column order is used; both must have the same columns.
+    Either version may be empty, making every row of the other an insert or a delete.
+    """
+    new_chunks = iter(new_chunks())
+    first_new = next(new_chunks, None)
+    old_chunks = iter(old_chunks())
+    first_old = next(old_chunks, None)
+    first = first_new if first_new is not None else first_old
+    key_columns = list(key_columns)
+    columns = list(first.columns) if first is not None else key_columns
+    unknown = [key for key in key_columns if key not in columns]
+    if not key_columns or unknown:
+        raise ValueError(f"Unknown key columns: {', '.join(map(str, unknown))}" if unknown
+                         else "Choose at least one key column.")
+
+    with span('delta', keys=len(key_columns)) as timing:
+        new = _fingerprints(_chained(first_new, new_chunks), columns, key_columns, dialect, 'new')
+        old = _fingerprints(_chained(first_old, old_chunks), columns, key_columns, dialect, 'previous')
+        keys = [f"key_{i}" for i in range(len(key_columns))]
+        merged = old.merge(new, on=keys, how='outer', suffixes=('_old', '_new'), indicator=True)
+
+        inserted = np.sort(merged.loc[merged['_merge'] == 'right_only', 'row_new'].to_numpy(dtype=np.int64))
+        removed = merged[merged['_merge'] == 'left_only'].sort_values('row_old')
+        changed = merged[(merged['_merge'] == 'both') & (merged['row_hash_old'] != merged['row_hash_new'])]
+        changed = changed.sort_values('row_new')
+        delta = TableDelta(
+            columns, key_columns, inserted,
+            updated_old=changed['row_old'].to_numpy(dtype=np.int64),
+            updated_new=changed['row_new'].to_numpy(dtype=np.int64),
+            deleted=removed[keys].reset_index(drop=True),
+        )
+        timing.add(rows=len(new))
+    return delta
+
+
+def _chained(first, rest):
+    if first is not None:
+        yield first
+    yield from rest
+
+
+def _where_clause(key_literals, key_columns, dialect):
+    clause = None
+    for position, key in enumerate(key_columns):
+        condition = _quote_identifier(key, dialect) + " = " + key_literals.iloc[:, position]
+        clause = condition if clause is None else clause + " AND " + condition
+    return clause
+
+
+def format_sql_deletes(key_literals, table_name, key_columns, dialect='generic'):
+    """
+    Formats DELETE statements for rows identified by the SQL literals of their keys.
+    """
+    where = _where_clause(key_literals, key_columns, dialect)
+    return '\n'.join((f"DELETE FROM {table_name} WHERE " + where + ";").tolist())
+
+
+def format_sql_updates(old_rows, new_rows, table_name, key_columns, dialect='generic'):
+    """
+    Formats UPDATE statements turning each row of `old_rows` into the matching row of
+    `new_rows`. Only the columns whose values changed are set.
+    """
+    old_literals = _literal_frame(expand_categoricals(old_rows[new_rows.columns]), dialect).to_numpy()
+    new_literals = _literal_frame(expand_categoricals(new_rows), dialect)
+    columns = list(new_rows.columns)
+    key_positions = {columns.index(key) for key in key_columns}
+    assignments = np.empty(new_literals.shape, dtype=object)
+    for position, col in enumerate(columns):
+        assignment = (_quote_identifier(col, dialect) + " = " + new_literals.iloc[:, position]).to_numpy()
+        changed = new_literals.iloc[:, position].to_numpy() != old_literals[:, position]
+        assignments[:, position] = np.where(changed & (position not in key_positions), assignment, '')
+    where = _where_clause(new_literals[[columns.index(key) for key in key_columns]], key_columns, dialect).tolist()
+    statements = []
+    for row, condition in zip(assignments, where):
+        fields = ', '.join(field for field in row if field)
+        if fields:
+            statements.append(f"UPDATE {table_name} SET {fields} WHERE {condition};")
+    return '\n'.join(statements)
+
+
+def frame_rows(df):
+    """
+    Returns a row fetcher for iter_delta_script over an in-memory DataFrame.
+    """
+    return lambda rows: df.iloc[rows].set_axis(pd.Index(rows))
+
+
+def iter_delta_script(delta, old_rows, new_rows, table_name, options=None, chunk_size=SQL_CHUNK_SIZE):
+    """
+    Yields (changes_done, text) pairs for the SQL script applying `delta`: DELETE
+    statements first, so reused keys do not collide, then UPDATEs, then INSERTs.
+    Joining the text gives the complete script.
+
+    `old_rows` and `new_rows` take a sorted array of row numbers and return those
+    rows as a DataFrame indexed by row number (see frame_rows, CsvStream.read_rows).
+    Rows are fetched `chunk_size` at a time. `options` are the SQL format options.
+    """
+    options = options or {}
+    dialect = options.get('dialect', 'generic')
+    key_columns = delta.key_columns
+    transaction = options.get('transaction', False)
+    done = 0
+    first = True
+
+    def piece(text):
+        nonlocal first
+        if first:
+            first = False
+            begin = ('START TRANSACTION;' if dialect == 'mysql' else 'BEGIN;') if transaction else ''
+            return begin + '\n' + text if begin else text
+        return '\n' + text
+
+    if not delta.changes:
+        yield 0, piece('-- No changes.') + ('\nCOMMIT;' if transaction else '')
+        return
+
+    for start in range(0, len(delta.deleted), chunk_size):
+        keys = delta.deleted.iloc[start:start + chunk_size]
+        done += len(keys)
+        yield done, piece(format_sql_deletes(keys, table_name, key_columns, dialect))
+
+    for start in range(0, len(delta.updated_new), chunk_size):
+        new_positions = delta.updated_new[start:start + chunk_size]
+        old_positions = delta.updated_old[start:start + chunk_size]
+        old = old_rows(np.sort(old_positions)).loc[old_positions]
+        new = new_rows(new_positions)
+        done += len(new_positions)
+        text = format_sql_updates(old, new, table_name, key_columns, dialect)
+        if text:
+            yield done, piece(text)
+
+    batch_size = options.get('batch_size', 1)
+    if batch_size > 1:
+        chunk_size = -(-chunk_size // batch_size) * batch_size
+    for start in range(0, len(delta.inserted), chunk_size):
+        rows = new_rows(delta.inserted[start:start + chunk_size])[delta.columns]
+        done += len(rows)
+        yield done, piece(format_sql_rows(expand_categoricals(rows), table_name, batch_size=batch_size,
+                                          column_list=options.get('column_list', False), dialect=dialect))
+
+    if transaction:
+        yield done, '\nCOMMIT;'
@@ -0,0 +1,225 @@
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .streaming import CsvStream
+from .timing import span
+from .xlsx_reader import XlsxRows
+
+# Key hashes kept in memory before they are spilled to bucket files on disk (16 bytes each)
+DUPLICATE_MEMORY_ROWS = 5000000
+# Number of bucket files hashes are partitioned into when spilling
+SPILL_BUCKETS = 64
+KEY_CHUNK_ROWS = 100000
+
+_PAIR = np.dtype([('hash', '<u8'), ('row', '<i8')])
+
+
+def _hash_pairs(chunk, unique_columns, offset):
+    pairs = np.empty(len(chunk), dtype=_PAIR)
+    pairs['hash'] = pd.util.hash_pandas_object(chunk[list(unique_columns)], index=False).to_numpy()
+    pairs['row'] = np.arange(offset, offset + len(chunk))
+    return pairs
+
+
+def _repeated_pairs(pairs):
+    """
+    Returns the pairs whose hash occurs more than once in `pairs`.
+    """
+    if len(pairs) < 2:
+        return pairs[:0]
+    order = np.argsort(pairs['hash'], kind='stable')
+    hashes = pairs['hash'][order]
+    same = hashes[1:] == hashes[:-1]
+    repeated = np.zeros(len(pairs), dtype=bool)
+    repeated[1:] |= same
+    repeated[:-1] |= same
+    return pairs[order[repeated]]
+
+
+class _HashSpill:
+    """
+    Key hashes partitioned by value into bucket files, so each bucket can be
+    searched for repeats on its own. The key values of the repeats are then
+    partitioned the same way, so they are also compared one bucket at a time.
+    """
+
+    def __init__(self, directory, buckets=SPILL_BUCKETS):
+        self.directory = directory
+        self.buckets = buckets
+        self._files = [open(os.path.join(directory, f"bucket_{i}.bin"), 'wb') for i in range(buckets)]
+        self._key_files = {}
+
+    def _partition(self, bucket_ids):
+        order = np.argsort(bucket_ids, kind='stable')
+        bounds = np.searchsorted(bucket_ids[order], np.arange(self.buckets + 1))
+        for bucket in range(self.buckets):
+            if bounds[bucket] < bounds[bucket + 1]:
+                yield bucket, order[bounds[bucket]:bounds[bucket + 1]]
+
+    def write(self, pairs):
+        for bucket, positions in self._partition(pairs['hash'] % self.buckets):
+            pairs[positions].tofile(self._files[bucket])
+
+    def repeated_pairs(self):
+        for f in self._files:
+            f.close()
+        found = [_repeated_pairs(np.fromfile(f.name, dtype=_PAIR)) for f in self._files]
+        return np.concatenate(found)
+
+    def write_keys(self, keys, hashes):
+        for bucket, positions in self._partition(hashes % self.buckets):
+            if bucket not in self._key_files:
+                self._key_files[bucket] = open(os.path.join(self.directory, f"keys_{bucket}.pkl"), 'wb')
+            pickle.dump(keys.iloc[positions], self._key_files[bucket], protocol=pickle.HIGHEST_PROTOCOL)
+
+    def key_buckets(self):
+        """
+        Yields the key values written for each bucket as one DataFrame.
+        """
+        for f in self._key_files.values():
+            f.close()
+            frames = []
+            with open(f.name, 'rb') as keys:
+                while True:
+                    try:
+                        frames.append(pickle.load(keys))
+                    except EOFError:
+                        break
+            yield pd.concat(frames)
+
+
+def _candidates(chunks, unique_columns, memory_rows, directory):
+    """
+    Hashes the key tuples and returns (pairs, spill): the (hash, row) pairs of the
+    rows whose hash repeats, sorted by row, and the _HashSpill they were found
+    with, or None if they all fit in memory.
+    """
+    buffered = []
+    buffered_rows = 0
+    spill = None
+    offset = 0
+    for chunk in chunks:
+        pairs = _hash_pairs(chunk, unique_columns, offset)
+        offset += len(chunk)
+        if spill is not None:
+            spill.write(pairs)
+            continue
+        buffered.append(pairs)
+        buffered_rows += len(pairs)
+        if buffered_rows > memory_rows:
+            spill = _HashSpill(directory)
+            for buffered_pairs in buffered:
+                spill.write(buffered_pairs)
+            buffered = []
+
+    if spill is not None:
+        pairs = spill.repeated_pairs()
+    else:
+        pairs = _repeated_pairs(np.concatenate(buffered)) if buffered else np.empty(0, dtype=_PAIR)
+    return pairs[np.argsort(pairs['row'], kind='stable')], spill
+
+
+def _verify(chunks, unique_columns, candidates, spill=None):
+    """
+    Compares the actual key values of the candidate rows, so a hash collision
+    never reports rows that are not duplicates. Equal keys hash alike, so with a
+    spill the values are compared one hash bucket at a time.
+    """
+    rows = candidates['row']
+    frames = []
+    offset = 0
+    for chunk in chunks:
+        lo, hi = np.searchsorted(rows, [offset, offset + len(chunk)])
+        if lo < hi:
+            keys = chunk[list(unique_columns)].iloc[rows[lo:hi] - offset]
+            keys.index = rows[lo:hi]
+            if spill is None:
+                frames.append(keys)
+            else:
+                spill.write_keys(keys, candidates['hash'][lo:hi])
+        offset += len(chunk)
+    buckets = spill.key_buckets() if spill is not None else [pd.concat(frames)] if frames else []
+    found = [keys.index[keys.duplicated(keep=False)].to_numpy() for keys in buckets]
+    return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+
+def find_duplicate_rows(chunks, unique_columns, memory_rows=DUPLICATE_MEMORY_ROWS, spill_dir=None):
+    """
+    Finds every row whose `unique_columns` values also occur in another row, like
+    df.duplicated(subset=unique_columns, keep=False), without holding all rows in memory.
+
+    `chunks` is a callable returning an iterator of DataFrames in row order, holding
+    at least the key columns, each column with the same dtype in every chunk. It is
+    called twice: the first pass hashes the key tuples (spilling to disk-partitioned
+    buckets above `memory_rows`), the second compares the actual values of rows whose
+    hashes repeat, bucket by bucket when the hashes were spilled.
+    Returns the sorted 0-based row numbers of all members of every duplicate group.
+    """
+    with span('duplicates') as timing:
+        with tempfile.TemporaryDirectory(dir=spill_dir, prefix='duplicates_') as directory:
+            candidates, spill = _candidates(chunks(), unique_columns, memory_rows, directory)
+            if len(candidates):
+                rows = _verify(chunks(), unique_columns, candidates, spill)
+            else:
+                rows = candidates['row'].astype(np.int64)
+        timing.add(rows=len(rows))
+    return rows
+
+
+def frame_chunks(df, chunk_size=KEY_CHUNK_ROWS):
+    """
+    Returns a chunk source for find_duplicate_rows over an in-memory DataFrame.
+    """
+    return lambda: (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+
+
+def _xlsx_keys(file_path, sheet_name, usecols, chunk_size):
+    """
+    Reads the key columns of a worksheet, streaming its rows, with the dtypes
+    read_excel gives them. Chunks are typed one at a time, so their key columns are
+    joined before a column can get one dtype across the sheet.
+    """
+    # A column added by a wide row is missing from the chunks before it
+    keys = pd.concat([chunk.reindex(columns=usecols) for chunk in XlsxRows(file_path, sheet_name).chunks(chunk_size)])
+    for position in range(len(usecols)):
+        series = keys.iloc[:, position]
+        if series.dtype == object:
+            # A whole number from a chunk typed as floats is an int in a text column
+            keys.isetitem(position, series.map(lambda value: int(value)
+                                               if isinstance(value, float) and value.is_integer() else value))
+    return keys
+
+
+def file_key_chunks(file_path, unique_columns, sheet_name=None, chunk_size=KEY_CHUNK_ROWS,
+                    delimiter=None, encoding=None, stream=None):
+    """
+    Returns a chunk source for find_duplicate_rows that reads only the key columns
+    of a file. Keys get the dtypes parse_file gives them, as validation sees them, so
+    rows compare as df.duplicated compares the parsed sheet. For a CSV, `stream` can
+    be a resolved CsvStream over the file, whose column dtypes are then reused.
+    """
+    usecols = list(unique_columns)
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext == '.csv':
+        csv = CsvStream(file_path, delimiter, encoding, chunk_size=chunk_size,
+                        dtypes=stream.dtypes if stream is not None else None,
+                        rows=stream.rows if stream is not None else None)
+
+    def chunks():
+        if ext == '.csv':
+            if csv.resolve():
+                yield from csv.chunks(usecols)
+                return
+            # Columns the chunked reader cannot type like a whole-file read are read whole
+            keys = csv._read(usecols=usecols)
+        elif ext == '.xlsx':
+            keys = _xlsx_keys(file_path, sheet_name, usecols, chunk_size)
+        else:
+            keys = pd.read_excel(file_path, sheet_name=sheet_name or 0, usecols=usecols)
+        for start in range(0, len(keys), chunk_size):
+            yield keys.iloc[start:start + chunk_size]
+    return chunks
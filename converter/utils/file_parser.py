@@ -1,29 +1,252 @@
+import codecs
+import csv
+import hashlib
 import os
+import numpy as np
 import pandas as pd
+from django.conf import settings
 
-def parse_file(file_path, sheet_name=None, trim_whitespace=False):
+from .timing import span, timed
+from .xlsx_reader import open_xlsx, read_xlsx
+
+try:
+    import pyarrow  # noqa: F401  (enables pandas' multithreaded CSV engine)
+except ImportError:
+    pyarrow = None
+
+# Bytes read from the start of a CSV file to guess its encoding and delimiter
+CSV_SNIFF_BYTES = 64 * 1024
+# Text columns with at most this share of distinct values are stored as categoricals,
+# in frames of at least CATEGORY_MIN_ROWS rows where that outweighs the category table
+CATEGORY_MAX_RATIO = 0.5
+CATEGORY_MIN_ROWS = 1000
+
+
+def parse_file(file_path, sheet_name=None, trim_whitespace=False, nrows=None, delimiter=None, encoding=None,
+               optimize=False):
+    """
+    Parses a CSV or Excel file into a DataFrame.
+    With `nrows`, only the header and the first `nrows` data rows are read.
+    `delimiter` and `encoding` apply to CSV files only and are sniffed when not given.
+    With `optimize`, column dtypes are shrunk (see optimize_dtypes) and the memory
+    used before and after is left in df.attrs['memory'].
+    """
     ext = os.path.splitext(file_path)[-1].lower()
     try:
-        if ext in ['.xls', '.xlsx']:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-        elif ext == '.csv':
-            df = pd.read_csv(file_path)
-        else:
-            raise ValueError(f"Unsupported file type: {ext}")
+        with span('parse', file_type=ext.lstrip('.'), nrows=nrows) as timing:
+            if ext == '.xlsx' and xlsx_streaming():
+                df = read_xlsx(file_path, sheet_name=sheet_name, nrows=nrows)
+            elif ext in ['.xls', '.xlsx']:
+                df = pd.read_excel(file_path, sheet_name=sheet_name, nrows=nrows)
+            elif ext == '.csv':
+                df = read_csv(file_path, nrows=nrows, delimiter=delimiter, encoding=encoding)
+            else:
+                raise ValueError(f"Unsupported file type: {ext}")
+            timing.add(rows=len(df))
 
         if df.empty:
             print("Parsed DataFrame is empty.", flush=True)
 
-        if trim_whitespace:
-            df.columns = df.columns.str.strip()
-            df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-
-        return df
+        return _prepare_frame(df, trim_whitespace, optimize)
     except Exception as e:
         print(f"Error parsing file: {e}", flush=True)
         return None
 
 
+def _prepare_frame(df, trim_whitespace=False, optimize=False):
+    if trim_whitespace:
+        with span('trim'):
+            df.columns = df.columns.str.strip()
+            df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
+
+    if optimize:
+        with span('optimize'):
+            df, memory = optimize_dtypes(df)
+        df.attrs['memory'] = memory
+    return df
+
+
+def iter_sheets(file_path, sheet_names=None, trim_whitespace=False, optimize=False, delimiter=None, encoding=None):
+    """
+    Yields (sheet_name, df) for each sheet of a workbook (or only `sheet_names`), opening
+    the file once and parsing one sheet at a time. A CSV file yields a single ('', df).
+    Unlike parse_file, parsing errors are raised.
+    """
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext == '.csv':
+        with span('parse', file_type='csv') as timing:
+            df = read_csv(file_path, delimiter=delimiter, encoding=encoding)
+            timing.add(rows=len(df))
+        yield '', _prepare_frame(df, trim_whitespace, optimize)
+        return
+    if ext not in ['.xls', '.xlsx']:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+    if ext == '.xlsx' and xlsx_streaming():
+        workbook = open_xlsx(file_path)
+        try:
+            for sheet_name in sheet_names or workbook.sheetnames:
+                with span('parse', file_type='xlsx', sheet=sheet_name) as timing:
+                    df = read_xlsx(file_path, sheet_name=sheet_name, workbook=workbook)
+                    timing.add(rows=len(df))
+                yield sheet_name, _prepare_frame(df, trim_whitespace, optimize)
+        finally:
+            workbook.close()
+        return
+
+    with pd.ExcelFile(file_path) as workbook:
+        for sheet_name in sheet_names or workbook.sheet_names:
+            with span('parse', file_type=ext.lstrip('.'), sheet=sheet_name) as timing:
+                df = workbook.parse(sheet_name)
+                timing.add(rows=len(df))
+            yield sheet_name, _prepare_frame(df, trim_whitespace, optimize)
+
+
+def xlsx_streaming():
+    """
+    Returns True if .xlsx sheets are read with the streaming reader (see xlsx_reader)
+    rather than pd.read_excel, as set by CONVERTER_XLSX_READER.
+    """
+    return getattr(settings, 'CONVERTER_XLSX_READER', 'stream') == 'stream'
+
+
+def csv_engine(engine=None):
+    """
+    Resolves the CSV reader to use: 'pyarrow' or 'c'. 'auto' (the default, from
+    CONVERTER_CSV_ENGINE) picks pyarrow when it is installed.
+    """
+    engine = engine or getattr(settings, 'CONVERTER_CSV_ENGINE', 'auto')
+    if engine == 'auto':
+        engine = 'pyarrow' if pyarrow is not None else 'c'
+    if engine == 'pyarrow' and pyarrow is None:
+        engine = 'c'
+    return engine
+
+
+def sniff_csv_file(file_path):
+    """
+    Returns the (encoding, delimiter) guessed from the start of a CSV file.
+    """
+    with open(file_path, 'rb') as f:
+        return sniff_csv_format(f.read(CSV_SNIFF_BYTES))
+
+
+def read_csv(file_path, nrows=None, delimiter=None, encoding=None, engine=None):
+    """
+    Reads a CSV file with the configured engine. A missing delimiter or encoding
+    is sniffed from the start of the file.
+
+    Whichever engine runs, the result has the same column names, dtypes and values:
+    pyarrow parses floats exactly, so when it is the configured engine the C engine
+    (used for bounded `nrows` reads, which pyarrow cannot do) parses them round-trip too.
+    """
+    if delimiter is None or encoding is None:
+        sniffed_encoding, sniffed_delimiter = sniff_csv_file(file_path)
+        delimiter = delimiter or sniffed_delimiter
+        encoding = encoding or sniffed_encoding
+
+    engine = csv_engine(engine)
+    if engine == 'pyarrow' and nrows is None:
+        try:
+            df = pd.read_csv(file_path, sep=delimiter, encoding=encoding, engine='pyarrow')
+        except Exception as e:
+            print(f"pyarrow CSV engine failed, falling back to the C engine: {e}", flush=True)
+        else:
+            # Take the header from the C engine, which renames blank and duplicate names
+            header = pd.read_csv(file_path, nrows=0, sep=delimiter, encoding=encoding).columns
+            if len(header) == len(df.columns):
+                df.columns = header
+            # pyarrow leaves missing text as None where the C engine uses NaN
+            for position in np.flatnonzero((df.dtypes == object).to_numpy()):
+                series = df.iloc[:, position]
+                if series.isna().any():
+                    df.isetitem(position, series.where(series.notna(), np.nan))
+            # Columns pyarrow parses differently are taken from the C engine instead
+            reread = [position for position in range(len(df.columns))
+                      if _pyarrow_differs(df.iloc[:, position])]
+            if reread:
+                c_columns = pd.read_csv(file_path, sep=delimiter, encoding=encoding, usecols=reread,
+                                        float_precision='round_trip')
+                for position, column in zip(reread, c_columns.columns):
+                    df.isetitem(position, c_columns[column])
+            return df
+
+    options = {'float_precision': 'round_trip'} if engine == 'pyarrow' else {}
+    return pd.read_csv(file_path, nrows=nrows, sep=delimiter, encoding=encoding, **options)
+
+
+def _pyarrow_differs(series):
+    """
+    Returns True if pyarrow may have parsed a column differently from the C engine:
+    dates, times and timestamps, which the C engine leaves as text, and floats too
+    large to be exact, which may be integers beyond int64 that the C engine reads
+    as uint64 or text.
+    """
+    dtype = series.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_timedelta64_dtype(dtype):
+        return True
+    if dtype == object:
+        return pd.api.types.infer_dtype(series, skipna=True) in ('date', 'datetime', 'time')
+    if pd.api.types.is_float_dtype(dtype):
+        return bool((series.abs() >= 2 ** 53).any())
+    return False
+
+
+def optimize_dtypes(df):
+    """
+    Shrinks a parsed frame: integer columns are downcast to the smallest integer type
+    holding their values, and low-cardinality text columns become categoricals.
+    Floats keep 64 bits so their values, and the scripts generated from them, do not change.
+    Returns (df, {'before': bytes, 'after': bytes}).
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    columns = []
+    changed = False
+    for position in range(len(df.columns)):
+        series = df.iloc[:, position]
+        if pd.api.types.is_integer_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+            optimized = pd.to_numeric(series, downcast='integer')
+        elif series.dtype == object and len(series) >= CATEGORY_MIN_ROWS \
+                and series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series) \
+                and pd.api.types.infer_dtype(series, skipna=True) == 'string':
+            optimized = series.astype('category')
+        else:
+            optimized = series
+        changed = changed or optimized is not series
+        columns.append(optimized)
+
+    if changed:
+        optimized_df = pd.concat(columns, axis=1)
+        optimized_df.columns = df.columns
+        optimized_df.attrs = dict(df.attrs)
+        df = optimized_df
+    return df, {'before': before, 'after': int(df.memory_usage(deep=True).sum())}
+
+
+def expand_categoricals(df):
+    """
+    Turns categorical columns back into plain columns of their values, for code
+    that formats or edits cells one by one.
+    """
+    categorical = [position for position, dtype in enumerate(df.dtypes)
+                   if isinstance(dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return df
+    df = df.copy(deep=False)
+    for position in categorical:
+        series = df.iloc[:, position]
+        df.isetitem(position, series.astype(series.cat.categories.dtype))
+    return df
+
+
+def fill_blanks(df, value=''):
+    """
+    Returns a copy of df with missing cells replaced by `value`, categoricals included.
+    """
+    df = expand_categoricals(df)
+    return df.astype(object).where(df.notna(), value)
+
+
 def get_sheet_names(file_path):
     """
     Returns a list of sheet names if the file is Excel.
@@ -38,6 +261,170 @@ def get_sheet_names(file_path):
         print(f"Error getting sheet names: {e}")
         return []
 
+def count_rows(file_path, sheet_name=None, encoding=None):
+    """
+    Returns the number of data rows (excluding the header) without parsing the file.
+    CSV rows are counted as pandas reads them (see count_csv_records); Excel rows come
+    from the sheet dimensions. Returns None if the count is unavailable.
+    """
+    ext = os.path.splitext(file_path)[-1].lower()
+    try:
+        if ext == '.csv':
+            return max(count_csv_records(file_path, encoding) - 1, 0)
+        if ext == '.xlsx':
+            from openpyxl import load_workbook
+            wb = load_workbook(file_path, read_only=True)
+            try:
+                ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+                if ws.max_row is None:
+                    ws.calculate_dimension(force=True)
+                return max((ws.max_row or 0) - 1, 0)
+            finally:
+                wb.close()
+        if ext == '.xls':
+            import xlrd
+            book = xlrd.open_workbook(file_path, on_demand=True)
+            try:
+                sheet = book.sheet_by_name(sheet_name) if sheet_name else book.sheet_by_index(0)
+                return max(sheet.nrows - 1, 0)
+            finally:
+                book.release_resources()
+    except Exception as e:
+        print(f"Error counting rows: {e}", flush=True)
+    return None
+
+
+def count_csv_records(file_path, encoding=None):
+    """
+    Returns the number of records in a CSV file, header included, as pandas reads
+    them: line breaks inside quoted cells do not end a record, blank lines are
+    skipped and a last line without a line break still counts.
+    """
+    encoding = encoding or sniff_csv_file(file_path)[0]
+    if codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32')):
+        f, quote, line_break = open(file_path, encoding=encoding, newline=''), '"', '\r\n'
+    else:
+        # Quotes and line breaks are the same bytes in every other supported encoding
+        f, quote, line_break = open(file_path, 'rb'), b'"', b'\r\n'
+    records = 0
+    in_quotes = False
+    with f:
+        for line in f:
+            if not in_quotes:
+                if not line.rstrip(line_break):
+                    continue
+                records += 1
+            if line.count(quote) % 2:
+                in_quotes = not in_quotes
+    return records
+
+
+def file_content_hash(file_path):
+    """
+    Returns the sha256 hex digest of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _header_names(values):
+    return ['' if value is None else str(value) for value in values]
+
+
+def extract_file_metadata(file_path, content_hash=None, delimiter=None, encoding=None):
+    """
+    Returns the content hash and, per sheet, the name, row/column counts and header row.
+    Workbooks are opened once in read-only mode and no data rows are parsed.
+    A CSV file is reported as a single sheet with a blank name; a delimiter or
+    encoding that had to be sniffed is returned as well.
+    """
+    ext = os.path.splitext(file_path)[-1].lower()
+    sheets = []
+    csv_format = {}
+    if ext == '.csv':
+        if delimiter is None or encoding is None:
+            sniffed_encoding, sniffed_delimiter = sniff_csv_file(file_path)
+            csv_format = {'delimiter': delimiter or sniffed_delimiter, 'encoding': encoding or sniffed_encoding}
+            delimiter, encoding = csv_format['delimiter'], csv_format['encoding']
+        columns = pd.read_csv(file_path, nrows=0, sep=delimiter, encoding=encoding).columns.tolist()
+        sheets.append({
+            'name': '',
+            'row_count': count_rows(file_path, encoding=encoding),
+            'column_count': len(columns),
+            'columns': columns,
+        })
+    elif ext == '.xlsx':
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True)
+        try:
+            for ws in wb.worksheets:
+                if ws.max_row is None:
+                    ws.calculate_dimension(force=True)
+                header = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+                sheets.append({
+                    'name': ws.title,
+                    'row_count': max((ws.max_row or 0) - 1, 0),
+                    'column_count': ws.max_column or 0,
+                    'columns': _header_names(header),
+                })
+        finally:
+            wb.close()
+    elif ext == '.xls':
+        import xlrd
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            for index in range(book.nsheets):
+                sheet = book.sheet_by_index(index)
+                sheets.append({
+                    'name': sheet.name,
+                    'row_count': max(sheet.nrows - 1, 0),
+                    'column_count': sheet.ncols,
+                    'columns': _header_names(sheet.row_values(0)) if sheet.nrows else [],
+                })
+                book.unload_sheet(index)
+        finally:
+            book.release_resources()
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+    return dict(csv_format, content_hash=content_hash or file_content_hash(file_path), sheets=sheets)
+
+
+def sniff_csv_format(sample):
+    """
+    Guesses the encoding and delimiter of a CSV file from its first bytes.
+    Returns (encoding, delimiter); the sample may end in the middle of a character or row.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    else:
+        encoding = 'latin-1'
+        for candidate in ('utf-8', 'cp1252'):
+            try:
+                codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+            except UnicodeDecodeError:
+                continue
+            encoding = candidate
+            break
+
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=False)
+    # Drop the last line, which is probably cut off
+    lines = text.splitlines()
+    if len(lines) > 1:
+        lines = lines[:-1]
+    try:
+        delimiter = csv.Sniffer().sniff('\n'.join(lines), delimiters=',;\t|').delimiter
+    except csv.Error:
+        delimiter = ','
+    return encoding, delimiter
+
+
+@timed('infer_types')
 def infer_column_types(df):
     """
     Infers and returns a dictionary of column types: 'str', 'int', 'float', 'date', etc.
@@ -45,6 +432,9 @@ def infer_column_types(df):
     column_types = {}
     for col in df.columns:
         dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            # Categoricals are typed by their values
+            dtype = dtype.categories.dtype
         if pd.api.types.is_string_dtype(dtype):
             column_types[col] = 'str'
         elif pd.api.types.is_integer_dtype(dtype):
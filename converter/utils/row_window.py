@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .timing import span
+from .validator import _blank_mask
+
+# Filter operators for row windows, with the labels shown in the preview
+FILTER_OPS = OrderedDict([
+    ('contains', 'contains'),
+    ('eq', '='),
+    ('ne', '!='),
+    ('lt', '<'),
+    ('le', '<='),
+    ('gt', '>'),
+    ('ge', '>='),
+    ('blank', 'is blank'),
+    ('not_blank', 'is not blank'),
+])
+_COMPARISONS = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'lt': lambda a, b: a < b,
+    'le': lambda a, b: a <= b,
+    'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b,
+}
+# Sorted and filtered row orders kept, so scrolling through a sorted view does not re-sort each page
+ROW_ORDER_CACHE_SIZE = 32
+
+_orders = OrderedDict()  # (dataset key, sort, descending, filter) -> row positions
+_orders_lock = threading.Lock()
+
+
+def _filter_mask(series, op, value):
+    """
+    Returns a boolean mask of the rows of `series` passing the filter. Numeric
+    columns compare as numbers, everything else as text; blank cells only match
+    the blank operator.
+    """
+    blank = _blank_mask(series)
+    if op == 'blank':
+        return blank.to_numpy()
+    if op == 'not_blank':
+        return ~blank.to_numpy()
+
+    if pd.api.types.is_bool_dtype(series.dtype):
+        values, value = series, value.strip().lower() in ('true', '1', 'yes')
+    elif pd.api.types.is_numeric_dtype(series.dtype) and op != 'contains':
+        try:
+            values, value = series, float(value)
+        except ValueError:
+            raise ValueError(f"Filter value for column '{series.name}' must be a number.")
+    else:
+        values = series.astype(str)
+
+    if op == 'contains':
+        mask = values.astype(str).str.contains(value, case=False, regex=False)
+    else:
+        mask = _COMPARISONS[op](values, value)
+    return mask.to_numpy(dtype=bool) & ~blank.to_numpy()
+
+
+def _sorted_positions(series, positions, descending):
+    series = series.iloc[positions].set_axis(positions)
+    try:
+        ordered = series.sort_values(ascending=not descending, kind='stable', na_position='last')
+    except TypeError:
+        # Text columns holding other values too sort by their text
+        ordered = series.astype(str).where(series.notna()).sort_values(
+            ascending=not descending, kind='stable', na_position='last')
+    return ordered.index.to_numpy()
+
+
+def row_order(df, key, sort=None, descending=False, row_filter=None):
+    """
+    Returns the positions of the rows of `df` passing `row_filter` (a (column, op, value)
+    tuple), ordered by the `sort` column, or None for every row in file order.
+    Orders are cached per dataset `key` (see dataset_key).
+    """
+    if sort is None and row_filter is None:
+        return None
+    cache_key = (key, sort, bool(descending), row_filter)
+    with _orders_lock:
+        positions = _orders.get(cache_key)
+        if positions is not None:
+            _orders.move_to_end(cache_key)
+            return positions
+
+    with span('row_order', sort=sort, filter=bool(row_filter)):
+        if row_filter is not None:
+            column, op, value = row_filter
+            positions = np.flatnonzero(_filter_mask(df[column], op, value))
+        else:
+            positions = np.arange(len(df))
+        if sort is not None:
+            positions = _sorted_positions(df[sort], positions, descending)
+
+    with _orders_lock:
+        _orders[cache_key] = positions
+        while len(_orders) > ROW_ORDER_CACHE_SIZE:
+            _orders.popitem(last=False)
+    return positions
+
+
+def row_window(df, key, offset, limit, sort=None, descending=False, row_filter=None):
+    """
+    Returns (window, total): the rows offset..offset+limit-1 of the sorted and
+    filtered view of `df`, indexed by their row number in the file, and the
+    number of rows in the view.
+    """
+    order = row_order(df, key, sort, descending, row_filter)
+    if order is None:
+        total = len(df)
+        positions = np.arange(min(offset, total), min(offset + limit, total))
+    else:
+        total = len(order)
+        positions = order[offset:offset + limit]
+    window = df.iloc[positions]
+    window.index = pd.Index(positions)
+    return window, total
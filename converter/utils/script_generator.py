@@ -1,24 +1,132 @@
+import datetime
+import itertools
+import json
+import math
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
-def generate_sql_script(df, table_name):
+from .file_parser import expand_categoricals, infer_column_types
+
+try:
+    # ujson encodes records several times faster than the standard library
+    import ujson as fast_json
+except ImportError:
+    fast_json = None
+
+SQL_CHUNK_SIZE = 10000
+# Pretty-printed JSON is several times larger than compact output; larger inputs
+# should use the NDJSON or compact JSON formats instead
+JSON_PRETTY_MAX_ROWS = 100000
+# Inputs smaller than this are always formatted serially; a process pool would cost more than it saves
+PARALLEL_MIN_ROWS = 50000
+
+SQL_DIALECTS = [
+    ('generic', 'Generic SQL'),
+    ('postgresql', 'PostgreSQL'),
+    ('sqlite', 'SQLite'),
+    ('mysql', 'MySQL'),
+]
+
+
+def _sql_literal_column(series, dialect='generic'):
     """
-    Generates SQL INSERT statements from a DataFrame.
-    Assumes all columns map directly to table columns in order.
+    Escapes a whole column into SQL literals in one vectorized pass.
+    Null cells become NULL, everything else a quoted string.
     """
-    statements = []
-    for _, row in df.iterrows():
-        values = ', '.join([
-            f"""'{str(val).replace("'", "''").replace(" - ", "-")}'""" if pd.notna(val) else "NULL"
-            for val in row
-        ])
-        statements.append(f"INSERT INTO {table_name} VALUES ({values});")
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        text = series.map(str)
+    else:
+        text = series.astype(str)
+    if dialect == 'mysql':
+        # MySQL treats backslashes in string literals as escapes by default
+        text = text.str.replace("\\", "\\\\", regex=False)
+    text = text.str.replace("'", "''", regex=False).str.replace(" - ", "-", regex=False)
+    return ("'" + text + "'").where(series.notna(), "NULL")
+
+
+def _quote_identifier(name, dialect='generic'):
+    if dialect == 'mysql':
+        return '`' + str(name).replace('`', '``') + '`'
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _column_list(df, dialect='generic'):
+    return '(' + ', '.join(_quote_identifier(col, dialect) for col in df.columns) + ')'
+
+
+def format_sql_rows(df, table_name, batch_size=1, column_list=False, transaction=False, dialect='generic'):
+    """
+    Formats a block of rows as SQL INSERT statements.
+
+    With `batch_size` > 1, rows are grouped into multi-row INSERT ... VALUES
+    statements; `column_list` names the target columns explicitly and
+    `transaction` wraps the block in BEGIN/COMMIT.
+    """
+    target = f"{table_name} {_column_list(df, dialect)}" if column_list else table_name
+    values = None
+    for col in range(df.shape[1]):
+        literals = _sql_literal_column(df.iloc[:, col], dialect)
+        values = literals if values is None else values + ", " + literals
+    if values is None:
+        tuples = ["()"] * len(df)
+    else:
+        tuples = ("(" + values + ")").tolist()
+
+    if batch_size <= 1:
+        statements = [f"INSERT INTO {target} VALUES {row};" for row in tuples]
+    else:
+        statements = [
+            f"INSERT INTO {target} VALUES\n" + ',\n'.join(tuples[start:start + batch_size]) + ';'
+            for start in range(0, len(tuples), batch_size)
+        ]
+    if transaction:
+        begin = 'START TRANSACTION;' if dialect == 'mysql' else 'BEGIN;'
+        statements = [begin] + statements + ['COMMIT;']
     return '\n'.join(statements)
 
 
-def generate_orm_script(df, model_name):
+def _copy_text_column(series):
     """
-    Generates Django ORM create statements from a DataFrame.
-    Maps each column to a model field by name.
+    Escapes a whole column for PostgreSQL COPY text format; nulls become \\N.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        text = series.map(str)
+    else:
+        text = series.astype(str)
+    text = (
+        text.str.replace("\\", "\\\\", regex=False)
+        .str.replace("\t", "\\t", regex=False)
+        .str.replace("\n", "\\n", regex=False)
+        .str.replace("\r", "\\r", regex=False)
+        .str.replace(" - ", "-", regex=False)
+    )
+    return text.where(series.notna(), "\\N")
+
+
+def format_copy_rows(df, table_name):
+    """
+    Formats a block of rows as tab-separated lines of a PostgreSQL COPY ... FROM STDIN data block.
+    """
+    lines = None
+    for col in range(df.shape[1]):
+        cells = _copy_text_column(df.iloc[:, col])
+        lines = cells if lines is None else lines + "\t" + cells
+    if lines is None:
+        return '\n'.join([''] * len(df))
+    return '\n'.join(lines.tolist())
+
+
+def _copy_header(df, table_name, **options):
+    return f"COPY {table_name} {_column_list(df, 'postgresql')} FROM STDIN;\n"
+
+
+def format_orm_rows(df, model_name):
+    """
+    Formats a block of rows as newline-separated Django ORM create statements.
     """
     statements = []
     for _, row in df.iterrows():
@@ -31,17 +139,354 @@ def generate_orm_script(df, model_name):
     return '\n'.join(statements)
 
 
+def _python_literal(value):
+    """
+    Returns Python source for a single cell value, for columns without one uniform type.
+    """
+    if value is None or (not isinstance(value, (list, dict)) and pd.isna(value)):
+        return 'None'
+    if isinstance(value, str):
+        return repr(value.replace(" - ", "-"))
+    if isinstance(value, pd.Timestamp):
+        return repr(value.to_pydatetime())
+    if isinstance(value, (bool, int, float, datetime.date, datetime.time)):
+        return repr(value)
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return repr(value.item())
+    return repr(str(value))
+
+
+def _python_literal_column(series):
+    """
+    Converts a whole column into Python literals matching its inferred type:
+    ints and floats as numbers, dates as datetime objects, missing values as None.
+    """
+    missing = series.isna()
+    column_type = infer_column_types(series.to_frame())[series.name]
+    if column_type in ('int', 'float') and not pd.api.types.is_bool_dtype(series.dtype):
+        numbers = series.astype(str)
+        if column_type == 'float':
+            numbers = numbers.replace({'inf': "float('inf')", '-inf': "float('-inf')"})
+        return numbers.where(~missing, 'None')
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series.astype(str)
+    if column_type == 'date':
+        return series.map(lambda value: 'None' if pd.isna(value) else repr(value.to_pydatetime()))
+    return series.map(_python_literal)
+
+
+def format_orm_bulk_rows(df, model_name, batch_size=1000, atomic=True):
+    """
+    Formats a block of rows as one Model.objects.bulk_create([...]) call with typed
+    literals. With `atomic`, the call is indented to sit inside the
+    transaction.atomic() block opened by the script header.
+    """
+    fields = None
+    for position, col in enumerate(df.columns):
+        literals = f"{col}=" + _python_literal_column(df.iloc[:, position])
+        fields = literals if fields is None else fields + ", " + literals
+    if fields is None:
+        objects = [f"    {model_name}()," for _ in range(len(df))]
+    else:
+        objects = (f"    {model_name}(" + fields + "),").tolist()
+
+    lines = [f"{model_name}.objects.bulk_create(["] + objects + [f"], batch_size={batch_size})"]
+    indent = '    ' if atomic else ''
+    return '\n'.join(indent + line for line in lines)
+
+
+def _orm_bulk_header(df, model_name, atomic=True, **options):
+    header = "import datetime\n\nfrom django.db import transaction\n\n"
+    if atomic:
+        header += "with transaction.atomic():\n"
+    return header
+
+
+def _json_records(df):
+    """
+    Converts a block of rows to JSON-ready records column by column: dates become
+    strings, missing values None, and spaces around dashes are removed from text.
+    JSON has no infinity, so infinite floats become None too.
+    """
+    columns = {}
+    for position, col in enumerate(df.columns):
+        series = df.iloc[:, position]
+        missing = series.isna()
+        if pd.api.types.is_float_dtype(series.dtype):
+            missing |= np.isinf(series)
+        elif series.dtype == object:
+            missing |= series.map(lambda value: isinstance(value, float) and math.isinf(value)).astype(bool)
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            series = series.astype(str)
+        elif series.dtype == object:
+            is_text = series.map(type).eq(str)
+            if is_text.any():
+                series = series.where(~is_text, series[is_text].str.replace(" - ", "-", regex=False))
+            # Anything else JSON cannot encode natively (timestamps, decimals...) becomes text
+            is_native = is_text | series.map(lambda value: isinstance(value, (bool, int, float)))
+            series = series.where(is_native | missing, series.astype(str))
+        columns[col] = series.astype(object).where(~missing, None)
+    return pd.DataFrame(columns, index=df.index).to_dict(orient='records')
+
+
+def format_json_rows(df, name=None):
+    """
+    Formats a block of rows as the comma-separated, indented records of a
+    pretty-printed JSON array.
+    """
+    records = _json_records(df)
+    return ',\n'.join(
+        '  ' + json.dumps(record, indent=2).replace('\n', '\n  ') for record in records
+    )
+
+
+def _encode_json(record):
+    if fast_json is not None:
+        return fast_json.dumps(record, ensure_ascii=True, escape_forward_slashes=False)
+    return json.dumps(record, separators=(',', ':'))
+
+
+def format_ndjson_rows(df, name=None):
+    """
+    Formats a block of rows as newline-delimited JSON, one compact record per line.
+    """
+    return '\n'.join(_encode_json(record) for record in _json_records(df))
+
+
+def format_compact_json_rows(df, name=None):
+    """
+    Formats a block of rows as the comma-separated records of a compact JSON array.
+    """
+    return ','.join(_encode_json(record) for record in _json_records(df))
+
+
+# Output formats: how a block of rows is formatted, what surrounds and separates
+# the blocks, and the file extension and default table/model name to use.
+# Header, footer and empty text may be callables taking (df, name, **options).
+# `options` lists the formatter keyword arguments a user may set, `defaults`
+# their values for this format.
+OUTPUT_FORMATS = {
+    'sql': {
+        'label': 'SQL Script',
+        'formatter': format_sql_rows,
+        'header': '', 'separator': '\n', 'footer': '', 'empty': '',
+        'extension': 'sql', 'default_name': 'your_table_name',
+        'options': ('column_list', 'transaction', 'dialect'),
+        'defaults': {},
+    },
+    'sql_bulk': {
+        'label': 'SQL Script (multi-row INSERT)',
+        'formatter': format_sql_rows,
+        'header': '', 'separator': '\n', 'footer': '', 'empty': '',
+        'extension': 'sql', 'default_name': 'your_table_name',
+        'options': ('batch_size', 'column_list', 'transaction', 'dialect'),
+        'defaults': {'batch_size': 1000, 'column_list': True, 'transaction': True},
+    },
+    'sql_copy': {
+        'label': 'PostgreSQL COPY',
+        'formatter': format_copy_rows,
+        'header': _copy_header, 'separator': '\n', 'footer': '\n\\.\n',
+        'empty': lambda df, name, **options: _copy_header(df, name) + '\\.\n',
+        'extension': 'sql', 'default_name': 'your_table_name',
+        'options': (),
+        'defaults': {},
+    },
+    'orm': {
+        'label': 'ORM Code',
+        'formatter': format_orm_rows,
+        'header': '', 'separator': '\n', 'footer': '', 'empty': '',
+        'extension': 'orm', 'default_name': 'YourModel',
+        'options': (),
+        'defaults': {},
+    },
+    'orm_bulk': {
+        'label': 'ORM Code (bulk_create)',
+        'formatter': format_orm_bulk_rows,
+        'header': _orm_bulk_header, 'separator': '\n', 'footer': '\n',
+        'empty': lambda df, name, **options: _orm_bulk_header(df, name, atomic=False),
+        'extension': 'py', 'default_name': 'YourModel',
+        'options': ('batch_size', 'atomic'),
+        'defaults': {'batch_size': 1000, 'atomic': True},
+    },
+    'json': {
+        'label': 'JSON (pretty-printed)',
+        'formatter': format_json_rows,
+        'header': '[\n', 'separator': ',\n', 'footer': '\n]', 'empty': '[]',
+        'extension': 'json', 'default_name': None,
+        'options': (),
+        'defaults': {},
+        'max_rows': JSON_PRETTY_MAX_ROWS,
+    },
+    'ndjson': {
+        'label': 'NDJSON (one record per line)',
+        'formatter': format_ndjson_rows,
+        'header': '', 'separator': '\n', 'footer': '\n', 'empty': '',
+        'extension': 'ndjson', 'default_name': None,
+        'options': (),
+        'defaults': {},
+    },
+    'json_compact': {
+        'label': 'JSON (compact)',
+        'formatter': format_compact_json_rows,
+        'header': '[', 'separator': ',', 'footer': ']', 'empty': '[]',
+        'extension': 'json', 'default_name': None,
+        'options': (),
+        'defaults': {},
+    },
+}
+
+
+def sheet_identifier(sheet_name, output_format):
+    """
+    Derives a table or model name from a sheet name: CamelCase for the ORM
+    formats, snake_case for the others.
+    """
+    words = re.findall(r'[A-Za-z0-9]+', sheet_name or '') or ['sheet']
+    if output_format.startswith('orm'):
+        name = ''.join(word[:1].upper() + word[1:] for word in words)
+        return 'Sheet' + name if name[0].isdigit() else name
+    name = '_'.join(word.lower() for word in words)
+    return 'sheet_' + name if name[0].isdigit() else name
+
+
+def format_options(output_format, options=None):
+    """
+    Returns the formatter keyword arguments for a format: its defaults, overridden
+    by any of `options` the format accepts. Unknown options are dropped.
+    """
+    spec = OUTPUT_FORMATS[output_format]
+    merged = dict(spec['defaults'])
+    for key, value in (options or {}).items():
+        if key in spec['options'] and value is not None:
+            merged[key] = value
+    return merged
+
+
+def _render(part, df, name, options):
+    return part(df, name, **options) if callable(part) else part
+
+
+def _format_partition(output_format, df, name, options):
+    # Runs in a worker process, so it looks the formatter up by name
+    return OUTPUT_FORMATS[output_format]['formatter'](expand_categoricals(df), name, **options)
+
+
+def _iter_formatted(blocks, output_format, name, options, workers):
+    """
+    Yields (rows_done, body) for each DataFrame of `blocks` in order. With more than
+    one worker the blocks are formatted in a process pool, keeping at most two
+    blocks per worker in flight so memory stays bounded.
+    """
+    done = 0
+    if workers <= 1:
+        for block in blocks:
+            done += len(block)
+            yield done, _format_partition(output_format, block, name, options)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for block in blocks:
+            done += len(block)
+            future = pool.submit(_format_partition, output_format, block, name, options)
+            in_flight.append((done, future))
+            if len(in_flight) >= workers * 2:
+                rows_done, future = in_flight.popleft()
+                yield rows_done, future.result()
+        while in_flight:
+            rows_done, future = in_flight.popleft()
+            yield rows_done, future.result()
+
+
+def block_size(chunk_size, options=None):
+    """
+    Rounds a block size up to whole INSERT batches, so batch boundaries do not
+    depend on the block size. `options` are those from format_options.
+    """
+    batch_size = (options or {}).get('batch_size', 1)
+    if batch_size > 1:
+        chunk_size = -(-chunk_size // batch_size) * batch_size
+    return chunk_size
+
+
+def iter_script(df, output_format, name=None, chunk_size=SQL_CHUNK_SIZE, workers=1,
+                parallel_min_rows=PARALLEL_MIN_ROWS, options=None):
+    """
+    Yields (rows_done, text) pairs for the script of a DataFrame, formatting
+    `chunk_size` rows at a time. Joining the text gives the complete script.
+
+    With `workers` > 1 and at least `parallel_min_rows` rows, the blocks are
+    formatted in a process pool; the output is identical to the serial path.
+    `options` are passed to the format's formatter (see format_options).
+    """
+    options = format_options(output_format, options)
+    chunk_size = block_size(chunk_size, options)
+    if len(df) < parallel_min_rows:
+        workers = 1
+    if len(df):
+        blocks = (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+    else:
+        blocks = iter([df])
+    yield from iter_script_chunks(blocks, len(df), output_format, name, workers=workers, options=options)
+
+
+def iter_script_chunks(chunks, total_rows, output_format, name=None, workers=1, options=None):
+    """
+    Like iter_script, for a table that arrives as consecutive DataFrames (such as the
+    chunks of a CsvStream) holding `total_rows` rows in all. Each chunk is formatted
+    as one block, so its row count should come from block_size(). At least one
+    chunk, possibly empty, must be given so an empty table still has its columns.
+    """
+    spec = OUTPUT_FORMATS[output_format]
+    name = name or spec['default_name']
+    options = format_options(output_format, options)
+    if total_rows > spec.get('max_rows', total_rows):
+        raise ValueError(
+            f"{spec['label']} output is limited to {spec['max_rows']} rows; "
+            f"choose a streaming format for this file."
+        )
+    chunks = iter(chunks)
+    first_chunk = next(chunks)
+    if total_rows == 0:
+        yield 0, _render(spec['empty'], first_chunk, name, options)
+        return
+    blocks = itertools.chain([first_chunk], chunks)
+    first = True
+    for done, text in _iter_formatted(blocks, output_format, name, options, workers):
+        prefix = _render(spec['header'], first_chunk, name, options) if first else spec['separator']
+        suffix = _render(spec['footer'], first_chunk, name, options) if done == total_rows else ''
+        first = False
+        yield done, prefix + text + suffix
+
+
+def iter_sql_script(df, table_name, chunk_size=SQL_CHUNK_SIZE):
+    """
+    Yields the SQL INSERT script for a DataFrame in chunks of `chunk_size` rows.
+    Joining the yielded pieces gives the same text as generate_sql_script.
+    """
+    for _, text in iter_script(df, 'sql', table_name, chunk_size):
+        yield text
+
+
+def generate_sql_script(df, table_name):
+    """
+    Generates SQL INSERT statements from a DataFrame.
+    Assumes all columns map directly to table columns in order.
+    """
+    return ''.join(iter_sql_script(df, table_name))
+
+
+def generate_orm_script(df, model_name):
+    """
+    Generates Django ORM create statements from a DataFrame.
+    Maps each column to a model field by name.
+    """
+    return ''.join(text for _, text in iter_script(df, 'orm', model_name))
+
+
 def generate_json_script(df):
     """
     Converts a DataFrame to a pretty-printed JSON array of records.
     """
-    records = df.to_dict(orient='records')
-    
-    # Remove spaces around dashes in string values
-    for record in records:
-        for key, value in record.items():
-            if isinstance(value, str):
-                record[key] = value.replace(" - ", "-")
-    
-    import json
-    return json.dumps(records, indent=2)
+    return ''.join(text for _, text in iter_script(df, 'json'))
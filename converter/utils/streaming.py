@@ -0,0 +1,265 @@
+import codecs
+
+import pandas as pd
+from django.conf import settings
+
+from .file_parser import _prepare_frame, csv_engine, sniff_csv_file
+from .timing import span
+
+# Rows per chunk read by the streaming pipeline
+STREAM_CHUNK_ROWS = 100000
+# The row index records the byte offset of every STREAM_INDEX_ROWS-th row, so
+# reading a window of rows parses at most this many rows before it
+STREAM_INDEX_ROWS = 10000
+
+# How a column is read in each chunk so it matches a whole-file read:
+#   'object'       read as text
+#   'int64'        read as parsed (every chunk parsed it as integers)
+#   'float64'      parsed, then cast (some chunks held integers, or had blanks)
+#   'bool'         read as parsed
+#   'bool_object'  parsed, then cast to object (booleans with blanks)
+STREAM_DTYPES = ('object', 'int64', 'float64', 'bool', 'bool_object')
+
+
+def _chunk_kind(series):
+    """
+    Classifies how pandas parsed one column of one chunk, or returns None when the
+    streaming pipeline cannot reproduce that dtype.
+    """
+    if series.isna().all():
+        return 'empty'
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_signed_integer_dtype(dtype):
+        return 'int64'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float64'
+    if dtype == object:
+        return 'bool_object' if pd.api.types.infer_dtype(series, skipna=True) == 'boolean' else 'object'
+    return None
+
+
+def _resolve_dtype(kinds):
+    """
+    Combines the per-chunk kinds of a column into the dtype a whole-file read gives it.
+    """
+    had_blanks = 'empty' in kinds
+    kinds = kinds - {'empty'}
+    if not kinds:
+        return 'float64'
+    if 'object' in kinds:
+        return 'object'
+    if kinds <= {'int64', 'float64'}:
+        return 'int64' if kinds == {'int64'} and not had_blanks else 'float64'
+    if kinds <= {'bool', 'bool_object'}:
+        return 'bool' if kinds == {'bool'} and not had_blanks else 'bool_object'
+    return None
+
+
+class CsvStream:
+    """
+    A CSV file read in chunks, with every column given the dtype a whole-file read
+    would give it, so the chunks concatenate to the same frame parse_file returns.
+
+    Call resolve() first: it reads the file once to settle the column dtypes and
+    count the rows. The dtypes can be stored and passed back in to skip that pass,
+    as can the row index built by index_rows().
+    """
+
+    def __init__(self, file_path, delimiter=None, encoding=None, trim_whitespace=False,
+                 chunk_size=STREAM_CHUNK_ROWS, dtypes=None, rows=None, offsets=None):
+        if delimiter is None or encoding is None:
+            sniffed_encoding, sniffed_delimiter = sniff_csv_file(file_path)
+            delimiter = delimiter or sniffed_delimiter
+            encoding = encoding or sniffed_encoding
+        self.file_path = file_path
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.trim_whitespace = trim_whitespace
+        self.chunk_size = chunk_size
+        self.dtypes = dtypes
+        self.rows = rows
+        self.offsets = offsets
+        self.header = pd.read_csv(file_path, nrows=0, sep=delimiter, encoding=encoding).columns
+
+    def _read(self, source=None, **options):
+        if csv_engine() == 'pyarrow':
+            # Whole-file reads use pyarrow, which parses floats exactly
+            options['float_precision'] = 'round_trip'
+        return pd.read_csv(source or self.file_path, sep=self.delimiter, encoding=self.encoding, **options)
+
+    def resolve(self):
+        """
+        Settles the column dtypes and row count. Returns False if some column has a
+        dtype the chunked reader cannot reproduce; use the in-memory path then.
+        """
+        if self.dtypes is not None and self.rows is not None:
+            return True
+        kinds = {col: set() for col in self.header}
+        rows = 0
+        with span('stream_resolve'):
+            with self._read(chunksize=self.chunk_size) as reader:
+                for chunk in reader:
+                    if not len(chunk):
+                        continue
+                    rows += len(chunk)
+                    for position, col in enumerate(self.header):
+                        kind = _chunk_kind(chunk.iloc[:, position])
+                        if kind is None:
+                            return False
+                        kinds[col].add(kind)
+        dtypes = {}
+        for col, col_kinds in kinds.items():
+            dtypes[col] = _resolve_dtype(col_kinds) if col_kinds else 'object'
+            if dtypes[col] is None:
+                return False
+        self.dtypes = dtypes
+        self.rows = rows
+        return True
+
+    def _apply_dtypes(self, chunk):
+        kinds = [self.dtypes.get(col) for col in chunk.columns]
+        for position, dtype in enumerate(kinds):
+            if dtype == 'float64' and chunk.dtypes.iloc[position] != 'float64':
+                chunk.isetitem(position, chunk.iloc[:, position].astype('float64'))
+        chunk = _prepare_frame(chunk, self.trim_whitespace)
+        # Cast after trimming, which would turn a column of booleans without blanks back into bool
+        for position, dtype in enumerate(kinds):
+            if dtype == 'bool_object' and chunk.dtypes.iloc[position] != object:
+                chunk.isetitem(position, chunk.iloc[:, position].astype(object))
+        return chunk
+
+    def _text_columns(self, usecols=None):
+        return {col: str for col, dtype in self.dtypes.items()
+                if dtype == 'object' and (usecols is None or col in usecols)}
+
+    def chunks(self, usecols=None):
+        """
+        Yields the file as DataFrames of chunk_size rows, indexed by row number.
+        At least one (possibly empty) frame is yielded.
+        """
+        with self._read(chunksize=self.chunk_size, usecols=usecols, dtype=self._text_columns(usecols)) as reader:
+            for chunk in reader:
+                yield self._apply_dtypes(chunk)
+
+    def index_rows(self):
+        """
+        Builds the row index: the byte offset of every STREAM_INDEX_ROWS-th data row,
+        found by scanning the file's lines and tracking quoted fields, which may span
+        lines. Call after resolve(). Sets `offsets` to False if the rows cannot be
+        located this way (a UTF-16 file, or a row count differing from pandas'); reads
+        then scan from the start of the file.
+        """
+        if self.offsets is not None:
+            return self.offsets
+        self.offsets = False
+        if codecs.lookup(self.encoding).name.startswith(('utf-16', 'utf-32')):
+            return self.offsets
+        offsets = []
+        rows = 0
+        position = 0
+        in_quotes = False
+        header_read = False
+        with span('stream_index'), open(self.file_path, 'rb') as f:
+            for line in f:
+                start = position
+                position += len(line)
+                if not in_quotes:
+                    # Blank lines are skipped by pandas, so they are not rows
+                    if not line.rstrip(b'\r\n'):
+                        continue
+                    if header_read:
+                        if rows % STREAM_INDEX_ROWS == 0:
+                            offsets.append(start)
+                        rows += 1
+                if line.count(b'"') % 2:
+                    in_quotes = not in_quotes
+                if not in_quotes:
+                    header_read = True
+        if rows == self.rows:
+            self.offsets = offsets
+        return self.offsets
+
+    def read_rows(self, rows):
+        """
+        Returns the given 0-based rows, in ascending order, as one DataFrame indexed by
+        row number. With the row index, each run of nearby rows is read from the
+        indexed row before it, so the cost depends on the rows asked for and not on
+        how far into the file they are. Memory stays bounded by the rows read.
+        """
+        rows = sorted(set(rows))
+        if rows and self.index_rows():
+            frames = []
+            run = [rows[0]]
+            for row in rows[1:]:
+                if row - run[0] // STREAM_INDEX_ROWS * STREAM_INDEX_ROWS < 2 * STREAM_INDEX_ROWS:
+                    run.append(row)
+                else:
+                    frames.append(self._read_run(run))
+                    run = [row]
+            frames.append(self._read_run(run))
+            return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+        # Without the index, rows are picked out of the chunks while scanning the file
+        frames = []
+        offset = 0
+        with self._read(chunksize=self.chunk_size, nrows=rows[-1] + 1 if rows else 0,
+                        dtype=self._text_columns()) as reader:
+            for chunk in reader:
+                picked = [row - offset for row in rows if offset <= row < offset + len(chunk)]
+                if picked or not frames:
+                    frames.append(chunk.iloc[picked].set_axis(pd.Index([offset + p for p in picked])))
+                offset += len(chunk)
+        if not frames:
+            frames.append(self._read(nrows=0, dtype=self._text_columns()))
+        return self._apply_dtypes(pd.concat(frames) if len(frames) > 1 else frames[0])
+
+    def _read_run(self, rows):
+        """
+        Reads sorted rows from the indexed row at or before the first of them.
+        """
+        segment = rows[0] // STREAM_INDEX_ROWS
+        base = segment * STREAM_INDEX_ROWS
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offsets[segment])
+            chunk = self._read(f, header=None, names=list(self.header), nrows=rows[-1] - base + 1,
+                               dtype=self._text_columns())
+        chunk = chunk.iloc[[row - base for row in rows if row - base < len(chunk)]]
+        chunk.index = pd.Index(rows[:len(chunk)])
+        return self._apply_dtypes(chunk)
+
+
+def streaming_enabled(uploaded_file, sheet=None):
+    """
+    Returns True if an upload is a CSV large enough to be processed in chunks
+    rather than loaded whole (see CONVERTER_STREAMING_ROWS).
+    """
+    if not uploaded_file.file.name.lower().endswith('.csv'):
+        return False
+    sheet = sheet or uploaded_file.get_sheet()
+    threshold = getattr(settings, 'CONVERTER_STREAMING_ROWS', 1000000)
+    return bool(sheet and sheet.row_count and sheet.row_count > threshold)
+
+
+def sheet_stream(uploaded_file, sheet=None, trim_whitespace=True, chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Returns a resolved CsvStream over an uploaded CSV, or None if its columns cannot
+    be streamed. The schema and row index settled on first use are stored on the
+    sheet's metadata, so later streams skip those passes.
+    """
+    sheet = sheet or uploaded_file.get_sheet()
+    schema = (sheet.stream_schema if sheet else None) or {}
+    if 'dtypes' in schema and schema['dtypes'] is None:
+        return None
+    stream = CsvStream(uploaded_file.file.path, trim_whitespace=trim_whitespace, chunk_size=chunk_size,
+                       dtypes=schema.get('dtypes'), rows=schema.get('rows'), offsets=schema.get('offsets'),
+                       **uploaded_file.parse_options())
+    resolved = stream.resolve()
+    if resolved:
+        stream.index_rows()
+    if sheet is not None and (not schema or (resolved and 'offsets' not in schema)):
+        sheet.stream_schema = {'dtypes': stream.dtypes, 'rows': stream.rows, 'offsets': stream.offsets} \
+            if resolved else {'dtypes': None}
+        sheet.save(update_fields=['stream_schema'])
+    return stream if resolved else None
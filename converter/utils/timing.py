@@ -0,0 +1,198 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('converter.timing')
+
+# Upper bounds (in milliseconds) of the stage latency histogram buckets
+LATENCY_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+# Spans finished while handling the current request, collected for the Server-Timing header
+_request_spans = contextvars.ContextVar('converter_request_spans', default=None)
+_enabled = None
+
+
+def timing_enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(getattr(settings, 'CONVERTER_TIMING_ENABLED', True))
+    return _enabled
+
+
+class Metrics:
+    """
+    In-process request counters and per-stage latency histograms.
+    Totals are per process; they reset when the server restarts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {'total': 0, 'by_status': {}, 'by_view': {}}
+            self.stages = {}
+
+    def record_request(self, view_name, status_code):
+        with self._lock:
+            self.requests['total'] += 1
+            by_status = self.requests['by_status']
+            by_status[status_code] = by_status.get(status_code, 0) + 1
+            by_view = self.requests['by_view']
+            by_view[view_name] = by_view.get(view_name, 0) + 1
+
+    def observe(self, stage, ms, rows=None, nbytes=None):
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'bytes': 0,
+                    'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                }
+            entry['count'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+            if rows:
+                entry['rows'] += rows
+            if nbytes:
+                entry['bytes'] += nbytes
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, entry in self.stages.items():
+                seconds = entry['total_ms'] / 1000
+                stages[stage] = {
+                    'count': entry['count'],
+                    'total_ms': round(entry['total_ms'], 3),
+                    'avg_ms': round(entry['total_ms'] / entry['count'], 3),
+                    'max_ms': round(entry['max_ms'], 3),
+                    'rows': entry['rows'],
+                    'bytes': entry['bytes'],
+                    'rows_per_sec': round(entry['rows'] / seconds, 1) if entry['rows'] and seconds else None,
+                    'histogram_ms': dict(zip(
+                        [str(b) for b in LATENCY_BUCKETS_MS] + ['+Inf'], entry['buckets']
+                    )),
+                }
+            return {
+                'requests': {
+                    'total': self.requests['total'],
+                    'by_status': {str(k): v for k, v in self.requests['by_status'].items()},
+                    'by_view': dict(self.requests['by_view']),
+                },
+                'stages': stages,
+            }
+
+
+metrics = Metrics()
+
+
+class Span:
+    """
+    Times a block of work. Rows and bytes handled inside the block can be added
+    with add(), so the metrics endpoint can report throughput per stage.
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.rows = None
+        self.bytes = None
+        self.ms = None
+
+    def add(self, rows=None, nbytes=None):
+        if rows is not None:
+            self.rows = (self.rows or 0) + rows
+        if nbytes is not None:
+            self.bytes = (self.bytes or 0) + nbytes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.ms = (time.perf_counter() - self._start) * 1000
+        metrics.observe(self.name, self.ms, self.rows, self.bytes)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append(self)
+        if logger.isEnabledFor(logging.INFO):
+            record = {'span': self.name, 'ms': round(self.ms, 3)}
+            if self.rows is not None:
+                record['rows'] = self.rows
+            if self.bytes is not None:
+                record['bytes'] = self.bytes
+            if exc_type is not None:
+                record['error'] = exc_type.__name__
+            record.update(self.fields)
+            logger.info(json.dumps(record, default=str))
+        return False
+
+
+class _NullSpan:
+    """Stands in for Span when timing is disabled; every method is a no-op."""
+
+    def add(self, rows=None, nbytes=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **fields):
+    """
+    Returns a context manager that times the enclosed block as stage `name`.
+    Extra keyword fields are added to the structured log line.
+    """
+    if not timing_enabled():
+        return _NULL_SPAN
+    return Span(name, **fields)
+
+
+def timed(name):
+    """
+    Decorator form of span().
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not timing_enabled():
+                return func(*args, **kwargs)
+            with Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request():
+    """
+    Starts collecting spans for the current request. Returns a token for finish_request().
+    """
+    return _request_spans.set([])
+
+
+def finish_request(token):
+    """
+    Stops collecting spans and returns the Server-Timing header value for them.
+    Repeated spans of the same stage are summed into one entry.
+    """
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    totals = {}
+    for s in spans:
+        totals[s.name] = totals.get(s.name, 0.0) + s.ms
+    return ', '.join(f"{name};dur={ms:.1f}" for name, ms in totals.items())
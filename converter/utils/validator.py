@@ -1,42 +1,158 @@
+import functools
+import warnings
+from collections import OrderedDict
+
 import pandas as pd
+# guess_datetime_format and format='mixed' need pandas 2 (see requirements.txt)
+from pandas.tseries.api import guess_datetime_format
+
+from .duplicates import find_duplicate_rows
+from .file_parser import fill_blanks, read_csv
+from .timing import span
+
+# A text column is treated as numeric/date when at least this share of its
+# non-blank values coerce cleanly; the remaining values are reported as errors.
+TYPE_MATCH_THRESHOLD = 0.9
+# Date coercion is only attempted on the whole column if a sample of this size passes
+TYPE_SAMPLE_SIZE = 1000
+
+# Validation rules run in registration order; later rules win when two report the same cell.
+RULES = OrderedDict()
+
+
+def register_rule(name):
+    """
+    Registers a vectorized validation rule.
+
+    A rule is called as rule(df, **options) and returns an iterable of
+    (column, mask, message) tuples, where mask is a boolean Series aligned with
+    df that is True for every failing row of that column.
+    """
+    def decorator(func):
+        RULES[name] = func
+        return func
+    return decorator
+
+
+def _blank_mask(series):
+    mask = series.isna()
+    if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype) \
+            or pd.api.types.is_string_dtype(series.dtype):
+        mask |= series.astype(str).str.strip().eq('')
+    return mask
+
+
+def _infer_dtype(series):
+    # Categoricals are typed by their values
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return pd.api.types.infer_dtype(series.cat.categories, skipna=True)
+    return pd.api.types.infer_dtype(series, skipna=True)
+
+
+def _coerced_mismatches(series, coerce):
+    """
+    Returns a mask of non-blank values that fail `coerce`, or None when the column
+    does not look like it is meant to hold that type at all.
+    """
+    values = series[~_blank_mask(series)]
+    if values.empty:
+        return None
+    sample = values.iloc[:TYPE_SAMPLE_SIZE]
+    if coerce(sample).notna().mean() < TYPE_MATCH_THRESHOLD:
+        return None
+    failed = coerce(values).isna()
+    if 1 - failed.mean() < TYPE_MATCH_THRESHOLD:
+        return None
+    return failed.reindex(series.index, fill_value=False)
+
+
+def _to_numeric(values):
+    return pd.to_numeric(values, errors='coerce')
+
+
+def _to_datetime(values, format=None):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return pd.to_datetime(values.astype(str), errors='coerce', format=format)
+
+
+@register_rule('required')
+def required_rule(df, required_columns=(), **options):
+    for col in required_columns:
+        yield col, _blank_mask(df[col]), 'Required field is missing.'
+
+
+@register_rule('data_types')
+def data_type_rule(df, column_types=None, type_checks=None, **options):
+    # type_checks, when given, are the checks check_column_types chose over the whole table
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype) and series.cat.categories.dtype == object:
+            series = series.astype(object)
+        # Columns pandas already parsed as numbers or dates cannot hold mismatches
+        if series.dtype != object:
+            continue
+        if type_checks is not None:
+            if col in type_checks:
+                coerce, message = type_checks[col]
+                values = series[~_blank_mask(series)]
+                yield col, coerce(values).isna().reindex(series.index, fill_value=False), message
+            continue
+        mismatches = _coerced_mismatches(series, _to_numeric)
+        if mismatches is not None:
+            yield col, mismatches, 'Expected number.'
+            continue
+        if column_types and column_types.get(col) in ('integer', 'floating', 'mixed-integer-float'):
+            continue
+        mismatches = _coerced_mismatches(series, _to_datetime)
+        if mismatches is not None:
+            yield col, mismatches, 'Expected date.'
+
+
+@register_rule('duplicates')
+def duplicate_rule(df, unique_columns=(), duplicate_rows=None, **options):
+    # duplicate_rows, when given, are row positions already found by the out-of-core detector
+    if unique_columns:
+        if duplicate_rows is None:
+            dupes = df.duplicated(subset=unique_columns, keep=False)
+        else:
+            # Rows are matched by index, so this also works on a chunk indexed by row number
+            dupes = pd.Series(df.index.isin(duplicate_rows), index=df.index)
+        for col in unique_columns:
+            yield col, dupes, 'Duplicate value.'
+
+
+def build_error_index(findings):
+    """
+    Turns (column, mask, message) findings into a sparse {row: {column: message}} index.
+    Only failing cells are materialized.
+    """
+    index = {}
+    for col, mask, message in findings:
+        for idx in mask.index[mask.to_numpy(dtype=bool)]:
+            index.setdefault(idx, {})[col] = message
+    return index
+
+
+def run_rules(df, **options):
+    """
+    Runs every registered rule and returns {rule_name: error_index}.
+    """
+    return OrderedDict(
+        (name, build_error_index(rule(df, **options))) for name, rule in RULES.items()
+    )
+
 
 def validate_required_fields(df, required_columns):
-    missing_fields = {}
-    for idx, row in df.iterrows():
-        row_errors = {}
-        for col in required_columns:
-            if pd.isnull(row[col]) or (isinstance(row[col], str) and not row[col].strip()):
-                row_errors[col] = 'Required field is missing.'
-        if row_errors:
-            missing_fields[idx] = row_errors
-    return missing_fields
+    return build_error_index(required_rule(df, required_columns=required_columns))
 
 def validate_data_types(df):
-    column_types = {col: pd.api.types.infer_dtype(df[col], skipna=True) for col in df.columns}
-    type_errors = {}
-    for idx, row in df.iterrows():
-        row_errors = {}
-        for col in df.columns:
-            val = row[col]
-            inferred = column_types[col]
-            if not pd.isnull(val):
-                if inferred == 'integer' and not isinstance(val, (int, float)):
-                    row_errors[col] = 'Expected number.'
-                elif inferred == 'string' and not isinstance(val, str):
-                    row_errors[col] = 'Expected string.'
-                elif inferred == 'datetime' and not pd.api.types.is_datetime64_any_dtype(type(val)):
-                    row_errors[col] = 'Expected date.'
-        if row_errors:
-            type_errors[idx] = row_errors
+    column_types = {col: _infer_dtype(df[col]) for col in df.columns}
+    type_errors = build_error_index(data_type_rule(df, column_types=column_types))
     return column_types, type_errors
 
 def validate_no_duplicates(df, unique_columns):
-    duplicate_errors = {}
-    if unique_columns:
-        dupes = df[df.duplicated(subset=unique_columns, keep=False)]
-        for idx in dupes.index:
-            duplicate_errors[idx] = {col: 'Duplicate value.' for col in unique_columns}
-    return duplicate_errors
+    return build_error_index(duplicate_rule(df, unique_columns=unique_columns))
 
 def merge_row_errors(*error_dicts):
     merged = []
@@ -51,23 +167,154 @@ def merge_row_errors(*error_dicts):
         merged.append(row_errors)
     return merged
 
-def validate_file(file_path, required_columns, unique_columns, selected_sheet=None):
-    if file_path.endswith('.csv'):
-        df = pd.read_csv(file_path)
-    elif file_path.endswith(('.xls', '.xlsx')):
-        df = pd.read_excel(file_path, sheet_name=selected_sheet)
-    else:
-        raise ValueError("Unsupported file format.")
+def validate_dataframe(df, required_columns, unique_columns, duplicate_rows=None):
+    """
+    Runs every registered rule over a DataFrame.
+    `duplicate_rows` can carry duplicates found out of core (see find_duplicate_rows).
+    Returns (column_types, {rule_name: {row: {column: message}}}).
+    """
+    with span('validate') as timing:
+        column_types = {col: _infer_dtype(df[col]) for col in df.columns}
+        rule_errors = run_rules(
+            df,
+            required_columns=required_columns,
+            unique_columns=unique_columns,
+            column_types=column_types,
+            duplicate_rows=duplicate_rows,
+        )
+        timing.add(rows=len(df))
+    return column_types, rule_errors
+
+class _TypeStats:
+    """
+    Running counts for one text column, gathered chunk by chunk so the checks
+    data_type_rule picks match those it would pick on the whole column.
+    """
 
-    df.fillna('', inplace=True)  # Optional: replace NaN with empty string for rendering
+    def __init__(self):
+        self.non_blank = 0
+        self.sample = []
+        self.sampled = 0
+        self.date_format = None
+        self.ok = {'number': 0, 'date': 0}
+        self.candidates = {'number', 'date'}
 
-    # Perform validations
-    missing_fields = validate_required_fields(df, required_columns)
-    column_types, type_errors = validate_data_types(df)
-    duplicate_errors = validate_no_duplicates(df, unique_columns)
+    def coercers(self):
+        # pandas infers the date format from the first value; fix it so every chunk uses it
+        return {'number': _to_numeric, 'date': functools.partial(_to_datetime, format=self.date_format)}
+
+    def add(self, values):
+        self.non_blank += len(values)
+        if self.sampled < TYPE_SAMPLE_SIZE:
+            if self.date_format is None:
+                self.date_format = guess_datetime_format(str(values.iloc[0])) or 'mixed'
+            self.sample.append(values.iloc[:TYPE_SAMPLE_SIZE - self.sampled])
+            self.sampled += len(self.sample[-1])
+            if self.sampled == TYPE_SAMPLE_SIZE:
+                self.candidates = self.passing_sample()
+        coercers = self.coercers()
+        for kind in self.candidates:
+            self.ok[kind] += int(coercers[kind](values).notna().sum())
+
+    def passing_sample(self):
+        sample = pd.concat(self.sample)
+        coercers = self.coercers()
+        return {kind for kind in self.candidates
+                if coercers[kind](sample).notna().mean() >= TYPE_MATCH_THRESHOLD}
+
+    def check(self, column_type):
+        """
+        Returns (coerce, message) for the check data_type_rule runs on this column, or None.
+        """
+        if not self.non_blank:
+            return None
+        candidates = self.passing_sample()
+        coercers = self.coercers()
+        if 'number' in candidates and self.ok['number'] / self.non_blank >= TYPE_MATCH_THRESHOLD:
+            return coercers['number'], 'Expected number.'
+        if column_type in ('integer', 'floating', 'mixed-integer-float'):
+            return None
+        if 'date' in candidates and self.ok['date'] / self.non_blank >= TYPE_MATCH_THRESHOLD:
+            return coercers['date'], 'Expected date.'
+        return None
+
+
+def check_column_types(chunks):
+    """
+    Infers the column types of a table arriving as DataFrame chunks and decides
+    which text columns data_type_rule checks as numbers or dates, as it would on
+    the whole table. Returns (column_types, type_checks) for run_rules.
+    """
+    kinds = {}
+    stats = {}
+    for chunk in chunks:
+        for col in chunk.columns:
+            series = chunk[col]
+            kinds.setdefault(col, set()).add(_infer_dtype(series))
+            if series.dtype != object:
+                continue
+            values = series[~_blank_mask(series)]
+            if not values.empty:
+                stats.setdefault(col, _TypeStats()).add(values)
+
+    column_types = {}
+    for col, col_kinds in kinds.items():
+        col_kinds = col_kinds - {'empty'}
+        column_types[col] = col_kinds.pop() if len(col_kinds) == 1 else ('mixed' if col_kinds else 'empty')
+    type_checks = {}
+    for col, col_stats in stats.items():
+        check = col_stats.check(column_types[col])
+        if check is not None:
+            type_checks[col] = check
+    return column_types, type_checks
+
+
+def validate_chunks(chunks, required_columns, unique_columns, duplicate_rows=None):
+    """
+    Streaming form of validate_dataframe, for tables too large to load whole.
+    `chunks` is a callable returning an iterator of DataFrames indexed by row number
+    (e.g. CsvStream.chunks); it is called twice, to settle the column types and then
+    to run the rules chunk by chunk. Duplicates are found out of core unless
+    `duplicate_rows` is given. Returns (column_types, rule_errors, row_count).
+    """
+    if unique_columns and duplicate_rows is None:
+        duplicate_rows = find_duplicate_rows(chunks, unique_columns)
+    with span('validate') as timing:
+        column_types, type_checks = check_column_types(chunks())
+        rule_errors = OrderedDict((name, {}) for name in RULES)
+        rows = 0
+        for chunk in chunks():
+            chunk_errors = run_rules(
+                chunk,
+                required_columns=required_columns,
+                unique_columns=unique_columns,
+                column_types=column_types,
+                type_checks=type_checks,
+                duplicate_rows=duplicate_rows,
+            )
+            for name, errors in chunk_errors.items():
+                rule_errors[name].update(errors)
+            rows += len(chunk)
+        timing.add(rows=rows)
+    return column_types, rule_errors, rows
+
+def validate_file(file_path, required_columns, unique_columns, selected_sheet=None, df=None):
+    # An already parsed DataFrame (e.g. from the dataset cache) skips reading the file
+    if df is None:
+        if file_path.endswith('.csv'):
+            df = read_csv(file_path)
+        elif file_path.endswith(('.xls', '.xlsx')):
+            df = pd.read_excel(file_path, sheet_name=selected_sheet)
+        else:
+            raise ValueError("Unsupported file format.")
+
+    # Perform validations; every registered rule runs column-wise over the whole frame
+    column_types, rule_errors = validate_dataframe(df, required_columns, unique_columns)
 
     # Merge all errors row-wise
-    errors = merge_row_errors(missing_fields, type_errors, duplicate_errors)
+    errors = merge_row_errors(*rule_errors.values())
+
+    df = fill_blanks(df)  # Optional: replace NaN with empty string for rendering
 
     # Build rows as list of dicts
     rows = df.to_dict(orient='records')
@@ -0,0 +1,208 @@
+import datetime
+import math
+
+import numpy as np
+import pandas as pd
+
+try:
+    # The strings pandas reads as missing values
+    from pandas._libs.parsers import STR_NA_VALUES
+except ImportError:
+    STR_NA_VALUES = {
+        '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+        '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+    }
+
+# Rows per DataFrame yielded by iter_xlsx_chunks
+XLSX_CHUNK_ROWS = 50000
+
+# Cell errors as openpyxl reports them in read-only, values-only mode
+_ERROR_CODES = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A'}
+_TRUE_VALUES = {'True', 'TRUE', 'true'}
+_FALSE_VALUES = {'False', 'FALSE', 'false'}
+
+
+def _cell(value):
+    """
+    Converts a cell value the way pandas' openpyxl reader does: whole floats become
+    ints and error cells become NaN. Empty cells are None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str):
+        if value == '':
+            return None
+        if value in _ERROR_CODES:
+            return math.nan
+    return value
+
+
+def _column_names(header, width):
+    """
+    Names the columns like read_excel: blank headers become 'Unnamed: <position>'
+    and repeated names get a '.1', '.2'... suffix.
+    """
+    names = [header[position] if position < len(header) else None for position in range(width)]
+    names = [f"Unnamed: {position}" if name is None else name for position, name in enumerate(names)]
+    # A suffixed name may not take a name that appears elsewhere in the header
+    taken = set(names)
+    used = set()
+    for position, name in enumerate(names):
+        if name in used:
+            count = 1
+            while f"{name}.{count}" in used or f"{name}.{count}" in taken:
+                count += 1
+            name = names[position] = f"{name}.{count}"
+        used.add(name)
+    return names
+
+
+def _column_array(values):
+    """
+    Types one column buffer as read_excel would: numbers (with blanks as NaN),
+    booleans, datetimes, or else objects with missing values as NaN.
+    """
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    missing = np.fromiter((value is None or (isinstance(value, str) and value in STR_NA_VALUES)
+                           for value in values), dtype=bool, count=len(values))
+    array[missing] = np.nan
+    if not len(array):
+        return array
+    try:
+        converted = pd.to_numeric(array)
+    except (ValueError, TypeError):
+        converted = array
+    if converted.dtype != object:
+        return converted
+
+    present = array[~missing]
+    if len(present) and all(value is True or value is False or value in _TRUE_VALUES or value in _FALSE_VALUES
+                            for value in present):
+        flags = np.fromiter((value is True or value in _TRUE_VALUES for value in present), dtype=bool)
+        if not missing.any():
+            return flags
+        # With blanks, booleans stay objects next to NaN
+        array[~missing] = flags
+        return array
+    if len(present) and all(isinstance(value, datetime.datetime) for value in present):
+        return pd.to_datetime(array).to_numpy()
+    return array
+
+
+def open_xlsx(file_path):
+    """
+    Opens a workbook in read-only mode, for reading several of its sheets with
+    XlsxRows without parsing its shared strings and styles again. Close it when done.
+    """
+    from openpyxl import load_workbook
+
+    return load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+
+
+class XlsxRows:
+    """
+    Reads one worksheet row by row from the sheet XML in read-only mode, collecting
+    cells into per-column buffers instead of building the workbook's object model.
+    Gives the same frame as pd.read_excel for the first sheet or `sheet_name`.
+    With `workbook` (from open_xlsx), that open workbook is read and left open.
+    """
+
+    def __init__(self, file_path, sheet_name=None, workbook=None):
+        self.file_path = file_path
+        self.sheet_name = sheet_name
+        self.workbook = workbook
+
+    def _rows(self):
+        workbook = self.workbook or open_xlsx(self.file_path)
+        try:
+            sheet = workbook[self.sheet_name] if self.sheet_name is not None else workbook.worksheets[0]
+            # The stored dimensions can be wrong; read every row that is there
+            sheet.reset_dimensions()
+            for row in sheet.iter_rows(values_only=True):
+                row = [_cell(value) for value in row]
+                while row and row[-1] is None:
+                    row.pop()
+                yield row
+        finally:
+            if workbook is not self.workbook:
+                workbook.close()
+
+    def chunks(self, chunk_size=XLSX_CHUNK_ROWS, nrows=None):
+        """
+        Yields the sheet as DataFrames of up to `chunk_size` rows, indexed by row
+        number; with `nrows`, stops after that many rows below the header. Columns
+        are typed per chunk, so a column may get different dtypes in different chunks.
+        Yields one (possibly empty) frame at least. A row wider than the rows before
+        it adds unnamed columns from its chunk on; earlier chunks lack them, so
+        pd.concat fills them with NaN there, as read_excel does.
+        """
+        rows = self._rows()
+        header = next(rows, [])
+        width = len(header)
+        buffers = [[] for _ in range(width)]
+        buffered = 0
+        blank_run = 0  # blank rows are kept as all-NaN rows, except at the end
+        offset = 0
+        read = 0
+        started = False
+
+        def flush():
+            nonlocal buffers, buffered, offset
+            if not width:
+                return pd.DataFrame()
+            frame = pd.DataFrame({position: _column_array(buffer) for position, buffer in enumerate(buffers)},
+                                 index=pd.RangeIndex(offset, offset + buffered))
+            frame.columns = _column_names(header, width)
+            offset += buffered
+            buffers = [[] for _ in range(width)]
+            buffered = 0
+            return frame
+
+        for row in rows:
+            if nrows is not None and read >= nrows:
+                break
+            read += 1
+            if not row:
+                blank_run += 1
+                continue
+            if len(row) > width:
+                # Rows wider than the header add unnamed columns, as read_excel does
+                buffers.extend([None] * buffered for _ in range(len(row) - width))
+                width = len(row)
+            # Blank rows count only once a later row shows they are not trailing
+            for row in [[]] * blank_run + [row]:
+                for position, buffer in enumerate(buffers):
+                    buffer.append(row[position] if position < len(row) else None)
+                buffered += 1
+                if buffered >= chunk_size:
+                    started = True
+                    yield flush()
+            blank_run = 0
+        if buffered or not started:
+            yield flush()
+
+    def read(self, nrows=None):
+        """
+        Returns the whole sheet, or its first `nrows` rows, as one DataFrame.
+        """
+        frames = list(self.chunks(chunk_size=math.inf, nrows=nrows))
+        return frames[0]
+
+
+def read_xlsx(file_path, sheet_name=None, nrows=None, workbook=None):
+    """
+    Reads a worksheet like pd.read_excel(file_path, sheet_name, nrows=nrows), streaming
+    the rows instead of building the full workbook first. Without `sheet_name`, the
+    first sheet is read. `workbook` is an already open workbook (see open_xlsx).
+    """
+    return XlsxRows(file_path, sheet_name, workbook).read(nrows=nrows)
+
+
+def iter_xlsx_chunks(file_path, sheet_name=None, chunk_size=XLSX_CHUNK_ROWS):
+    """
+    Yields a worksheet as DataFrames of up to `chunk_size` rows (see XlsxRows.chunks).
+    """
+    yield from XlsxRows(file_path, sheet_name).chunks(chunk_size)
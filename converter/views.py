@@ -1,5 +1,6 @@
+import io
 import os
-import pandas as pd
+import zipfile
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
@@ -8,61 +9,160 @@ from django.urls import reverse
 from django.template.loader import render_to_string
 
 from .forms import UploadFileForm
-from .models import UploadedFile
-from .utils.file_parser import parse_file, get_sheet_names, infer_column_types
-from .utils.validator import validate_file
-from .utils.script_generator import generate_sql_script, generate_orm_script, generate_json_script
+from .models import UploadedFile, ConversionJob, ValidationRun, UploadSession
+from .jobs import DOWNLOAD_PATH, QueueFull, enqueue_conversion
+from .offload import offload_stats, offloaded
+from .retention import schedule_retention
+from .uploads import OffsetMismatch, append_chunk, save_upload, start_upload
+from .utils.file_parser import parse_file, infer_column_types, fill_blanks
+from .utils.validator import validate_chunks, validate_dataframe
+from .utils.dataset_cache import dataset_key, load_dataset, get_dataset_cache
+from .utils.duplicates import file_key_chunks, find_duplicate_rows
+from .utils.row_window import FILTER_OPS, row_window
+from .utils.script_generator import OUTPUT_FORMATS, SQL_DIALECTS
+from .utils.streaming import sheet_stream, streaming_enabled
+from .utils.timing import metrics, span, timing_enabled
+
+# Only this much of a generated script is inlined into the result page
+SCRIPT_PREVIEW_CHARS = 20000
+
+# Rows read for the preview table; the rest of the file is never parsed for a preview.
+# The preview grid fetches further rows in pages of the same size as it scrolls.
+PREVIEW_ROWS = 50
+PREVIEW_MAX_PAGE_SIZE = 1000
+
+# Files above the threshold are sent by the upload page in resumable chunks of this size
+CHUNKED_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024
+
+# Validation results are served in pages of this many rows
+VALIDATION_PAGE_SIZE = 50
+VALIDATION_MAX_PAGE_SIZE = 500
+
+def _uploaded_file_response(request, uploaded_file, content_hash=None):
+    """
+    Records metadata for a freshly stored upload and tells the upload page what to
+    do next: show the sheet picker, go to the preview, or report an error.
+    """
+    file_path = uploaded_file.file.path
+    extension = os.path.splitext(file_path)[1].lower()
+    # New files are a good moment to check the storage quotas
+    schedule_retention()
+
+    if extension in ['.xls', '.xlsx', '.csv']:
+        # One read-only pass records the hash, sheet names and dimensions;
+        # a repeat of an earlier upload already has them
+        try:
+            with span('metadata'):
+                if not uploaded_file.sheets.exists():
+                    uploaded_file.record_metadata(content_hash=content_hash)
+        except Exception as e:
+            return JsonResponse({'error': f'Error reading file: {str(e)}'}, status=400)
+
+    if extension in ['.xls', '.xlsx']:
+        # Get the sheet names recorded for the uploaded file
+        sheet_names = uploaded_file.sheet_names()
+        base_name = os.path.basename(uploaded_file.file.name).rsplit('_', 1)[0]
+
+        # If there are multiple sheets, return modal HTML with sheet options
+        if len(sheet_names) > 1:
+            modal_html = render_to_string('converter/select_sheet_modal.html', {
+                'file': uploaded_file,
+                'base_name': base_name,
+                'sheets': sheet_names
+            }, request=request)
+
+            return JsonResponse({
+                'show_modal': True,
+                'modal_html': modal_html
+            })
 
-DOWNLOAD_PATH = os.path.join(settings.BASE_DIR, 'converter', 'downloads')
+        # If there's only one sheet, we can directly proceed to the preview
+        else:
+            # Process the file with the sheet selected
+            uploaded_file.sheet_name = sheet_names[0] if sheet_names else None
+            uploaded_file.save(update_fields=["sheet_name"])
+            return JsonResponse({
+                'redirect_url': reverse('preview_file', kwargs={'file_id': uploaded_file.id})
+            })
+    elif extension == '.csv':
+        try:
+            # A bounded read is enough to reject files that are not valid CSV
+            if parse_file(file_path, nrows=PREVIEW_ROWS, **uploaded_file.parse_options()) is None:
+                raise ValueError("Unable to parse file")
+            return JsonResponse({
+                'redirect_url': reverse('preview_file', kwargs={'file_id': uploaded_file.id})
+            })
+        except Exception as e:
+            return JsonResponse({'error': f'Error reading CSV: {str(e)}'}, status=400)
 
+    return JsonResponse({'error': 'Unsupported file format'}, status=400)
+
+@offloaded('heavy', json=True)
 def upload_file(request):
     if request.method == 'POST':
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
-            uploaded_file = form.save()
-            file_path = uploaded_file.file.path
-            extension = os.path.splitext(file_path)[1].lower()
-
-            if extension in ['.xls', '.xlsx']:
-                # Get the sheet names from the uploaded file
-                sheet_names = get_sheet_names(file_path)
-                base_name = os.path.basename(uploaded_file.file.name).rsplit('_', 1)[0]
-
-                # If there are multiple sheets, return modal HTML with sheet options
-                if len(sheet_names) > 1:
-                    modal_html = render_to_string('converter/select_sheet_modal.html', {
-                        'file': uploaded_file,
-                        'base_name': base_name,
-                        'sheets': sheet_names
-                    }, request=request)
-
-                    return JsonResponse({
-                        'show_modal': True,
-                        'modal_html': modal_html
-                    })
-
-                # If there's only one sheet, we can directly proceed to the preview
-                else:
-                    # Process the file with the sheet selected
-                    sheet_name = sheet_names[0]
-                    return JsonResponse({
-                        'redirect_url': reverse('preview_file', kwargs={'file_id': uploaded_file.id, 'sheet_name': sheet_name})
-                    })
-            elif extension == '.csv':
-                try:
-                    df = pd.read_csv(file_path)
-                    return JsonResponse({
-                        'redirect_url': reverse('preview_file', kwargs={'file_id': uploaded_file.id})
-                    })
-                except Exception as e:
-                    return JsonResponse({'error': f'Error reading CSV: {str(e)}'}, status=400)
-
-            return JsonResponse({'error': 'Unsupported file format'}, status=400)
+            uploaded_file = save_upload(form.cleaned_data['file'])
+            return _uploaded_file_response(request, uploaded_file, content_hash=uploaded_file.content_hash)
 
         return JsonResponse({'error': 'Invalid form submission'}, status=400)
 
     # Fallback for GET request or if something went wrong
-    return render(request, 'converter/upload.html', {'form': UploadFileForm()})
+    return render(request, 'converter/upload.html', {
+        'form': UploadFileForm(),
+        'chunk_size': CHUNKED_UPLOAD_CHUNK_SIZE,
+        'chunked_threshold': CHUNKED_UPLOAD_THRESHOLD,
+    })
+
+def start_chunked_upload(request):
+    """
+    Starts a resumable upload. Expects `filename` and `size` (in bytes) as POST fields.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        session = start_upload(request.POST.get('filename', ''), int(request.POST.get('size', 0)))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'upload_id': str(session.id),
+        'offset': 0,
+        'upload_url': reverse('chunked_upload', kwargs={'upload_id': session.id}),
+        'chunk_size': CHUNKED_UPLOAD_CHUNK_SIZE,
+    })
+
+@offloaded('heavy', json=True)
+def chunked_upload(request, upload_id):
+    """
+    GET reports how many bytes have been stored, so a client can resume from there.
+    POST appends the raw request body at the offset given in the X-Upload-Offset header.
+    """
+    session = get_object_or_404(UploadSession, id=upload_id)
+    if request.method == 'POST':
+        try:
+            offset = int(request.headers.get('X-Upload-Offset', ''))
+        except ValueError:
+            return JsonResponse({'error': 'X-Upload-Offset header is required'}, status=400)
+        try:
+            # The body is streamed to disk block by block, never buffered whole
+            with span('upload_chunk') as timing:
+                before = session.received_bytes
+                session = append_chunk(session.id, offset, request)
+                timing.add(nbytes=session.received_bytes - before)
+        except OffsetMismatch as e:
+            return JsonResponse({'error': str(e), 'offset': e.expected}, status=409)
+
+        if session.is_complete and session.uploaded_file:
+            return _uploaded_file_response(request, session.uploaded_file,
+                                           content_hash=session.uploaded_file.content_hash)
+
+    return JsonResponse({
+        'upload_id': str(session.id),
+        'offset': session.received_bytes,
+        'size': session.total_size,
+        'complete': session.is_complete,
+    })
 
 
 # Select sheet and parse the selected sheet for preview
@@ -78,12 +178,17 @@ def select_sheet(request, file_id):
         sheet_name = request.POST.get('sheet_name')
         if not sheet_name:
             return HttpResponse("No sheet selected", status=400)
+        if sheet_name not in uploaded_file.sheet_names():
+            return HttpResponse("Unknown sheet", status=400)
 
         try:
-            # Parse the selected sheet using pandas
-            excel_file = pd.ExcelFile(file_path)
-            df = excel_file.parse(sheet_name)
-            
+            # Check the selected sheet with a bounded read before previewing it
+            if parse_file(file_path, sheet_name=sheet_name, nrows=PREVIEW_ROWS,
+                          **uploaded_file.parse_options()) is None:
+                raise ValueError("Unable to parse sheet")
+            uploaded_file.sheet_name = sheet_name
+            uploaded_file.save(update_fields=["sheet_name"])
+
             return JsonResponse({
                 'redirect_url': reverse('preview_file', kwargs={'file_id': uploaded_file.id})
             })
@@ -92,7 +197,7 @@ def select_sheet(request, file_id):
 
     else:
         # Handle sheet names in GET request (for rendering modal or page)
-        sheet_names = get_sheet_names(file_path)
+        sheet_names = uploaded_file.sheet_names()
 
         context = {
             'file': uploaded_file,
@@ -101,21 +206,42 @@ def select_sheet(request, file_id):
         }
         return render(request, 'converter/select_sheet_modal.html', context)
 
+def _earlier_uploads(uploaded, limit=50):
+    """
+    Lists recent uploads with other content, newest first, one per content, as
+    candidates to generate a changes-only script against.
+    """
+    seen = {uploaded.content_hash}
+    earlier = []
+    for candidate in UploadedFile.objects.exclude(id=uploaded.id).order_by('-uploaded_at')[:limit * 4]:
+        if candidate.content_hash in seen:
+            continue
+        seen.add(candidate.content_hash)
+        earlier.append(candidate)
+        if len(earlier) == limit:
+            break
+    return earlier
+
+@offloaded('preview')
 def preview_file(request, file_id):
     uploaded = get_object_or_404(UploadedFile, id=file_id)
+    uploaded.touch()
     file_path = uploaded.file.path
     selected_sheet = request.GET.get('sheet') or uploaded.sheet_name
     trim = request.GET.get('trim') == 'on'
     preview_data = []
     sheet_names = []
     column_types = {}
+    total_rows = None
 
     try:
-        sheet_names = get_sheet_names(file_path)
+        sheet_names = uploaded.sheet_names()
         if sheet_names and not selected_sheet:
             selected_sheet = sheet_names[0]
 
-        df = parse_file(file_path, sheet_name=selected_sheet, trim_whitespace=trim)
+        # Only the first rows are parsed; column types are inferred from that sample
+        df = parse_file(file_path, sheet_name=selected_sheet, trim_whitespace=trim, nrows=PREVIEW_ROWS,
+                        **uploaded.parse_options())
         if df is None:
             raise ValueError("Unable to parse file")
 
@@ -123,28 +249,106 @@ def preview_file(request, file_id):
         uploaded.save(update_fields=["sheet_name"])
 
         column_types = infer_column_types(df)
-        preview_data = df.head(50).to_dict(orient='records')
+        preview_data = fill_blanks(df).astype(str).values.tolist()
         columns = df.columns.tolist()
+        sheet = uploaded.get_sheet(selected_sheet)
+        total_rows = sheet.row_count if sheet else None
 
     except Exception as e:
         return render(request, 'converter/preview.html', {
             'error': str(e), 'file': uploaded
         })
 
-    return render(request, 'converter/preview.html', {
+    with span('render'):
+        return render(request, 'converter/preview.html', {
+            'columns': columns,
+            'rows': preview_data,
+            'file': uploaded,
+            'sheet_names': sheet_names,
+            'selected_sheet': selected_sheet,
+            'trim': trim,
+            'column_types': column_types,
+            'total_rows': total_rows,
+            'sheet': sheet,
+            'grid_config': {
+                'sheet': selected_sheet or '',
+                'trim': trim,
+                'page_size': PREVIEW_ROWS,
+                'total': total_rows,
+                'columns': columns,
+                'rows': preview_data,
+            },
+            'filter_ops': FILTER_OPS,
+            'output_formats': OUTPUT_FORMATS,
+            'format_defaults': {key: spec['defaults'] for key, spec in OUTPUT_FORMATS.items()},
+            'sql_dialects': SQL_DIALECTS,
+            'earlier_uploads': _earlier_uploads(uploaded),
+        })
+
+@offloaded('preview', json=True)
+def preview_rows(request, file_id):
+    """
+    Returns one window of a sheet's rows as JSON, for the scrolling preview grid.
+    Query parameters: sheet, trim=on, offset, limit, sort (a column) with desc=1,
+    and filter_column, filter_op and filter_value for a single-column filter.
+    """
+    uploaded = get_object_or_404(UploadedFile, id=file_id)
+    uploaded.touch()
+    selected_sheet = request.GET.get('sheet') or uploaded.sheet_name or None
+    trim = request.GET.get('trim') == 'on'
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', PREVIEW_ROWS)), 1), PREVIEW_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'offset and limit must be integers'}, status=400)
+    sort = request.GET.get('sort') or None
+    descending = request.GET.get('desc') in ('1', 'true', 'on')
+    row_filter = None
+    if request.GET.get('filter_column'):
+        op = request.GET.get('filter_op', 'contains')
+        if op not in FILTER_OPS:
+            return JsonResponse({'error': f'Unknown filter operator: {op}'}, status=400)
+        row_filter = (request.GET['filter_column'], op, request.GET.get('filter_value', ''))
+
+    sheet = uploaded.get_sheet(selected_sheet)
+    stream = sheet_stream(uploaded, sheet, trim_whitespace=trim) if streaming_enabled(uploaded, sheet) else None
+    if stream is not None:
+        # Large CSV files are never loaded whole, so they can only be browsed in file order
+        if sort or row_filter:
+            return JsonResponse({'error': 'Sorting and filtering are not available for files this large.'},
+                                status=400)
+        window = stream.read_rows(range(offset, min(offset + limit, stream.rows)))
+        columns, total = list(window.columns), stream.rows
+    else:
+        df = load_dataset(uploaded, sheet_name=selected_sheet, trim_whitespace=trim)
+        if df is None:
+            return JsonResponse({'error': 'Unable to parse file'}, status=500)
+        unknown = [col for col in (sort, row_filter and row_filter[0]) if col and col not in df.columns]
+        if unknown:
+            return JsonResponse({'error': f'Unknown column: {unknown[0]}'}, status=400)
+        try:
+            window, total = row_window(df, dataset_key(uploaded, selected_sheet, trim), offset, limit,
+                                       sort=sort, descending=descending, row_filter=row_filter)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        columns = list(df.columns)
+
+    return JsonResponse({
+        'offset': offset,
+        'limit': limit,
+        'total': total,
         'columns': columns,
-        'rows': preview_data,
-        'file': uploaded,
-        'sheet_names': sheet_names,
-        'selected_sheet': selected_sheet,
-        'trim': trim,
-        'column_types': column_types
+        'rows': [
+            {'row': row, 'values': values}
+            for row, values in zip(window.index.tolist(), fill_blanks(window).astype(str).values.tolist())
+        ],
     })
 
+@offloaded('heavy')
 def validate_file_view(request, file_id):
     # Get the uploaded file object using the file_id
     uploaded = get_object_or_404(UploadedFile, id=file_id)
-    file_path = uploaded.file.path
+    uploaded.touch()
     selected_sheet = uploaded.sheet_name or None
 
     # Get the required and unique columns from the POST request
@@ -152,86 +356,249 @@ def validate_file_view(request, file_id):
     unique_columns = request.POST.getlist('unique_columns')
 
     try:
-        # Call the validate_file function from validator.py to validate the file
-        errors = validate_file(file_path, required_columns, unique_columns, selected_sheet)
-
-        # If errors are found, render the validation result with the errors
-        return render(request, 'converter/validation_result.html', {
-            'rows': errors['rows'],
-            'errors': errors['errors'],
-            'columns': errors['columns'],
-            'column_types': errors['column_types'],
-            'file': uploaded,
-        })
+        # CSV files too large to load are validated chunk by chunk
+        sheet = uploaded.get_sheet(selected_sheet)
+        stream = sheet_stream(uploaded, sheet, trim_whitespace=False) if streaming_enabled(uploaded, sheet) else None
+
+        # Uniqueness on large sheets is checked from the key columns in the file, out of core
+        duplicate_rows = None
+        if unique_columns and sheet and (sheet.row_count or 0) > getattr(settings, 'CONVERTER_OUT_OF_CORE_ROWS', 1000000):
+            duplicate_rows = find_duplicate_rows(
+                file_key_chunks(uploaded.file.path, unique_columns, selected_sheet, stream=stream,
+                                **uploaded.parse_options()),
+                unique_columns,
+                memory_rows=getattr(settings, 'CONVERTER_DUPLICATE_MEMORY_ROWS', 5000000),
+            )
+
+        # Validate column-wise and persist only the failing cells; rows are served in pages
+        if stream is not None:
+            column_types, rule_errors, row_count = validate_chunks(
+                stream.chunks, required_columns, unique_columns, duplicate_rows,
+            )
+            columns = stream.header
+        else:
+            df = load_dataset(uploaded, sheet_name=selected_sheet)
+            if df is None:
+                raise ValueError("Unable to parse file")
+            column_types, rule_errors = validate_dataframe(df, required_columns, unique_columns, duplicate_rows)
+            columns, row_count = df.columns, len(df)
+        run = ValidationRun.record(
+            uploaded, selected_sheet, required_columns, unique_columns,
+            columns, column_types, row_count, rule_errors,
+        )
 
     except Exception as e:
         # In case of any exception (e.g., file parsing errors), show an error message
         return render(request, 'converter/validation_result.html', {
             'error': str(e),
             'file': uploaded,
-            'rows': [],
-            'errors': [],
             'columns': [],
             'column_types': {},
+            'output_formats': OUTPUT_FORMATS,
+        })
+
+    return redirect('validation_run', run_id=run.id)
+
+def validation_run(request, run_id):
+    run = get_object_or_404(ValidationRun, id=run_id)
+    with span('render'):
+        return render(request, 'converter/validation_result.html', {
+            'run': run,
+            'file': run.uploaded_file,
+            'columns': run.columns,
+            'column_types': run.column_types,
+            'column_error_counts': [(col, run.column_error_counts.get(col, 0)) for col in run.columns],
+            'page_size': VALIDATION_PAGE_SIZE,
+            'output_formats': OUTPUT_FORMATS,
         })
 
+def validation_rows(request, run_id):
+    """
+    Returns one window of validated rows with their errors, as JSON.
+    Query parameters: offset, limit and errors_only=1 to list failing rows only.
+    """
+    run = get_object_or_404(ValidationRun, id=run_id)
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', VALIDATION_PAGE_SIZE)), 1), VALIDATION_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'offset and limit must be integers'}, status=400)
+    errors_only = request.GET.get('errors_only') in ('1', 'true', 'on')
+
+    if errors_only:
+        total = run.error_row_count
+        row_ids = list(
+            run.issues.order_by('row').values_list('row', flat=True).distinct()[offset:offset + limit]
+        )
+    else:
+        total = run.row_count
+        row_ids = list(range(offset, min(offset + limit, total)))
+
+    row_errors = {}
+    for row, column, message in run.issues.filter(row__in=row_ids).values_list('row', 'column', 'message'):
+        row_errors.setdefault(row, {}).setdefault(column, []).append(message)
+
+    values = []
+    if row_ids:
+        uploaded = run.uploaded_file
+        # Large CSV files are never loaded whole; only the requested rows are read
+        stream = sheet_stream(uploaded, trim_whitespace=False) if streaming_enabled(uploaded) else None
+        if stream is not None:
+            window = stream.read_rows(row_ids)
+        else:
+            df = load_dataset(uploaded, sheet_name=run.sheet_name)
+            if df is None:
+                return JsonResponse({'error': 'Unable to parse file'}, status=500)
+            window = df.iloc[row_ids]
+        values = fill_blanks(window).astype(str).values.tolist()
+
+    return JsonResponse({
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'errors_only': errors_only,
+        'columns': run.columns,
+        'column_error_counts': run.column_error_counts,
+        'rows': [
+            {'row': row, 'values': row_values, 'errors': row_errors.get(row, {})}
+            for row, row_values in zip(row_ids, values)
+        ],
+    })
+
+def _script_options(request):
+    """
+    Reads the optional output settings from the export form. Forms without the
+    options fieldset leave every setting at the chosen format's default.
+    """
+    if 'script_options' not in request.POST:
+        return {}
+    options = {
+        name: request.POST.get(name) == 'on'
+        for name in ('column_list', 'transaction', 'atomic')
+    }
+    dialect = request.POST.get('dialect')
+    if dialect:
+        if dialect not in dict(SQL_DIALECTS):
+            raise ValueError(f"Unknown SQL dialect: {dialect}")
+        options['dialect'] = dialect
+    batch_size = request.POST.get('batch_size')
+    if batch_size:
+        options['batch_size'] = max(int(batch_size), 1)
+    return options
+
+@offloaded('heavy')
 def generate_script(request, file_id):
     # Get the uploaded file object using the file_id
     uploaded = get_object_or_404(UploadedFile, id=file_id)
-    file_path = uploaded.file.path
+    uploaded.touch()
     selected_sheet = uploaded.sheet_name or None
     output_format = request.POST.get('format', 'sql')
     table_or_model_name = request.POST.get('table_name')
 
-    # Ensure the download path exists
-    if not os.path.exists(DOWNLOAD_PATH):
-        os.makedirs(DOWNLOAD_PATH)
-
-    # Parse the file (implement your parse_file function)
-    df = parse_file(file_path, sheet_name=selected_sheet, trim_whitespace=True)
-    if df is None:
-        return HttpResponse("Failed to parse file.", status=400)
-
-    # Initialize the script variable and output format extension
-    script = ""
-    extension = output_format
-
-    # Generate the script based on the selected format
-    if output_format == 'sql':
-        if not table_or_model_name:
-            table_or_model_name = 'your_table_name'
-        script = generate_sql_script(df, table_or_model_name)
-
-    elif output_format == 'orm':
-        if not table_or_model_name:
-            table_or_model_name = 'YourModel'
-        script = generate_orm_script(df, table_or_model_name)
-
-    elif output_format == 'json':
-        script = generate_json_script(df)
-
-    # Save the generated script to a file
-    filename = f"migration_output_{file_id}.{extension}"
-    file_save_path = os.path.join(DOWNLOAD_PATH, filename)
-    with open(file_save_path, 'w', encoding='utf-8') as f:
-        f.write(script)
+    if output_format not in OUTPUT_FORMATS:
+        return HttpResponse("Unsupported output format.", status=400)
+    try:
+        options = _script_options(request)
+    except ValueError:
+        return HttpResponse("Invalid script options.", status=400)
+
+    # All-sheets mode takes one optional table/model name per sheet, in sheet order
+    all_sheets = request.POST.get('all_sheets') == 'on'
+    sheet_tables = {}
+    if all_sheets:
+        sheet_tables = dict(zip(uploaded.sheet_names(), request.POST.getlist('sheet_table')))
+
+    # Changes-only mode compares with an earlier upload, matching rows on the key columns
+    base_file = None
+    if request.POST.get('base_file'):
+        try:
+            base_file_id = int(request.POST['base_file'])
+        except ValueError:
+            return HttpResponse("Invalid earlier upload.", status=400)
+        base_file = get_object_or_404(UploadedFile, id=base_file_id)
+        base_file.touch()
 
-    # Render the result in a template and provide the download link
+    # The conversion itself runs in the background; the result page polls its progress
+    try:
+        job = enqueue_conversion(uploaded, output_format, table_or_model_name, selected_sheet, options,
+                                 all_sheets=all_sheets, sheet_tables=sheet_tables,
+                                 base_file=base_file, key_columns=request.POST.getlist('key_columns'))
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    except QueueFull:
+        response = HttpResponse("Too many conversions are queued. Please try again shortly.", status=503)
+        response['Retry-After'] = '30'
+        return response
+    schedule_retention()
+
+    return redirect('conversion_job', job_id=job.id)
+
+def conversion_job(request, job_id):
+    job = get_object_or_404(ConversionJob, id=job_id)
     return render(request, 'converter/generated_script.html', {
-        'script': script,
-        'format': output_format,
-        'download_url': f"/converter/download/{filename}",
-        'file': uploaded,
-        'table_name_used': table_or_model_name,
+        'job': job,
+        'format': job.output_format,
+        'file': job.uploaded_file,
+        'table_name_used': job.table_name,
     })
 
+def conversion_job_status(request, job_id):
+    job = get_object_or_404(ConversionJob, id=job_id)
+    data = {
+        'status': job.status,
+        'rows_processed': job.rows_processed,
+        'rows_total': job.rows_total,
+        'eta_seconds': job.eta_seconds(),
+        'error': job.error,
+    }
+    if job.status == ConversionJob.STATUS_DONE:
+        job.touch()
+        # Only the beginning of the script is sent back for the on-page preview
+        file_path = os.path.join(DOWNLOAD_PATH, job.output_filename)
+        if job.all_sheets:
+            # Bundles list their entries and preview the first one
+            with zipfile.ZipFile(file_path) as bundle:
+                entries = bundle.infolist()
+                data['files'] = [{'name': entry.filename, 'size': entry.file_size} for entry in entries]
+                preview = ''
+                if entries:
+                    with io.TextIOWrapper(bundle.open(entries[0]), encoding='utf-8') as f:
+                        preview = f.read(SCRIPT_PREVIEW_CHARS)
+                truncated = len(entries) > 1 or (
+                    bool(entries) and entries[0].file_size > len(preview.encode('utf-8')))
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                preview = f.read(SCRIPT_PREVIEW_CHARS)
+            truncated = os.path.getsize(file_path) > len(preview.encode('utf-8'))
+        data.update({
+            'download_url': reverse('download_script', kwargs={'filename': job.output_filename}),
+            'preview': preview,
+            'truncated': truncated,
+        })
+    return JsonResponse(data)
+
 def download_script(request, filename):
     file_path = os.path.join(DOWNLOAD_PATH, filename)
     if not os.path.exists(file_path):
         return HttpResponse("File not found.", status=404)
+    job = ConversionJob.objects.filter(output_filename=filename).order_by('-id').first()
+    if job is not None:
+        job.touch()
     try:
-        with open(file_path, 'rb') as f:
-            response = FileResponse(f, as_attachment=True, filename=filename)
-            return response
+        # FileResponse streams the file in blocks and closes it when done
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=filename)
     except Exception as e:
-        raise Http404(f"Error opening file: {e}")
\ No newline at end of file
+        raise Http404(f"Error opening file: {e}")
+
+
+def dataset_cache_stats(request):
+    return JsonResponse(get_dataset_cache().stats())
+
+def timing_metrics(request):
+    """
+    Returns request counts and per-stage latency histograms for this process, as JSON.
+    """
+    data = metrics.snapshot()
+    data['enabled'] = timing_enabled()
+    data['offload'] = offload_stats()
+    return JsonResponse(data)
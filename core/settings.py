@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'converter.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -126,3 +128,93 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Parsed dataset cache: in-process LRU bounded by DataFrame memory size,
+# backed by on-disk snapshots so a spreadsheet is parsed once per upload.
+DATASET_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DATASET_CACHE_DIR = BASE_DIR / 'converter' / 'cache'
+
+# Background conversion jobs: worker threads in the local pool, and how many
+# jobs may be queued or running before new submissions are refused.
+CONVERTER_JOB_WORKERS = 2
+CONVERTER_JOB_QUEUE_DEPTH = 20
+
+# Each process marks the jobs it owns as alive every CONVERTER_JOB_HEARTBEAT
+# seconds. Queued or running jobs without a heartbeat for CONVERTER_JOB_STALE_AFTER
+# seconds were left behind by a stopped process and are failed (see
+# `python manage.py recover_jobs`, to run at startup).
+CONVERTER_JOB_HEARTBEAT = 30
+CONVERTER_JOB_STALE_AFTER = 120
+
+# Script generation splits large inputs into row partitions formatted in a
+# process pool. Inputs below CONVERTER_PARALLEL_MIN_ROWS stay on the serial path.
+CONVERTER_GENERATION_WORKERS = min(4, os.cpu_count() or 1)
+CONVERTER_PARTITION_ROWS = 10000
+CONVERTER_PARALLEL_MIN_ROWS = 50000
+
+# CSV ingestion: 'auto' uses pandas' multithreaded pyarrow engine when pyarrow is
+# installed, 'c' forces the C engine. Fully loaded datasets have their integers
+# downcast and low-cardinality text stored as categoricals.
+CONVERTER_CSV_ENGINE = 'auto'
+CONVERTER_OPTIMIZE_DTYPES = True
+
+# .xlsx sheets: 'stream' reads the rows straight from the sheet XML into column
+# buffers, typed as pd.read_excel would; 'pandas' uses pd.read_excel instead.
+CONVERTER_XLSX_READER = 'stream'
+
+# Uniqueness checks on sheets above CONVERTER_OUT_OF_CORE_ROWS hash the key columns
+# read from the file; hashes beyond CONVERTER_DUPLICATE_MEMORY_ROWS spill to disk.
+CONVERTER_OUT_OF_CORE_ROWS = 1000000
+CONVERTER_DUPLICATE_MEMORY_ROWS = 5000000
+
+# CSV files above CONVERTER_STREAMING_ROWS rows are never loaded whole: conversion
+# and validation read them in chunks, keeping memory flat whatever the file size.
+CONVERTER_STREAMING_ROWS = 1000000
+
+# Storage retention for uploads (MEDIA_ROOT/uploads), generated scripts
+# (converter/downloads) and dataset snapshots (DATASET_CACHE_DIR): files not
+# accessed for the TTL are removed, then the least recently used until each area
+# fits its quota. None disables a limit. A pass runs in the background at most
+# every CONVERTER_RETENTION_INTERVAL seconds (0 = only through `manage.py clean_storage`).
+CONVERTER_UPLOADS_MAX_BYTES = 10 * 1024 * 1024 * 1024
+CONVERTER_UPLOADS_TTL_DAYS = 30
+CONVERTER_DOWNLOADS_MAX_BYTES = 5 * 1024 * 1024 * 1024
+CONVERTER_DOWNLOADS_TTL_DAYS = 7
+CONVERTER_SNAPSHOTS_MAX_BYTES = 2 * 1024 * 1024 * 1024
+CONVERTER_SNAPSHOTS_TTL_DAYS = 7
+CONVERTER_RETENTION_INTERVAL = 3600
+
+# Uploads, previews, validations and script submissions run as async views whose
+# pandas work goes to bounded thread pools: one lane for previews, one for the
+# heavy views. Each lane queues up to CONVERTER_OFFLOAD_QUEUE_DEPTH requests per
+# worker, and one client may have CONVERTER_CLIENT_CONCURRENCY in progress per lane;
+# beyond that requests get a 429 with Retry-After.
+CONVERTER_PREVIEW_WORKERS = 4
+CONVERTER_HEAVY_WORKERS = 2
+CONVERTER_OFFLOAD_QUEUE_DEPTH = 4
+CONVERTER_CLIENT_CONCURRENCY = 2
+CONVERTER_OFFLOAD_RETRY_AFTER = 5
+
+# Addresses of the reverse proxies in front of the app. Requests from them are
+# counted against the client named in X-Forwarded-For instead of the proxy.
+CONVERTER_TRUSTED_PROXIES = []
+
+# Stage timing: spans around parsing, validation, generation and rendering feed
+# the Server-Timing header, the /metrics/ endpoint and the converter.timing log.
+# When off, the middleware unloads itself and spans are no-ops.
+CONVERTER_TIMING_ENABLED = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'converter.timing': {
+            'handlers': ['console'],
+            'level': os.environ.get('CONVERTER_TIMING_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}